@@ -37,6 +37,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "restaurant.middleware.QueryMetricsMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -178,23 +179,64 @@ CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 
 CELERY_BEAT_SCHEDULE = {
-    "restaurant.tasks.find_active_bookings": {
-        "task": "restaurant.tasks.find_active_bookings",
-        "schedule": timedelta(minutes=1),  # Run every day at 00:00
-    }
+    "restaurant.tasks.release_expired_holds": {
+        "task": "restaurant.tasks.release_expired_holds",
+        "schedule": timedelta(minutes=5),
+    },
+    "restaurant.tasks.relay_mail": {
+        "task": "restaurant.tasks.relay_mail",
+        "schedule": timedelta(minutes=1),
+    },
+    # напоминания, для которых не поставлена отложенная задача (в том числе перенесенные миграцией)
+    "restaurant.tasks.reconcile_reminders": {
+        "task": "restaurant.tasks.reconcile_reminders",
+        "schedule": timedelta(minutes=10),
+    },
 }
 # CELERY_BEAT_SCHEDULE = "django_celery_beat.schedulers:DatabaseScheduler"
 
 TELEGRAM_URL = os.getenv("TELEGRAM_URL")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# таймауты (соединение, чтение) в секундах и лимиты отправки: сообщений в секунду на бота и в один чат
+TELEGRAM_TIMEOUT = (3.05, float(os.getenv("TELEGRAM_TIMEOUT", 10)))
+TELEGRAM_RATE = int(os.getenv("TELEGRAM_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+# сколько запросов одновременно держит асинхронная пакетная отправка напоминаний
+TELEGRAM_CONCURRENCY = int(os.getenv("TELEGRAM_CONCURRENCY", 50))
+
+# бюджет SQL-запросов на один запрос к представлению, включая сессию и пользователя
+# (restaurant.middleware.QueryMetricsMiddleware):
+# превышение пишется в лог, а в тестах (QUERY_BUDGET_STRICT, включает TEST_RUNNER) роняет тест
+QUERY_BUDGETS = {
+    "restaurant:main": 5,
+    "restaurant:about_us": 5,
+    "restaurant:booking_list": 4,
+    # POST: бронирование, токен, письмо в очереди и пересчет маски занятости столика
+    # (2 запроса и блокировка (столик, сутки) в PostgreSQL)
+    "restaurant:booking_create": 16,
+    "restaurant:booking_update": 16,
+    # сессия и пользователь (его смещение часового пояса задает "сейчас") и 3 запроса свободных промежутков
+    "restaurant:free_slots": 5,
+    "restaurant:question_list": 4,
+    "users:user_detail": 5,
+    "users:profile": 3,
+}
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT") == "True"
+TEST_RUNNER = "config.test_runner.QueryBudgetTestRunner"
 
 CACHE_ENABLED = os.getenv("CACHE_ENABLED") == "True"
 
 if CACHE_ENABLED:
     CACHES = {
         "default": {
-            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "BACKEND": "restaurant.utils.metrics.InstrumentedRedisCache",
             "LOCATION": os.getenv("LOCATION"),
             "TIMEOUT": 300  # Ручная регулировка времени жизни кеша в секундах, по умолчанию 300
         }
     }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "restaurant.utils.metrics.InstrumentedLocMemCache",
+        }
+    }
@@ -0,0 +1,16 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """manage.py test: превышение бюджета SQL-запросов (QUERY_BUDGETS) роняет тест; при запуске другим
+    раннером (pytest-django) строгий режим включается переменной окружения QUERY_BUDGET_STRICT=True"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.strict_budget = override_settings(QUERY_BUDGET_STRICT=True)
+        self.strict_budget.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.strict_budget.disable()
+        super().teardown_test_environment(**kwargs)
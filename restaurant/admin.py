@@ -1,6 +1,6 @@
 from django.contrib import admin
 from restaurant.models import Table, Booking, ContentText, ContentImage, ContentParameters, Contentlink, Questions, \
-    Review
+    Review, NotificationOutbox, MailOutbox
 
 
 @admin.register(Table)
@@ -13,11 +13,25 @@ class TableAdmin(admin.ModelAdmin):
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = ("user", "table", "places", "notification", "date_field", "time_start", "time_end", "active",
-                    "created_at")
+                    "is_pending", "created_at")
     list_filter = ("user", "table", "date_field", "time_start")
     search_fields = ("user", "table")
 
 
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ("booking", "due_at", "status", "attempts", "available_at", "sent_at", "last_error", )
+    list_filter = ("status", "due_at", )
+    search_fields = ("booking__user__email", )
+
+
+@admin.register(MailOutbox)
+class MailOutboxAdmin(admin.ModelAdmin):
+    list_display = ("subject", "recipient_list", "status", "attempts", "available_at", "sent_at", "last_error", )
+    list_filter = ("status", "created_at", )
+    search_fields = ("subject", "recipient_list", )
+
+
 @admin.register(ContentImage)
 class ContentImageAdmin(admin.ModelAdmin):
     list_display = ("title", "description", "image",)
@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta, timezone
+
+from django.db.models import Q, Exists, OuterRef
+
+from restaurant.availability.index import DayIndex, Interval
+from restaurant.availability.occupancy import classify_tables, refresh_occupancy, table_days
+from restaurant.models import Booking, BookingToken, Table
+from restaurant.templates.restaurant.services import get_cached_day_bookings
+
+
+def as_wall_clock(value: datetime) -> datetime:
+    # starts_at/ends_at хранят "настенное" время ресторана в UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def get_reserved_bookings(time_border, queryset=None):
+    # бронирования, занимающие столик: подтвержденные или ожидающие подтверждения,
+    # у которых токен создан позже time_border (время на подтверждение не истекло)
+    if queryset is None:
+        queryset = Booking.objects.all()
+
+    pending = Exists(BookingToken.objects.filter(booking=OuterRef("pk"), created_at__gt=time_border))
+    return queryset.filter(Q(active=True) | Q(pending))
+
+
+def release_expired_bookings(time_border, table=None) -> int:
+    # снимает удержание столика с бронирований, время подтверждения которых истекло,
+    # и освобождает их слоты в масках занятости (update() не отправляет сигналов)
+    pending = Exists(BookingToken.objects.filter(booking=OuterRef("pk"), created_at__gt=time_border))
+    expired = Booking.objects.filter(active=False, is_pending=True).exclude(pending)
+    if table is not None:
+        expired = expired.filter(table=table)
+
+    rows = list(expired.values_list("pk", "table_id", "starts_at", "ends_at"))
+    if not rows:
+        return 0
+
+    released = expired.filter(pk__in=[pk for pk, *_ in rows]).update(is_pending=False)
+    refresh_occupancy(key for _, table_id, starts_at, ends_at in rows
+                      for key in table_days(table_id, starts_at, ends_at))
+    return released
+
+
+def build_day_index(start: datetime, end: datetime, time_border) -> DayIndex:
+    # индекс по закешированным строкам всех суток, в которые попадает [start, end)
+    rows = {}
+    day = start.date()
+    while day <= end.date():
+        # бронирование через полночь попадает в двое суток
+        for row in get_cached_day_bookings(day):
+            rows[row[1]] = row
+        day += timedelta(days=1)
+
+    return DayIndex((table_id, Interval(b_start, b_end, pk, active))
+                    for table_id, pk, b_start, b_end, active, token_created_at in rows.values()
+                    if active or (token_created_at is not None and token_created_at > time_border))
+
+
+def find_conflict(table, start: datetime, end: datetime, time_border, exclude_pk=None) -> Interval | None:
+    # самое раннее пересекающееся бронирование столика - один запрос по индексу starts_at/ends_at
+    start, end = as_wall_clock(start), as_wall_clock(end)
+
+    bookings = get_reserved_bookings(time_border).filter(table=table, starts_at__lt=end, ends_at__gt=start)
+    if exclude_pk is not None:
+        bookings = bookings.exclude(pk=exclude_pk)
+
+    row = bookings.order_by("starts_at").values_list("starts_at", "ends_at", "pk", "active").first()
+    return Interval(*row) if row else None
+
+
+def get_free_tables(start: datetime, end: datetime, places: int, time_border, exclude_pk=None) -> list[Table]:
+    # столики с достаточным числом мест, свободные весь период [start, end): занятость решается AND масок
+    # (restaurant.availability.occupancy), запрос к бронированиям - только для неоднозначных столиков
+    start, end = as_wall_clock(start), as_wall_clock(end)
+
+    tables = list(Table.objects.filter(places__gte=places).order_by("number"))
+    busy, unsure = classify_tables([t.pk for t in tables], start, end)
+    if exclude_pk is not None:
+        # маски учитывают и само переносимое бронирование
+        busy, unsure = set(), busy | unsure
+
+    if unsure:
+        bookings = get_reserved_bookings(time_border).filter(table_id__in=unsure, starts_at__lt=end, ends_at__gt=start)
+        if exclude_pk is not None:
+            bookings = bookings.exclude(pk=exclude_pk)
+        busy |= set(bookings.values_list("table_id", flat=True))
+    return [t for t in tables if t.pk not in busy]
+
+
+def get_free_windows(start: datetime, end: datetime, places: int, time_border, flour=None) -> list[tuple]:
+    # свободные промежутки внутри [start, end) по всем столикам с достаточным числом мест:
+    # [(столик, [(начало, конец), ...]), ...]; бронирования суток берутся из кеша (get_cached_day_bookings)
+    start, end = as_wall_clock(start), as_wall_clock(end)
+
+    index = build_day_index(start, end, time_border)
+    tables = Table.objects.filter(places__gte=places).order_by("number")
+    if flour is not None:
+        tables = tables.filter(flour=flour)
+    return [(t, index.free_windows(t.pk, start, end)) for t in tables]
+
+
+def get_booked_tables(start: datetime, end: datetime, time_border) -> list[Table]:
+    # столики, занятые бронированиями в [start, end), у каждого booking_days - [(дата, [бронирования]), ...]
+    # по порядку; два запроса: только нужные поля бронирований и сами столики
+    start, end = as_wall_clock(start), as_wall_clock(end)
+
+    rows = (get_reserved_bookings(time_border).filter(starts_at__lt=end, ends_at__gt=start)
+            .order_by("starts_at").values("table_id", "date_field", "time_start", "time_end", "active"))
+    days = {}
+    for row in rows:
+        days.setdefault(row["table_id"], {}).setdefault(row["date_field"], []).append(row)
+
+    tables = list(Table.objects.filter(pk__in=days).order_by("number"))
+    for table in tables:
+        table.booking_days = list(days[table.pk].items())
+    return tables
@@ -0,0 +1,87 @@
+from bisect import bisect_left
+from datetime import datetime
+from typing import Iterable, NamedTuple
+
+
+class Interval(NamedTuple):
+    # полуинтервал занятости столика [start, end)
+    start: datetime
+    end: datetime
+    pk: int
+    active: bool
+
+
+class DayIndex:
+    """Отсортированный индекс интервалов бронирований по столикам"""
+
+    def __init__(self, rows: Iterable[tuple[int, Interval]] = ()):
+        intervals = {}
+        for table_id, interval in rows:
+            intervals.setdefault(table_id, []).append(interval)
+
+        self._intervals = {}
+        self._starts = {}
+        self._max_ends = {}
+
+        for table_id, items in intervals.items():
+            items.sort()
+            self._intervals[table_id] = items
+            self._starts[table_id] = [i.start for i in items]
+
+            # максимум концов на префиксе позволяет остановить обход назад,
+            # даже если в базе уже лежат пересекающиеся бронирования
+            max_ends = []
+            for i in items:
+                max_ends.append(i.end if not max_ends or i.end > max_ends[-1] else max_ends[-1])
+            self._max_ends[table_id] = max_ends
+
+    def __len__(self):
+        return sum(len(items) for items in self._intervals.values())
+
+    def table_ids(self):
+        return set(self._intervals)
+
+    def intervals(self, table_id: int) -> list[Interval]:
+        return self._intervals.get(table_id, [])
+
+    def find_conflict(self, table_id: int, start: datetime, end: datetime, exclude_pk=None) -> Interval | None:
+        # ищет самое раннее бронирование столика, пересекающееся с [start, end)
+        items = self._intervals.get(table_id)
+        if not items:
+            return None
+
+        starts = self._starts[table_id]
+        max_ends = self._max_ends[table_id]
+
+        conflict = None
+        # кандидаты - интервалы, начавшиеся раньше конца запрошенного
+        i = bisect_left(starts, end) - 1
+        while i >= 0 and max_ends[i] > start:
+            interval = items[i]
+            if interval.end > start and interval.pk != exclude_pk:
+                conflict = interval
+            i -= 1
+
+        return conflict
+
+    def is_free(self, table_id: int, start: datetime, end: datetime, exclude_pk=None) -> bool:
+        return self.find_conflict(table_id, start, end, exclude_pk) is None
+
+    def free_table_ids(self, table_ids: Iterable[int], start: datetime, end: datetime, exclude_pk=None) -> list[int]:
+        return [table_id for table_id in table_ids if self.is_free(table_id, start, end, exclude_pk)]
+
+    def free_windows(self, table_id: int, start: datetime, end: datetime) -> list[tuple[datetime, datetime]]:
+        # свободные промежутки столика внутри [start, end) - один проход (sweep line) по интервалам,
+        # отсортированным по началу; курсор - самый поздний конец среди пройденных
+        windows = []
+        cursor = start
+        for interval in self._intervals.get(table_id, ()):
+            if interval.start >= end:
+                break
+            if interval.start > cursor:
+                windows.append((cursor, interval.start))
+            cursor = max(cursor, interval.end)
+
+        if cursor < end:
+            windows.append((cursor, end))
+        return windows
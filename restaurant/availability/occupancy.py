@@ -0,0 +1,131 @@
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from restaurant.models import Booking, TableDayOccupancy
+
+# занятость столика за сутки - битовые маски по SLOT_MINUTES минут от 00:00 ("настенное" время, как starts_at):
+# slots - слоты, которые хоть частично перекрывает бронирование, держащее столик (active или is_pending),
+# confirmed - слоты, целиком занятые подтвержденными бронированиями
+SLOT_MINUTES = TableDayOccupancy.SLOT_MINUTES
+SLOT_SECONDS = SLOT_MINUTES * 60
+
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def period_masks(start: datetime, end: datetime, inner=False) -> dict[date, int]:
+    # маски периода [start, end) по суткам: по умолчанию слоты на краях захватываются целиком (пустое
+    # пересечение таких масок - периоды точно не пересекаются), inner=True - только целиком покрытые слоты
+    masks = {}
+    day = start.date()
+    while day_start(day) < end:
+        begin = (max(start, day_start(day)) - day_start(day)).total_seconds()
+        finish = (min(end, day_start(day + timedelta(days=1))) - day_start(day)).total_seconds()
+        if inner:
+            first, last = -int(-begin // SLOT_SECONDS), int(finish // SLOT_SECONDS)
+        else:
+            first, last = int(begin // SLOT_SECONDS), -int(-finish // SLOT_SECONDS)
+        if last > first:
+            masks[day] = ((1 << (last - first)) - 1) << first
+        day += timedelta(days=1)
+    return masks
+
+
+def table_days(table_id, start: datetime, end: datetime) -> set[tuple[int, date]]:
+    return {(table_id, day) for day in period_masks(start, end)}
+
+
+def collect_masks(bookings, keep=lambda key: True) -> dict[tuple[int, date], list[int]]:
+    # (столик, сутки) -> [slots, confirmed] по строкам (table_id, starts_at, ends_at, active)
+    masks = {}
+    for table_id, starts_at, ends_at, active in bookings:
+        for day, mask in period_masks(starts_at, ends_at).items():
+            if keep((table_id, day)):
+                masks.setdefault((table_id, day), [0, 0])[0] |= mask
+        if active:
+            for day, mask in period_masks(starts_at, ends_at, inner=True).items():
+                if keep((table_id, day)):
+                    masks[(table_id, day)][1] |= mask
+    return masks
+
+
+def reserved_bookings():
+    # бронирования, которые держат столик с точки зрения ограничения booking_table_period_excl
+    return Booking.objects.filter(Q(active=True) | Q(is_pending=True)).values_list("table_id", "starts_at",
+                                                                                   "ends_at", "active")
+
+
+def lock_table_days(keys: set[tuple[int, date]]):
+    # пересчеты одних и тех же (столик, сутки) идут по очереди: блокировка держится до конца транзакции,
+    # и следующий пересчет читает бронирования (READ COMMITTED - новый снимок на запрос) уже после коммита
+    # предыдущего, а не затирает его маску своей; ключи берутся по порядку, чтобы не было взаимоблокировок
+    if connection.vendor != "postgresql":
+        # SQLite и так пропускает только одну пишущую транзакцию
+        return
+    table_ids, days = zip(*sorted(keys))
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(t, d) FROM (SELECT t, d FROM unnest(%s::int[], %s::int[]) "
+                       "AS k(t, d) ORDER BY t, d) AS keys", [list(table_ids), [day.toordinal() for day in days]])
+
+
+def refresh_occupancy(keys: Iterable[tuple[int, date]]):
+    # пересчет масок затронутых (столик, сутки) по бронированиям из базы под блокировкой этих ключей:
+    # блокировка, один запрос на чтение, одна вставка/обновление и удаление опустевших
+    keys = set(keys)
+    if not keys:
+        return
+
+    with transaction.atomic(savepoint=False):
+        lock_table_days(keys)
+
+        periods = Q()
+        for day in {day for _, day in keys}:
+            periods |= Q(starts_at__lt=day_start(day + timedelta(days=1)), ends_at__gt=day_start(day))
+        bookings = reserved_bookings().filter(periods, table_id__in={table_id for table_id, _ in keys})
+        masks = collect_masks(bookings, keep=keys.__contains__)
+
+        TableDayOccupancy.objects.bulk_create(
+            [TableDayOccupancy(table_id=table_id, day=day, mask=slots, confirmed_mask=confirmed)
+             for (table_id, day), (slots, confirmed) in masks.items()],
+            update_conflicts=True, unique_fields=["table", "day"], update_fields=["slots", "confirmed"])
+
+        empty = Q()
+        for table_id, day in keys - set(masks):
+            empty |= Q(table_id=table_id, day=day)
+        if empty:
+            TableDayOccupancy.objects.filter(empty).delete()
+
+
+def rebuild_occupancy(since: date) -> int:
+    # полный пересчет с даты since (после загрузки данных в обход сигналов: bulk_create, update)
+    TableDayOccupancy.objects.filter(day__gte=since).delete()
+    bookings = reserved_bookings().filter(ends_at__gt=day_start(since)).iterator(chunk_size=5000)
+    masks = collect_masks(bookings, keep=lambda key: key[1] >= since)
+
+    TableDayOccupancy.objects.bulk_create(
+        [TableDayOccupancy(table_id=table_id, day=day, mask=slots, confirmed_mask=confirmed)
+         for (table_id, day), (slots, confirmed) in masks.items()], batch_size=5000)
+    return len(masks)
+
+
+def classify_tables(table_ids: Iterable[int], start: datetime, end: datetime) -> tuple[set[int], set[int]]:
+    # (точно заняты, неизвестно) по AND масок за каждые сутки периода - одним запросом;
+    # остальные столики точно свободны; "неизвестно" - периоды на краях слотов и ожидающие подтверждения
+    wanted = period_masks(start, end)
+    occupied = {(row.table_id, row.day): (row.mask, row.confirmed_mask)
+                for row in TableDayOccupancy.objects.filter(day__in=list(wanted))}
+
+    busy, unsure = set(), set()
+    for table_id in table_ids:
+        for day, mask in wanted.items():
+            slots, confirmed = occupied.get((table_id, day), (0, 0))
+            if confirmed & mask:
+                busy.add(table_id)
+                break
+            if slots & mask:
+                unsure.add(table_id)
+    return busy, unsure - busy
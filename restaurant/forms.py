@@ -1,14 +1,12 @@
 import datetime
 
 from django import forms
-from django.db.models import Q
 from django.forms import BooleanField, TimeField, DateField, NumberInput, Textarea, CharField
 from django.utils import timezone
 
-from restaurant.models import Booking, BookingToken, Questions
-from restaurant.utils.utils import time_segment, get_content_parameters, get_actual_bookings
-
-PARAMETERS = get_content_parameters(True)
+from restaurant.availability.engine import find_conflict, get_free_tables
+from restaurant.models import Booking, Questions, booking_period
+from restaurant.utils.utils import time_segment, get_content_parameters
 
 
 class StyleFormMixin:
@@ -39,6 +37,8 @@ class BookingForm(StyleFormMixin, forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # столики, свободные в выбранный период, если выбранный занят (показываются под формой)
+        self.free_tables = []
         for field_name, field in self.fields.items():
             if isinstance(field, CharField):
                 field.widget = Textarea(attrs={"rows": 5})
@@ -47,7 +47,7 @@ class BookingForm(StyleFormMixin, forms.ModelForm):
     class Meta:
         model = Booking
         fields = "__all__"
-        exclude = ("user", "active", "created_at")
+        exclude = ("user", "active", "is_pending", "created_at")
 
     def validate_date_time(self, parametr_dict):
         # проверка допустимости бронирования с учетом времени работы и срока предварительного бронирования
@@ -92,50 +92,33 @@ class BookingForm(StyleFormMixin, forms.ModelForm):
     def clean_my_table(self, time_border):
         # проверка того, что столик свободен
         data = self.cleaned_data
-        # print(f"clean_table {data}")
 
-        t_start, t_end = time_segment(data["date_field"], data["time_start"], data["time_end"])
+        t_start, t_end = booking_period(data["date_field"], data["time_start"], data["time_end"])
         table = data["table"]
 
-        # отбор по времени конца бронирования без учета активности:
-        present_time_booking = get_actual_bookings(active=False, time_start=False)
-        # время подтверждения не истекло у следующих pk
-        booking_tokens = [token.booking.pk for token in BookingToken.objects.filter(created_at__gt=time_border)]
-        # теперь фильтруем по pk исключая те, которые не были подтверждены
-        # получение списка актуальных бронирований
-        bookings = (present_time_booking.filter(table=table).filter(Q(active=True) | Q(pk__in=booking_tokens)).
-                    order_by("date_field", "time_start"))
-
-        #
-        # # список pk бронирований, которые могут быть подтверждены
-        # booking_tokens = [token.booking.pk for token in BookingToken.objects.filter(created_at__gt=time_border)]
-        #
-        # # получение списка актуальных бронирований
-        # # получение уменьшенного списка бронирований
-        # bookings = (Booking.objects.filter(table=table).filter(Q(active=True) | Q(pk__in=booking_tokens)).
-        #             filter(date_field__year__gte=t_now.year, date_field__month__gte=t_now.month,
-        #                    date_field__day__gte=(t_now - datetime.timedelta(days=1)).day).order_by("date_field",
-        #                                                                                            "time_start"))
+        # если это обновление, то будет обновляемый объект, иначе None
+        booking_id = self.instance
 
-        # проверка перекрытия времени бронирований
-        for b in bookings:
-            b_start, b_end = time_segment(b.date_field, b.time_start, b.time_end)
+        # самое раннее из пересекающихся актуальных бронирований (подтвержденных или ожидающих подтверждения)
+        conflict = find_conflict(table, t_start, t_end, time_border, exclude_pk=booking_id.pk)
 
-            # если это обновление, то будет обновляемый объект, иначе None
-            booking_id = self.instance
+        # проверка перекрытия времени бронирований
+        if conflict is not None:
+            b_start, b_end = conflict.start, conflict.end
+            self.free_tables = get_free_tables(t_start, t_end, data.get("places") or 1, time_border,
+                                               exclude_pk=booking_id.pk)
 
-            if b_start <= t_start < b_end and booking_id.pk != b.pk:
+            if b_start <= t_start < b_end:
                 raise forms.ValidationError("В указанное время выбранный столик занят")
-            if b_start < t_end <= b_end and booking_id.pk != b.pk:
+            if b_start < t_end <= b_end:
                 raise forms.ValidationError("В указанное время выбранный столик еще не освободился")
-            if t_start <= b_start < t_end and booking_id.pk != b.pk:
-                raise forms.ValidationError("В указанный период времени столик забронирован")
+            raise forms.ValidationError("В указанный период времени столик забронирован")
 
         return data
 
     def clean(self):
 
-        parameters_dict = PARAMETERS
+        parameters_dict = get_content_parameters(True)
 
         if parameters_dict:
             confirm_timedelta = parameters_dict.get("confirm_timedelta")
@@ -0,0 +1,253 @@
+import json
+import platform
+import statistics
+import uuid
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+from unittest import mock
+
+import django
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.forms import ValidationError
+from django.test import Client, override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import reverse
+from django.utils import timezone
+
+from restaurant.forms import BookingForm
+from restaurant.models import Booking, Table
+from restaurant.utils.metrics import RequestMetrics
+from restaurant.utils.parameters import get_parameters
+from restaurant.utils.seed import seed_restaurant
+from restaurant.utils.utils import get_actual_bookings, get_due_notifications
+from users.models import User
+
+# сценарий: функция (данные сида, число итераций) -> функция одной итерации (номер итерации)
+SCENARIOS = {}
+# насколько может вырасти p95 относительно прошлого запуска, прежде чем это считается регрессией
+REGRESSION_THRESHOLD = 0.2
+
+
+def scenario(name):
+    def register(setup):
+        SCENARIOS[name] = setup
+        return setup
+    return register
+
+
+@scenario("booking_create")
+def booking_create(data, iterations):
+    # POST формы бронирования целиком (middleware, clean_my_table, транзакция, токен, письмо в очередь);
+    # слоты после 22:00 сид не занимает, каждая итерация бронирует свой столик и день
+    client = Client()
+    client.force_login(data["users"][0])
+    days = max(get_parameters().period_of_booking - 1, 1)
+    url = reverse("restaurant:booking_create")
+
+    def run(number):
+        table = data["tables"][number % len(data["tables"])]
+        day = date.today() + timedelta(days=number // len(data["tables"]) % days + 1)
+        response = client.post(url, {"table": table.pk, "places": 1, "notification": 0, "description": "",
+                                     "date_field": day.isoformat(), "time_start": "22:00", "time_end": "23:00"})
+        return response.status_code
+    return run
+
+
+@scenario("booking_list")
+def booking_list(data, iterations):
+    # история бронирований пользователей по кругу: первый запрос каждого - промах кеша
+    clients = []
+    for user in data["users"]:
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    url = reverse("restaurant:booking_list")
+
+    def run(number):
+        return clients[number % len(clients)].get(url).status_code
+    return run
+
+
+@scenario("get_actual_bookings")
+def actual_bookings(data, iterations):
+    # выборка, которую строит страница создания бронирования
+    def run(number):
+        list(get_actual_bookings(active=False, time_start=False))
+    return run
+
+
+@scenario("clean_my_table")
+def clean_my_table(data, iterations):
+    # проверка пересечения по столику: по очереди занятые слоты сида и свободные после 22:00
+    time_border = timezone.now() - get_parameters().confirm_delta
+    forms = []
+    for booking in data["bookings"]:
+        for start, end in ((booking.time_start, booking.time_end), ("22:00", "23:00")):
+            form = BookingForm(data={"table": booking.table_id, "places": 1, "notification": 0,
+                                     "date_field": booking.date_field.isoformat(), "time_start": start,
+                                     "time_end": end})
+            # форма проверяется один раз, замеряется только clean_my_table
+            form.is_valid()
+            forms.append(form)
+
+    def run(number):
+        try:
+            forms[number % len(forms)].clean_my_table(time_border)
+        except ValidationError:
+            return "busy"
+        return "free"
+    return run
+
+
+@scenario("due_notifications")
+def due_notifications(data, iterations):
+    # вместо find_active_bookings (напоминания теперь отложенные задачи): выборка напоминаний,
+    # которые пора отправить, окнами по часу на сутки вперед - как при разборе очереди
+    now = timezone.now()
+
+    def run(number):
+        since = now + timedelta(hours=number % 24)
+        list(get_due_notifications(since, since + timedelta(hours=1)))
+    return run
+
+
+def percentile(quantiles, value) -> float:
+    return round(quantiles[value - 1] * 1000, 3)
+
+
+def measure(run, iterations, warmup) -> dict:
+    for number in range(warmup):
+        run(number)
+
+    timings, outcomes = [], {}
+    counter = RequestMetrics()
+    with connection.execute_wrapper(counter):
+        started = perf_counter()
+        for number in range(warmup, warmup + iterations):
+            begin = perf_counter()
+            outcome = run(number)
+            timings.append(perf_counter() - begin)
+            # исход итерации (код ответа, занят ли столик), если сценарий его возвращает
+            if outcome is not None:
+                outcomes[str(outcome)] = outcomes.get(str(outcome), 0) + 1
+        elapsed = perf_counter() - started
+
+    quantiles = statistics.quantiles(timings, n=100, method="inclusive") if len(timings) > 1 else timings * 99
+    return {
+        "iterations": iterations,
+        "per_second": round(iterations / elapsed, 1),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "p50_ms": percentile(quantiles, 50),
+        "p95_ms": percentile(quantiles, 95),
+        "p99_ms": percentile(quantiles, 99),
+        "max_ms": round(max(timings) * 1000, 3),
+        # SQL-запросы на итерацию: рост - регрессия независимо от шума времени
+        "queries": round(counter.queries / iterations, 2),
+        "outcomes": outcomes,
+    }
+
+
+def run_suite(tables=20, users=100, bookings=2000, iterations=200, warmup=10, seed=0, scenarios=None) -> dict:
+    # заполняет текущую базу и прогоняет сценарии; база должна быть пустой (тестовой)
+    names = scenarios or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    # после 22:00 и через полночь сид не бронирует - эти слоты свободны для сценариев
+    started = perf_counter()
+    seed_restaurant(tables=tables, users=users, bookings=bookings, seed=seed, close=time(22), late_share=0)
+    seeded = perf_counter() - started
+    data = {"tables": list(Table.objects.order_by("number")), "users": list(User.objects.order_by("pk")[:10]),
+            "bookings": list(Booking.objects.filter(active=True).order_by("pk")[:50])}
+
+    results = {}
+    # письма остаются в MailOutbox, задача отправки не ставится: брокер в замерах не участвует
+    with mock.patch("restaurant.notifications.mail.dispatch_relay"):
+        for name in names:
+            results[name] = measure(SCENARIOS[name](data, iterations), iterations, warmup)
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": {"python": platform.python_version(), "django": django.get_version(),
+                        "database": connection.vendor, "cache": settings.CACHES["default"]["BACKEND"],
+                        "cache_enabled": settings.CACHE_ENABLED},
+        "parameters": {"tables": tables, "users": users, "bookings": bookings, "iterations": iterations,
+                       "warmup": warmup, "seed": seed, "seed_seconds": round(seeded, 3)},
+        "scenarios": results,
+    }
+
+
+def compare_results(baseline, current, threshold=REGRESSION_THRESHOLD) -> list[str]:
+    # регрессии относительно прошлого запуска: p95 хуже больше чем на threshold или больше SQL-запросов
+    regressions = []
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} мс")
+        if result["queries"] > before["queries"]:
+            regressions.append(f"{name}: SQL-запросов {before['queries']} -> {result['queries']}")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ("Замеры сценариев бронирования (p50/p95/p99, запросов в секунду, SQL на запрос) на отдельной "
+            "тестовой базе с сгенерированными данными; результат - JSON для сравнения между запусками")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tables", type=int, default=20)
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--bookings", type=int, default=2000)
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--scenario", action="append", dest="scenarios", choices=sorted(SCENARIOS),
+                            help="только указанные сценарии (можно несколько раз)")
+        parser.add_argument("--output", help="файл для результатов в JSON (по умолчанию - вывод)")
+        parser.add_argument("--compare", help="JSON прошлого запуска: регрессии завершают команду с ошибкой")
+        parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+        parser.add_argument("--keepdb", action="store_true", help="не удалять тестовую базу после замеров")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as file:
+                baseline = json.load(file)
+
+        # рабочая база не трогается: данные создаются в тестовой (test_<NAME>), как у manage.py test;
+        # ключи кеша - под своим префиксом, чтобы не смешиваться с кешем сайта в общем Redis
+        prefix = f"benchmark:{uuid.uuid4().hex[:8]}"
+        caches = {alias: {**config, "KEY_PREFIX": prefix} for alias, config in settings.CACHES.items()}
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options["keepdb"])
+        try:
+            with override_settings(CACHES=caches, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                results = run_suite(tables=options["tables"], users=options["users"],
+                                    bookings=options["bookings"], iterations=options["iterations"],
+                                    warmup=options["warmup"], seed=options["seed"],
+                                    scenarios=options["scenarios"])
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+
+        output = json.dumps(results, ensure_ascii=False, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+        for name, result in results["scenarios"].items():
+            self.stderr.write(f"{name:<20} {result['per_second']:>8} в секунду, p50 {result['p50_ms']:>8} мс, "
+                              f"p95 {result['p95_ms']:>8} мс, p99 {result['p99_ms']:>8} мс, "
+                              f"SQL {result['queries']}")
+
+        if baseline is not None:
+            regressions = compare_results(baseline, results, options["threshold"])
+            if regressions:
+                raise CommandError("регрессии относительно " + options["compare"] + ":\n" + "\n".join(regressions))
+            self.stderr.write(f"регрессий относительно {options['compare']} нет")
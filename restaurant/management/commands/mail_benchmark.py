@@ -0,0 +1,85 @@
+import socket
+import time
+
+from django.core.mail import get_connection, EmailMessage
+from django.core.management import BaseCommand
+
+from restaurant.notifications.mail import PersistentMailConnection
+
+
+class SinkHandler:
+    # принимает и отбрасывает письма, запоминая, с каких соединений они пришли
+    def __init__(self):
+        self.messages = 0
+        self.peers = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        self.peers.add(session.peer)
+        return "250 OK"
+
+
+class SmtpSink:
+    """Локальный SMTP-сервер aiosmtpd для тестов и замеров"""
+
+    def __init__(self):
+        from aiosmtpd.controller import Controller
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self.handler = SinkHandler()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=self.port)
+
+    def __enter__(self):
+        self.controller.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.controller.stop()
+
+    def connection_options(self) -> dict:
+        return {"backend": "django.core.mail.backends.smtp.EmailBackend", "host": "127.0.0.1", "port": self.port,
+                "username": "", "password": "", "use_tls": False, "use_ssl": False, "timeout": 10}
+
+
+def run_benchmark(messages=200) -> dict:
+    # письмо на соединение (как send_mail в каждой задаче) против одного соединения воркера
+    emails = [EmailMessage("Подтверждение бронирования", "Привет, перейди по ссылке", "from@test.ru",
+                           [f"user{number}@test.ru"]) for number in range(messages)]
+    results = {}
+
+    with SmtpSink() as sink:
+        def measure(name, send):
+            sink.handler.peers.clear()
+            started = time.perf_counter()
+            sent = send()
+            elapsed = time.perf_counter() - started
+            results[name] = {"sent": sent, "connections": len(sink.handler.peers), "seconds": round(elapsed, 3),
+                             "per_second": round(sent / elapsed, 1)}
+
+        def per_message():
+            return sum(get_connection(**sink.connection_options()).send_messages([email]) for email in emails)
+
+        def persistent():
+            connection = PersistentMailConnection(**sink.connection_options())
+            sent = connection.send_messages(emails)
+            connection.close()
+            return sent
+
+        measure("per_message", per_message)
+        measure("persistent", persistent)
+
+    return results
+
+
+class Command(BaseCommand):
+    help = "Скорость отправки писем: новое SMTP-соединение на письмо против соединения воркера (aiosmtpd)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200)
+
+    def handle(self, *args, **options):
+        for name, result in run_benchmark(options["messages"]).items():
+            self.stdout.write(f"{name:<12} {result['sent']:>6} писем, соединений: {result['connections']:>4}, "
+                              f"{result['seconds']:>7} с - {result['per_second']} в секунду")
@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from restaurant.notifications.outbox import reconcile_notifications, reconcile_horizon
+
+
+class Command(BaseCommand):
+    help = ("Восстановление отложенных задач напоминаний (например, после очистки брокера): создает недостающие "
+            "записи NotificationOutbox, заново ставит задачи ожидающим напоминаниям и отправляет просроченные")
+
+    def handle(self, *args, **options):
+        created, scheduled, overdue = reconcile_notifications(timezone.now(), reconcile_horizon())
+        self.stdout.write(f"создано записей: {created}, поставлено задач: {scheduled}, "
+                          f"просрочено (отправка пакетом): {overdue}")
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from restaurant.templates.restaurant.services import cache_delete_all_bookings
+from restaurant.utils.seed import seed_restaurant, SEED_DOMAIN, SEED_PASSWORD
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ("Генерация данных для проверки под нагрузкой: столики, пользователи, бронирования с токенами "
+            "подтверждения, вопросы и отзывы; вставка пачками через bulk_create, одинаковый --seed - одинаковые "
+            "данные")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tables", type=int, default=300)
+        parser.add_argument("--users", type=int, default=20000)
+        parser.add_argument("--bookings", type=int, default=1000000)
+        parser.add_argument("--questions", type=int, default=2000)
+        parser.add_argument("--reviews", type=int, default=20000)
+        parser.add_argument("--days", type=int, default=21,
+                            help="дней бронирований (не меньше, чем нужно для --bookings)")
+        parser.add_argument("--late-share", type=float, default=0.05,
+                            help="доля столиков в день с бронированием через полночь")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not options["tables"] or not options["users"]:
+            raise CommandError("нужен хотя бы один столик и один пользователь")
+        if User.objects.filter(email=f"user{options['seed']}-0@{SEED_DOMAIN}").exists():
+            raise CommandError(f"данные с --seed {options['seed']} уже созданы, укажите другой --seed")
+
+        started = time.perf_counter()
+        current = None
+
+        def progress(name, done, total):
+            # строка прогресса модели перезаписывается после каждой пачки
+            nonlocal current
+            if current not in (None, name):
+                self.stdout.write("")
+            current = name
+            self.stdout.write(f"\r{name}: {done} из {total}", ending="")
+            self.stdout.flush()
+
+        counts = seed_restaurant(tables=options["tables"], users=options["users"], bookings=options["bookings"],
+                                 questions=options["questions"], reviews=options["reviews"], seed=options["seed"],
+                                 days=options["days"], late_share=options["late_share"], progress=progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write("")
+
+        # bulk_create не отправляет сигналов: закешированные бронирования сбрасываются версией пространства имен
+        cache_delete_all_bookings()
+
+        self.stdout.write(", ".join(f"{name}: {count}" for name, count in counts.items()) +
+                          f" - за {elapsed:.1f} с ({sum(counts.values()) / elapsed:.0f} строк в секунду)")
+        self.stdout.write(f"пароль пользователей user{options['seed']}-N@{SEED_DOMAIN}: {SEED_PASSWORD}; "
+                          f"задачи напоминаний поставит периодическая reconcile_reminders "
+                          f"(или сразу - manage.py reconcile_reminders)")
@@ -0,0 +1,83 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.core.management import BaseCommand
+
+# модули, которые загружает процесс при старте: веб (URLconf тянет views и forms) и воркер Celery
+TARGETS = {
+    "web": ["config.wsgi", "config.urls"],
+    "worker": ["config.celery", "restaurant.tasks"],
+}
+PROJECT_PACKAGES = ("config", "restaurant", "users")
+
+# выполняется в отдельном "холодном" процессе; запросы к базе считаются с самого начала, включая django.setup()
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from django.db import connection
+queries = []
+
+def count(execute, sql, params, many, context):
+    queries.append(sql)
+    return execute(sql, params, many, context)
+
+with connection.execute_wrapper(count):
+    import django
+    django.setup()
+    for name in sys.argv[1:]:
+        __import__(name)
+print(json.dumps({"seconds": time.perf_counter() - start, "queries": queries}))
+"""
+
+
+def parse_importtime(stderr) -> list[tuple[str, int, int]]:
+    # строки вида "import time:   self [us] | cumulative | imported package"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure_startup(modules) -> dict:
+    # время холодного старта, запросы к базе во время импорта и самые "тяжелые" импорты
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "config.settings"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT, *modules],
+                            capture_output=True, text=True, env=env, check=True)
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["imports"] = parse_importtime(result.stderr)
+    return report
+
+
+class Command(BaseCommand):
+    help = "Отчет о времени старта веб-процесса и воркера (python -X importtime) и запросах к базе при импорте"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", choices=[*TARGETS, "all"], default="all")
+        parser.add_argument("--repeat", type=int, default=3, help="количество запусков для медианы")
+        parser.add_argument("--top", type=int, default=15, help="сколько самых долгих импортов показать")
+
+    def handle(self, *args, **options):
+        targets = list(TARGETS) if options["target"] == "all" else [options["target"]]
+
+        for target in targets:
+            reports = [measure_startup(TARGETS[target]) for _ in range(options["repeat"])]
+            report = reports[-1]
+            seconds = statistics.median(r["seconds"] for r in reports)
+
+            self.stdout.write(f"{target}: старт {seconds * 1000:.0f} мс (медиана из {len(reports)}), "
+                              f"запросов к базе при импорте: {len(report['queries'])}")
+            for sql in report["queries"]:
+                self.stdout.write(self.style.WARNING(f"  {sql}"))
+
+            project = [row for row in report["imports"] if row[0].split(".")[0] in PROJECT_PACKAGES]
+            for title, rows in (("модули проекта", project), ("все модули", report["imports"])):
+                self.stdout.write(f"  {title}, cumulative [мс]:")
+                for name, self_us, cumulative_us in sorted(rows, key=lambda row: -row[2])[:options["top"]]:
+                    self.stdout.write(f"    {cumulative_us / 1000:8.1f}  {name}")
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management import BaseCommand
+
+from restaurant.notifications.telegram import TelegramClient, AsyncTelegramClient
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    # ответ sendMessage с задержкой, как у api.telegram.org; соединения keep-alive
+    protocol_version = "HTTP/1.1"
+    # заголовки и тело пишутся отдельно - без TCP_NODELAY каждый ответ ждал бы отложенного ACK
+    disable_nagle_algorithm = True
+    payload = json.dumps({"ok": True, "result": {"message_id": 1}}).encode()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+    def __init__(self, latency):
+        super().__init__(("127.0.0.1", 0), FakeTelegramHandler)
+        self.latency = latency
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/bot"
+
+
+def run_benchmark(messages=200, latency=0.02, concurrency=50, pool_size=10) -> dict:
+    # пропускная способность (сообщений в секунду) трех способов отправки; лимиты Telegram отключены,
+    # чтобы мерить только транспорт
+    batch = [(str(chat_id), "напоминание") for chat_id in range(messages)]
+    options = {"rate": 10 ** 6, "chat_rate": 10 ** 6}
+    results = {}
+
+    with FakeTelegramServer(latency) as server:
+        def measure(name, send):
+            started = time.perf_counter()
+            sent = send()
+            elapsed = time.perf_counter() - started
+            results[name] = {"sent": sent, "seconds": round(elapsed, 3), "per_second": round(sent / elapsed, 1)}
+
+        client = TelegramClient(server.url, "TOKEN", pool_size=pool_size, **options)
+
+        def sequential():
+            return sum(client.send_message(*message) is not None for message in batch)
+
+        def threads():
+            return sum(not isinstance(result, Exception) for result in client.send_batch(batch))
+
+        async def send_async():
+            async with AsyncTelegramClient(server.url, "TOKEN", concurrency=concurrency, **options) as async_client:
+                return await async_client.send_batch(batch)
+
+        measure("sequential", sequential)
+        measure("threads", threads)
+        measure("asyncio", lambda: sum(not isinstance(result, Exception) for result in asyncio.run(send_async())))
+        client.close()
+
+    return results
+
+
+class Command(BaseCommand):
+    help = "Пропускная способность отправки напоминаний в Telegram на локальном фейковом Bot API"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа фейкового API, сек")
+        parser.add_argument("--concurrency", type=int, default=50, help="одновременных запросов asyncio")
+        parser.add_argument("--pool-size", type=int, default=10, help="потоков и соединений TelegramClient")
+
+    def handle(self, *args, **options):
+        results = run_benchmark(options["messages"], options["latency"], options["concurrency"],
+                                options["pool_size"])
+        for name, result in results.items():
+            self.stdout.write(f"{name:<12} {result['sent']:>6} сообщений за {result['seconds']:>7} с - "
+                              f"{result['per_second']} в секунду")
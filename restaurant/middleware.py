@@ -0,0 +1,71 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from restaurant.utils.metrics import RequestMetrics, current_metrics, metrics_registry
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryMetricsMiddleware:
+    """SQL-запросы, время SQL, попадания в кеш и время отрисовки по имени представления (restaurant:booking_create):
+    заголовок Server-Timing, сводка на /metrics/ и проверка бюджета запросов QUERY_BUDGETS"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        duration = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "<unresolved>"
+        budget = settings.QUERY_BUDGETS.get(view)
+        over_budget = budget is not None and metrics.queries > budget
+        metrics_registry.record(view, metrics, duration, over_budget)
+
+        if over_budget:
+            message = f"{view}: {metrics.queries} SQL-запросов при бюджете {budget}"
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        # время по частям видно только при отладке и сотрудникам
+        user = getattr(request, "user", None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response["Server-Timing"] = server_timing(metrics, duration)
+        return response
+
+    def process_template_response(self, request, response):
+        # TemplateResponse отрисовывается после представления - время меряется колбэками вокруг render()
+        metrics = current_metrics.get()
+        if metrics is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                metrics.render_time += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def server_timing(metrics, duration) -> str:
+    return ", ".join((
+        f'db;dur={metrics.sql_time * 1000:.1f};desc="{metrics.queries} queries"',
+        f'cache;desc="{metrics.cache_hits} hits, {metrics.cache_misses} misses"',
+        f"render;dur={metrics.render_time * 1000:.1f}",
+        f"total;dur={duration * 1000:.1f}",
+    ))
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:00
+
+from datetime import datetime, timedelta, timezone
+
+from django.db import migrations, models
+
+
+def fill_booking_period(apps, schema_editor):
+    Booking = apps.get_model("restaurant", "Booking")
+
+    batch = []
+    for booking in Booking.objects.only("date_field", "time_start", "time_end").iterator(chunk_size=2000):
+        time_start = booking.time_start.replace(second=0, microsecond=0)
+        time_end = booking.time_end.replace(second=0, microsecond=0)
+        booking.starts_at = datetime.combine(booking.date_field, time_start, tzinfo=timezone.utc)
+        booking.ends_at = datetime.combine(booking.date_field, time_end, tzinfo=timezone.utc)
+        if time_end < time_start:
+            booking.ends_at += timedelta(days=1)
+
+        batch.append(booking)
+        if len(batch) >= 2000:
+            Booking.objects.bulk_update(batch, ["starts_at", "ends_at"])
+            batch = []
+
+    if batch:
+        Booking.objects.bulk_update(batch, ["starts_at", "ends_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booking",
+            name="starts_at",
+            field=models.DateTimeField(
+                db_index=True,
+                editable=False,
+                null=True,
+                verbose_name="начало бронирования (дата и время)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="booking",
+            name="ends_at",
+            field=models.DateTimeField(
+                db_index=True,
+                editable=False,
+                null=True,
+                verbose_name="конец бронирования (дата и время)",
+            ),
+        ),
+        migrations.RunPython(fill_booking_period, migrations.RunPython.noop),
+    ]
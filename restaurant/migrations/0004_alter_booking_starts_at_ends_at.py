@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0003_booking_starts_at_ends_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="booking",
+            name="starts_at",
+            field=models.DateTimeField(
+                db_index=True,
+                editable=False,
+                verbose_name="начало бронирования (дата и время)",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="booking",
+            name="ends_at",
+            field=models.DateTimeField(
+                db_index=True,
+                editable=False,
+                verbose_name="конец бронирования (дата и время)",
+            ),
+        ),
+    ]
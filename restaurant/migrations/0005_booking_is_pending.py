@@ -0,0 +1,45 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:10
+
+from datetime import timedelta
+
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+
+def fill_is_pending(apps, schema_editor):
+    # неподтвержденные бронирования с неистекшим токеном продолжают держать столик
+    Booking = apps.get_model("restaurant", "Booking")
+    BookingToken = apps.get_model("restaurant", "BookingToken")
+    ContentParameters = apps.get_model("restaurant", "ContentParameters")
+
+    try:
+        confirm_timedelta = int(ContentParameters.objects.get(title="confirm_timedelta").body)
+    except Exception:
+        confirm_timedelta = 45
+    time_border = timezone.now() - timedelta(minutes=confirm_timedelta)
+
+    tokens = BookingToken.objects.filter(booking=OuterRef("pk"), created_at__gt=time_border)
+    Booking.objects.filter(Exists(tokens), active=False).update(is_pending=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0004_alter_booking_starts_at_ends_at"),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.AddField(
+            model_name="booking",
+            name="is_pending",
+            field=models.BooleanField(
+                default=False,
+                help_text="введите ожидает ли бронирование подтверждения",
+                verbose_name="ожидает ли бронирование подтверждения",
+            ),
+        ),
+        migrations.RunPython(fill_is_pending, migrations.RunPython.noop),
+    ]
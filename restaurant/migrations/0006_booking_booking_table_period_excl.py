@@ -0,0 +1,60 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:10
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+import restaurant.models
+from django.db import migrations, models
+
+
+def check_overlapping_bookings(apps, schema_editor):
+    # ограничение не создастся, если в базе уже есть пересекающиеся бронирования одного столика:
+    # их нужно разобрать вручную (отменить лишние), а не удалять молча
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT a.id, b.id
+            FROM restaurant_booking a
+            JOIN restaurant_booking b
+              ON a.table_id = b.table_id AND a.id < b.id
+             AND a.starts_at < b.ends_at AND b.starts_at < a.ends_at
+            WHERE (a.active OR a.is_pending) AND (b.active OR b.is_pending)
+            LIMIT 50
+            """
+        )
+        overlapping = cursor.fetchall()
+
+    if overlapping:
+        pairs = ", ".join(f"{a}-{b}" for a, b in overlapping)
+        raise RuntimeError(f"Пересекающиеся бронирования одного столика (pk): {pairs}. "
+                           f"Отмените лишние бронирования и повторите миграцию.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0005_booking_is_pending"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_overlapping_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="booking",
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(
+                condition=models.Q(("active", True), ("is_pending", True), _connector="OR"),
+                expressions=[
+                    ("table", "="),
+                    (
+                        restaurant.models.TsTzRange(
+                            "starts_at", "ends_at", django.contrib.postgres.fields.ranges.RangeBoundary()
+                        ),
+                        "&&",
+                    ),
+                ],
+                name="booking_table_period_excl",
+                violation_error_message="В указанный период времени столик забронирован",
+            ),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0006_booking_booking_table_period_excl"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # составные индексы создаются раньше, чем удаляются одиночные индексы внешних ключей
+    operations = [
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["table", "starts_at", "ends_at"], name="booking_table_period_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                fields=["user", "date_field", "time_start"], name="booking_user_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                condition=models.Q(("active", True), ("notification__gt", 0)),
+                fields=["starts_at"],
+                name="booking_notification_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookingtoken",
+            index=models.Index(
+                fields=["booking", "created_at"], name="bookingtoken_created_idx"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="bookingtoken",
+            name="token",
+            field=models.CharField(
+                blank=True, max_length=100, null=True, unique=True, verbose_name="Token"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="booking",
+            name="table",
+            field=models.ForeignKey(
+                db_index=False,
+                help_text="выберите столик",
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="table",
+                to="restaurant.table",
+                verbose_name="столик",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="booking",
+            name="user",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                help_text="пользователь",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="user",
+                to=settings.AUTH_USER_MODEL,
+                verbose_name="пользователь",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="bookingtoken",
+            name="booking",
+            field=models.ForeignKey(
+                db_index=False,
+                help_text="токен для восстановления пароля",
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="user_token",
+                to="restaurant.booking",
+                verbose_name="бронирование",
+            ),
+        ),
+    ]
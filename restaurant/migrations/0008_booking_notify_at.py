@@ -0,0 +1,53 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:42
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def fill_notify_at(apps, schema_editor):
+    Booking = apps.get_model("restaurant", "Booking")
+
+    batch = []
+    bookings = (Booking.objects.filter(notification__gt=0, user__isnull=False).select_related("user")
+                .only("starts_at", "notification", "user__time_offset"))
+    for booking in bookings.iterator(chunk_size=2000):
+        booking.notify_at = booking.starts_at - timedelta(hours=booking.notification + booking.user.time_offset)
+
+        batch.append(booking)
+        if len(batch) >= 2000:
+            Booking.objects.bulk_update(batch, ["notify_at"])
+            batch = []
+
+    if batch:
+        Booking.objects.bulk_update(batch, ["notify_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0007_booking_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booking",
+            name="notify_at",
+            field=models.DateTimeField(
+                blank=True, editable=False, null=True, verbose_name="время напоминания"
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name="booking",
+            name="booking_notification_idx",
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(
+                condition=models.Q(("active", True), ("notify_at__isnull", False)),
+                fields=["notify_at"],
+                name="booking_notify_at_idx",
+            ),
+        ),
+        migrations.RunPython(fill_notify_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,122 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:55
+
+from datetime import datetime, timedelta, timezone
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_outbox(apps, schema_editor):
+    # напоминания по уже подтвержденным бронированиям, которые еще предстоит отправить
+    Booking = apps.get_model("restaurant", "Booking")
+    NotificationOutbox = apps.get_model("restaurant", "NotificationOutbox")
+
+    since = datetime.now(timezone.utc) - timedelta(hours=1)
+    bookings = Booking.objects.filter(active=True, notify_at__gt=since).only("notify_at")
+
+    batch = []
+    for booking in bookings.iterator(chunk_size=2000):
+        batch.append(NotificationOutbox(booking=booking, due_at=booking.notify_at, available_at=booking.notify_at))
+        if len(batch) >= 2000:
+            NotificationOutbox.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+
+    if batch:
+        NotificationOutbox.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0008_booking_notify_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("due_at", models.DateTimeField(verbose_name="время напоминания")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "ожидает отправки"),
+                            ("sent", "отправлено"),
+                            ("failed", "ошибка отправки"),
+                            ("skipped", "не отправлялось"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                        verbose_name="статус",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.SmallIntegerField(default=0, verbose_name="число попыток"),
+                ),
+                (
+                    "available_at",
+                    models.DateTimeField(verbose_name="время следующей попытки"),
+                ),
+                (
+                    "locked_until",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="занято воркером до"
+                    ),
+                ),
+                (
+                    "sent_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="время отправки"
+                    ),
+                ),
+                (
+                    "last_error",
+                    models.TextField(
+                        blank=True, null=True, verbose_name="последняя ошибка"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="дата создания"),
+                ),
+                (
+                    "booking",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="notifications",
+                        to="restaurant.booking",
+                        verbose_name="бронирование",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "напоминание",
+                "verbose_name_plural": "напоминания",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "pending")),
+                        fields=["available_at"],
+                        name="notification_available_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("booking", "due_at"),
+                        name="notification_booking_due_uniq",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_outbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0009_notificationoutbox"),
+    ]
+
+    # отложенные задачи для уже существующих записей ставит команда reconcile_reminders
+    operations = [
+        migrations.AddField(
+            model_name="notificationoutbox",
+            name="task_id",
+            field=models.CharField(
+                blank=True, max_length=50, null=True, verbose_name="id задачи Celery"
+            ),
+        ),
+    ]
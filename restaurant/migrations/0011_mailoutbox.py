@@ -0,0 +1,84 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0010_notificationoutbox_task_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("subject", models.CharField(max_length=255, verbose_name="тема")),
+                ("message", models.TextField(verbose_name="текст")),
+                ("recipient_list", models.JSONField(verbose_name="получатели")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "ожидает отправки"),
+                            ("sent", "отправлено"),
+                            ("failed", "ошибка отправки"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                        verbose_name="статус",
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.SmallIntegerField(default=0, verbose_name="число попыток"),
+                ),
+                (
+                    "available_at",
+                    models.DateTimeField(verbose_name="время следующей попытки"),
+                ),
+                (
+                    "locked_until",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="занято воркером до"
+                    ),
+                ),
+                (
+                    "sent_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="время отправки"
+                    ),
+                ),
+                (
+                    "last_error",
+                    models.TextField(
+                        blank=True, null=True, verbose_name="последняя ошибка"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="дата создания"),
+                ),
+            ],
+            options={
+                "verbose_name": "письмо",
+                "verbose_name_plural": "письма",
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("status", "pending")),
+                        fields=["available_at"],
+                        name="mail_available_idx",
+                    )
+                ],
+            },
+        ),
+    ]
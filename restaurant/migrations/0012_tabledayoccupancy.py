@@ -0,0 +1,118 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:06
+
+from datetime import date, datetime, time, timedelta, timezone
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q
+
+SLOT_SECONDS = 15 * 60
+SLOTS_BYTES = 12
+
+
+def slot_masks(start, end, inner):
+    # маски периода [start, end) по суткам: слоты на краях целиком (inner=False) или только покрытые
+    masks = {}
+    day = start.date()
+    while datetime.combine(day, time.min, tzinfo=timezone.utc) < end:
+        day_start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+        begin = (max(start, day_start) - day_start).total_seconds()
+        finish = (min(end, day_start + timedelta(days=1)) - day_start).total_seconds()
+        if inner:
+            first, last = -int(-begin // SLOT_SECONDS), int(finish // SLOT_SECONDS)
+        else:
+            first, last = int(begin // SLOT_SECONDS), -int(-finish // SLOT_SECONDS)
+        if last > first:
+            masks[day] = ((1 << (last - first)) - 1) << first
+        day += timedelta(days=1)
+    return masks
+
+
+def fill_occupancy(apps, schema_editor):
+    # маски занятости по действующим и ожидающим подтверждения бронированиям начиная со вчерашнего дня
+    Booking = apps.get_model("restaurant", "Booking")
+    TableDayOccupancy = apps.get_model("restaurant", "TableDayOccupancy")
+
+    since = date.today() - timedelta(days=1)
+    masks = {}
+    bookings = Booking.objects.filter(
+        Q(active=True) | Q(is_pending=True),
+        ends_at__gt=datetime.combine(since, time.min, tzinfo=timezone.utc),
+    ).values_list("table_id", "starts_at", "ends_at", "active")
+    for table_id, starts_at, ends_at, active in bookings.iterator(chunk_size=2000):
+        for day, mask in slot_masks(starts_at, ends_at, inner=False).items():
+            if day >= since:
+                masks.setdefault((table_id, day), [0, 0])[0] |= mask
+        if active:
+            for day, mask in slot_masks(starts_at, ends_at, inner=True).items():
+                if day >= since:
+                    masks[(table_id, day)][1] |= mask
+
+    TableDayOccupancy.objects.bulk_create(
+        [
+            TableDayOccupancy(
+                table_id=table_id,
+                day=day,
+                slots=slots.to_bytes(SLOTS_BYTES, "big"),
+                confirmed=confirmed.to_bytes(SLOTS_BYTES, "big"),
+            )
+            for (table_id, day), (slots, confirmed) in masks.items()
+        ],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("restaurant", "0011_mailoutbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TableDayOccupancy",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField(verbose_name="дата")),
+                (
+                    "slots",
+                    models.BinaryField(max_length=12, verbose_name="занятые слоты"),
+                ),
+                (
+                    "confirmed",
+                    models.BinaryField(
+                        max_length=12, verbose_name="слоты подтвержденных бронирований"
+                    ),
+                ),
+                (
+                    "table",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="occupancy",
+                        to="restaurant.table",
+                        verbose_name="столик",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "занятость столика",
+                "verbose_name_plural": "занятость столиков",
+                "indexes": [models.Index(fields=["day"], name="occupancy_day_idx")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("table", "day"), name="occupancy_table_day_uniq"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_occupancy, migrations.RunPython.noop),
+    ]
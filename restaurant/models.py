@@ -1,9 +1,42 @@
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeBoundary, RangeOperators
 from django.db import models
+from django.db.models import Q
 from users.models import User
 
 NULLABLE = {"blank": True, "null": True}
 
 
+def booking_period(date_field, time_start, time_end) -> tuple[datetime, datetime]:
+    # начало и конец бронирования одной парой datetime, "настенное" время ресторана хранится в UTC;
+    # если конец раньше начала, бронирование переходит через полночь
+    starts_at = datetime.combine(date_field, time_start.replace(second=0, microsecond=0), tzinfo=timezone.utc)
+    ends_at = datetime.combine(date_field, time_end.replace(second=0, microsecond=0), tzinfo=timezone.utc)
+    if time_end < time_start:
+        ends_at += timedelta(days=1)
+
+    return starts_at, ends_at
+
+
+def notify_time(starts_at, notification, time_offset) -> datetime:
+    # starts_at - "настенное" время в часовом поясе пользователя, переводим его в настоящий UTC
+    return starts_at - timedelta(hours=notification + time_offset)
+
+
+def occupancy_state(booking) -> tuple:
+    # то, от чего зависят маски занятости: столик, период, удержание столика (slots) и подтверждение (confirmed)
+    values = booking.__dict__
+    return (values.get("table_id"), values.get("starts_at"), values.get("ends_at"),
+            bool(values.get("active") or values.get("is_pending")), bool(values.get("active")))
+
+
+class TsTzRange(models.Func):
+    function = "TSTZRANGE"
+    output_field = DateTimeRangeField()
+
+
 class Table(models.Model):
     number = models.SmallIntegerField(verbose_name="Номер столика", help_text="Введите номер столика", unique=True)
     places = models.SmallIntegerField(verbose_name="Число сидячих мест у столика",
@@ -32,10 +65,11 @@ class Booking(models.Model):
         (3, "За три часа"),
     )
 
+    # индексы по user и table - составные, см. Meta.indexes
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="пользователь", help_text="пользователь",
-                             related_name="user", **NULLABLE)
+                             related_name="user", db_index=False, **NULLABLE)
     table = models.ForeignKey(Table, on_delete=models.CASCADE, verbose_name="столик", help_text="выберите столик",
-                              related_name="table")
+                              related_name="table", db_index=False)
     places = models.SmallIntegerField(verbose_name="Число бронируемых мест",
                                       help_text="Введите число бронируемых мест", default=2)
 
@@ -50,18 +84,130 @@ class Booking(models.Model):
     time_start = models.TimeField(verbose_name="начало бронирования", help_text="введите начало бронирования")
     time_end = models.TimeField(verbose_name="конец бронирования", help_text="введите конец бронирования")
 
+    # вычисляются из date_field, time_start, time_end при каждом сохранении (restaurant.signals)
+    starts_at = models.DateTimeField(verbose_name="начало бронирования (дата и время)", editable=False,
+                                     db_index=True)
+    ends_at = models.DateTimeField(verbose_name="конец бронирования (дата и время)", editable=False,
+                                   db_index=True)
+    # настоящий момент (UTC) напоминания в Telegram: начало по местному времени пользователя минус notification часов
+    notify_at = models.DateTimeField(verbose_name="время напоминания", editable=False, **NULLABLE)
+
     active = models.BooleanField(verbose_name="активно ли бронирование", default=True,
                                  help_text="введите активно ли бронирование")
+    # бронирование ожидает подтверждения по email и пока держит столик (снимается restaurant.tasks)
+    is_pending = models.BooleanField(verbose_name="ожидает ли бронирование подтверждения", default=False,
+                                     help_text="введите ожидает ли бронирование подтверждения")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="дата создания",
                                       help_text="введите дату создания бронирования")
 
     class Meta:
         verbose_name = "бронирование"
         verbose_name_plural = "бронирования"
+        constraints = [
+            # один столик не может быть занят двумя действующими бронированиями одновременно
+            ExclusionConstraint(
+                name="booking_table_period_excl",
+                expressions=[
+                    ("table", RangeOperators.EQUAL),
+                    (TsTzRange("starts_at", "ends_at", RangeBoundary()), RangeOperators.OVERLAPS),
+                ],
+                condition=Q(active=True) | Q(is_pending=True),
+                violation_error_message="В указанный период времени столик забронирован",
+            ),
+        ]
+        indexes = [
+            # поиск пересечений по столику (restaurant.availability)
+            models.Index(fields=["table", "starts_at", "ends_at"], name="booking_table_period_idx"),
+            # история бронирований пользователя, отсортированная по дате и времени
+            models.Index(fields=["user", "date_field", "time_start"], name="booking_user_date_idx"),
+            # напоминания в Telegram, которые пора отправить (restaurant.tasks.find_active_bookings)
+            models.Index(fields=["notify_at"], condition=Q(active=True, notify_at__isnull=False),
+                         name="booking_notify_at_idx"),
+        ]
 
     def __str__(self):
         return f"{self.pk}, {self.user} - {self.table}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # период при загрузке нужен, чтобы при переносе бронирования сбросить кеш старых суток
+        instance._loaded_period = (instance.__dict__.get("starts_at"), instance.__dict__.get("ends_at"))
+        # столик, период и удержание столика - по ним пересчитывается маска занятости (restaurant.signals)
+        instance._loaded_occupancy = occupancy_state(instance)
+        return instance
+
+    def save(self, *args, **kwargs):
+        # starts_at/ends_at/notify_at пересчитываются в pre_save, их нужно сохранить вместе с исходными полями
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if {"date_field", "time_start", "time_end"} & update_fields:
+                update_fields |= {"starts_at", "ends_at", "notify_at"}
+            if {"notification", "user"} & update_fields:
+                update_fields.add("notify_at")
+            kwargs["update_fields"] = update_fields
+        super().save(*args, **kwargs)
+
+    def set_period(self):
+        self.starts_at, self.ends_at = booking_period(self.date_field, self.time_start, self.time_end)
+
+    def set_notify_at(self):
+        # вызывается после set_period; без оповещения или пользователя напоминания нет
+        if not self.notification or self.user_id is None:
+            self.notify_at = None
+            return
+
+        try:
+            time_offset = self.user.time_offset
+        except User.DoesNotExist:
+            # при загрузке фикстур пользователь может появиться в базе позже бронирования
+            time_offset = User._meta.get_field("time_offset").default
+        self.notify_at = notify_time(self.starts_at, self.notification, time_offset)
+
+
+class TableDayOccupancy(models.Model):
+    # занятость столика за сутки битовыми масками по SLOT_MINUTES минут (restaurant.availability.occupancy):
+    # проверка пересечения - AND масок; пересчитывается сигналами при изменении бронирований
+    SLOT_MINUTES = 15
+    SLOTS_BYTES = 24 * 60 // SLOT_MINUTES // 8
+
+    table = models.ForeignKey(Table, on_delete=models.CASCADE, verbose_name="столик", related_name="occupancy",
+                              db_index=False)
+    day = models.DateField(verbose_name="дата")
+    slots = models.BinaryField(max_length=SLOTS_BYTES, verbose_name="занятые слоты")
+    confirmed = models.BinaryField(max_length=SLOTS_BYTES, verbose_name="слоты подтвержденных бронирований")
+
+    class Meta:
+        verbose_name = "занятость столика"
+        verbose_name_plural = "занятость столиков"
+        constraints = [
+            models.UniqueConstraint(fields=["table", "day"], name="occupancy_table_day_uniq"),
+        ]
+        indexes = [
+            # маски всех столиков за сутки (поиск свободных столиков)
+            models.Index(fields=["day"], name="occupancy_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.table_id} - {self.day}"
+
+    @property
+    def mask(self) -> int:
+        return int.from_bytes(self.slots, "big")
+
+    @mask.setter
+    def mask(self, value: int):
+        self.slots = value.to_bytes(self.SLOTS_BYTES, "big")
+
+    @property
+    def confirmed_mask(self) -> int:
+        return int.from_bytes(self.confirmed, "big")
+
+    @confirmed_mask.setter
+    def confirmed_mask(self, value: int):
+        self.confirmed = value.to_bytes(self.SLOTS_BYTES, "big")
+
 
 class ContentText(models.Model):
     title = models.CharField(max_length=150, verbose_name="контент-название",
@@ -132,11 +278,96 @@ class Contentlink(models.Model):
 
 class BookingToken(models.Model):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, verbose_name="бронирование",
-                                help_text="токен для восстановления пароля", related_name="user_token")
+                                help_text="токен для восстановления пароля", related_name="user_token",
+                                db_index=False)
 
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="дата создания",
                                       help_text="введите дату создания токена")
-    token = models.CharField(max_length=100, verbose_name="Token", **NULLABLE)
+    token = models.CharField(max_length=100, verbose_name="Token", unique=True, **NULLABLE)
+
+    class Meta:
+        indexes = [
+            # проверка неистекшего времени подтверждения бронирования (EXISTS по booking и created_at)
+            models.Index(fields=["booking", "created_at"], name="bookingtoken_created_idx"),
+        ]
+
+
+class NotificationOutbox(models.Model):
+    # напоминание в Telegram по подтвержденному бронированию; отправляется отложенной задачей Celery (task_id),
+    # которая забирает запись с арендой (locked_until), а при ошибке ставит себя повторно с задержкой
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+    STATUSES = (
+        (PENDING, "ожидает отправки"),
+        (SENT, "отправлено"),
+        (FAILED, "ошибка отправки"),
+        (SKIPPED, "не отправлялось"),
+    )
+
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, verbose_name="бронирование",
+                                related_name="notifications", db_index=False)
+    due_at = models.DateTimeField(verbose_name="время напоминания")
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, verbose_name="статус")
+    attempts = models.SmallIntegerField(default=0, verbose_name="число попыток")
+    available_at = models.DateTimeField(verbose_name="время следующей попытки")
+    locked_until = models.DateTimeField(verbose_name="занято воркером до", **NULLABLE)
+    sent_at = models.DateTimeField(verbose_name="время отправки", **NULLABLE)
+    last_error = models.TextField(verbose_name="последняя ошибка", **NULLABLE)
+    # id отложенной (eta) задачи Celery, которая отправит напоминание; задачи с другим id ничего не делают
+    task_id = models.CharField(max_length=50, verbose_name="id задачи Celery", **NULLABLE)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="дата создания")
+
+    class Meta:
+        verbose_name = "напоминание"
+        verbose_name_plural = "напоминания"
+        constraints = [
+            # одно напоминание на бронирование и момент отправки
+            models.UniqueConstraint(fields=["booking", "due_at"], name="notification_booking_due_uniq"),
+        ]
+        indexes = [
+            # очередь на отправку (restaurant.notifications.outbox)
+            models.Index(fields=["available_at"], condition=Q(status="pending"), name="notification_available_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.booking_id} - {self.due_at} ({self.status})"
+
+
+class MailOutbox(models.Model):
+    # письмо, записанное в той же транзакции, что и бронирование или пользователь; после коммита его отправляет
+    # задача relay_mail пакетом через одно SMTP-соединение (restaurant.notifications.mail)
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, "ожидает отправки"),
+        (SENT, "отправлено"),
+        (FAILED, "ошибка отправки"),
+    )
+
+    subject = models.CharField(max_length=255, verbose_name="тема")
+    message = models.TextField(verbose_name="текст")
+    recipient_list = models.JSONField(verbose_name="получатели")
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, verbose_name="статус")
+    attempts = models.SmallIntegerField(default=0, verbose_name="число попыток")
+    available_at = models.DateTimeField(verbose_name="время следующей попытки")
+    locked_until = models.DateTimeField(verbose_name="занято воркером до", **NULLABLE)
+    sent_at = models.DateTimeField(verbose_name="время отправки", **NULLABLE)
+    last_error = models.TextField(verbose_name="последняя ошибка", **NULLABLE)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="дата создания")
+
+    class Meta:
+        verbose_name = "письмо"
+        verbose_name_plural = "письма"
+        indexes = [
+            # очередь на отправку (restaurant.notifications.mail)
+            models.Index(fields=["available_at"], condition=Q(status="pending"), name="mail_available_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} - {', '.join(self.recipient_list)} ({self.status})"
 
 
 class Questions(models.Model):
@@ -0,0 +1,166 @@
+import logging
+import smtplib
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from restaurant.models import MailOutbox
+
+logger = logging.getLogger(__name__)
+
+# письма копятся в MailOutbox MAIL_BATCH_WINDOW секунд и уходят пакетом через одно SMTP-соединение
+MAIL_BATCH_WINDOW = 2
+MAIL_BATCH_SIZE = 200
+MAIL_RELAY_LOCK = "lock:relay_mail"
+MAIL_LEASE = timedelta(minutes=5)
+# повторы при недоступном SMTP-сервере: 1, 2, 4 минуты...; после MAIL_MAX_ATTEMPTS попыток - ошибка
+MAIL_RETRY_DELAY = timedelta(minutes=1)
+MAIL_MAX_RETRY_DELAY = timedelta(hours=1)
+MAIL_MAX_ATTEMPTS = 5
+# простаивающее дольше соединение закрывается заранее: серверы обычно рвут его сами через пару минут
+MAIL_CONNECTION_MAX_IDLE = 60
+
+
+class PersistentMailConnection:
+    """SMTP-соединение процесса воркера: открывается при первой отправке и переиспользуется между задачами"""
+
+    def __init__(self, max_idle=MAIL_CONNECTION_MAX_IDLE, clock=time.monotonic, **kwargs):
+        self.max_idle = max_idle
+        self.clock = clock
+        self.kwargs = kwargs
+        self.connection = None
+        self.used = 0.0
+        self.lock = threading.Lock()
+
+    def open(self):
+        if self.connection is not None and self.clock() - self.used > self.max_idle:
+            self.close()
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False, **self.kwargs)
+        # открытое соединение send_messages не закрывает после отправки
+        self.connection.open()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def send_once(self, message) -> bool:
+        self.open()
+        try:
+            sent = self.connection.send_messages([message]) == 1
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as error:
+            # 421 - сервер закрывает соединение; остальное - отказ принять именно это письмо (адрес, размер),
+            # остальные письма пакета он не задерживает
+            if getattr(error, "smtp_code", None) == 421:
+                raise
+            logger.warning("письмо не принято: %s - %s", message.to, error)
+            return False
+        self.used = self.clock()
+        return sent
+
+    def send(self, message) -> bool:
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    return self.send_once(message)
+                except OSError:
+                    # разрыв соединения (например, сервер закрыл простаивавшее) - переподключение и повтор
+                    self.close()
+                    if attempt:
+                        raise
+
+    def send_messages(self, messages) -> int:
+        return sum(self.send(message) for message in messages)
+
+
+mail_connection = PersistentMailConnection()
+
+
+def mail_message(subject, message, recipient_list) -> EmailMessage:
+    return EmailMessage(subject=str(subject), body=str(message), from_email=settings.EMAIL_HOST_USER,
+                        to=list(recipient_list))
+
+
+def queue_mail(subject, message, recipient_list) -> MailOutbox:
+    # письмо записывается в текущей транзакции (откат - письма нет), задача отправки ставится после коммита
+    mail = MailOutbox.objects.create(subject=str(subject), message=str(message),
+                                     recipient_list=list(recipient_list), available_at=timezone.now())
+    transaction.on_commit(dispatch_relay)
+    return mail
+
+
+def dispatch_relay():
+    # одна задача на окно MAIL_BATCH_WINDOW; недоступный брокер не ломает запрос - письмо останется
+    # в очереди, и его заберет периодический запуск relay_mail
+    from restaurant.tasks import relay_mail
+
+    # без общего кеша (Redis) блокировка видна только своему процессу - задача ставится на каждое письмо
+    if settings.CACHE_ENABLED and not cache.add(MAIL_RELAY_LOCK, 1, timeout=MAIL_BATCH_WINDOW * 5):
+        return
+    try:
+        relay_mail.apply_async(countdown=MAIL_BATCH_WINDOW, retry=False)
+    except Exception as error:
+        cache.delete(MAIL_RELAY_LOCK)
+        logger.error("задача отправки писем не поставлена: %s", error)
+
+
+def claim_mail(now, limit) -> list:
+    # SELECT ... FOR UPDATE SKIP LOCKED: параллельные задачи забирают разные письма
+    with transaction.atomic():
+        pks = list(MailOutbox.objects.select_for_update(skip_locked=True)
+                   .filter(status=MailOutbox.PENDING, available_at__lte=now)
+                   .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))
+                   .order_by("available_at").values_list("pk", flat=True)[:limit])
+        MailOutbox.objects.filter(pk__in=pks).update(locked_until=now + MAIL_LEASE, attempts=F("attempts") + 1)
+
+    return list(MailOutbox.objects.filter(pk__in=pks).order_by("available_at"))
+
+
+def finish_mail(mail, **fields) -> bool:
+    # запись обновляется, только если аренда все еще наша
+    return MailOutbox.objects.filter(pk=mail.pk, locked_until=mail.locked_until).update(
+        locked_until=None, **fields) == 1
+
+
+def retry_mail(mail, now, error):
+    if mail.attempts >= MAIL_MAX_ATTEMPTS:
+        finish_mail(mail, status=MailOutbox.FAILED, last_error=str(error))
+    else:
+        delay = min(MAIL_RETRY_DELAY * 2 ** (mail.attempts - 1), MAIL_MAX_RETRY_DELAY)
+        finish_mail(mail, available_at=now + delay, last_error=str(error))
+
+
+def relay_mail_batch(now=None, limit=MAIL_BATCH_SIZE, connection=None) -> tuple[int, int]:
+    # блокировка снимается до чтения очереди: письмо, записанное после, либо попадет в этот пакет,
+    # либо поставит новую задачу; возвращает (забрано писем, отправлено)
+    cache.delete(MAIL_RELAY_LOCK)
+    now = now or timezone.now()
+    connection = connection or mail_connection
+
+    mails = claim_mail(now, limit)
+    sent = 0
+    for number, mail in enumerate(mails):
+        try:
+            accepted = connection.send(mail_message(mail.subject, mail.message, mail.recipient_list))
+        except Exception as error:
+            # SMTP-сервер недоступен и после переподключения - остаток пакета откладывается целиком
+            for rest in mails[number:]:
+                retry_mail(rest, now, error)
+            break
+
+        if accepted:
+            sent += finish_mail(mail, status=MailOutbox.SENT, sent_at=timezone.now(), last_error=None)
+        else:
+            finish_mail(mail, status=MailOutbox.FAILED, last_error="письмо не принято сервером")
+    return len(mails), sent
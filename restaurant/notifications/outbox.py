@@ -0,0 +1,213 @@
+from datetime import timedelta
+from uuid import uuid4
+
+from celery import current_app
+from django.db import transaction
+from django.db.models import Exists, OuterRef, F, Q
+from django.utils import timezone
+
+from restaurant.models import NotificationOutbox
+from restaurant.notifications.telegram import send_batch_async
+from restaurant.services import send_telegram_message
+from restaurant.utils.parameters import get_parameters
+from restaurant.utils.utils import get_due_notifications
+
+# на сколько запись закрепляется за воркером, который ее отправляет
+OUTBOX_LEASE = timedelta(minutes=2)
+# повторы при ошибке: 30 секунд, 1, 2, 4 минуты...; после OUTBOX_MAX_ATTEMPTS попыток - ошибка
+OUTBOX_RETRY_DELAY = timedelta(seconds=30)
+OUTBOX_MAX_RETRY_DELAY = timedelta(minutes=15)
+OUTBOX_MAX_ATTEMPTS = 5
+# опоздавшее больше чем на час напоминание уже не отправляется
+REMINDER_TTL = timedelta(hours=1)
+# сколько просроченных напоминаний отправляется одним пакетом (асинхронно, TELEGRAM_CONCURRENCY запросов
+# одновременно); от OUTBOX_BURST_SIZE ожидающих напоминаний всплеск отправляется пакетом, а не задачами по одной
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_BURST_SIZE = 20
+
+
+def reminder_message(booking):
+    return (f"Вы забронировали столик [{booking.table}]: Время: [{booking.time_start} - {booking.time_end}], "
+            f"дата: [{booking.date_field}]")
+
+
+def revoke_task(task_id):
+    # отзыв - только оптимизация: задача с устаревшим task_id и так ничего не сделает
+    def revoke():
+        try:
+            current_app.control.revoke(task_id)
+        except Exception:
+            pass
+
+    transaction.on_commit(revoke)
+
+
+def schedule_notification(notification):
+    # новая отложенная задача на available_at; предыдущая задача записи отзывается
+    from restaurant.tasks import send_reminder
+
+    if notification.task_id:
+        revoke_task(notification.task_id)
+
+    task_id = str(uuid4())
+    NotificationOutbox.objects.filter(pk=notification.pk).update(task_id=task_id)
+    notification.task_id = task_id
+
+    pk, eta = notification.pk, notification.available_at
+    transaction.on_commit(lambda: send_reminder.apply_async((pk,), eta=eta, task_id=task_id))
+
+
+def sync_notification(booking):
+    # приводит очередь в соответствие с бронированием: одна ожидающая запись на notify_at
+    # подтвержденного бронирования; уже отправленные записи не трогаются, у удаленных отзывается задача
+    pending = NotificationOutbox.objects.filter(booking=booking, status=NotificationOutbox.PENDING)
+    if not booking.active or booking.notify_at is None:
+        pending.delete()
+        return
+
+    pending.exclude(due_at=booking.notify_at).delete()
+    notification, created = NotificationOutbox.objects.get_or_create(
+        booking=booking, due_at=booking.notify_at, defaults={"available_at": booking.notify_at})
+    if created:
+        schedule_notification(notification)
+
+
+def claim_notification(pk, task_id, now):
+    # SELECT ... FOR UPDATE SKIP LOCKED: запись забирает только задача, на которую она назначена,
+    # и только если аренда свободна; повторно доставленная брокером задача получит None
+    with transaction.atomic():
+        claimed = list(NotificationOutbox.objects.select_for_update(skip_locked=True)
+                       .filter(pk=pk, task_id=task_id, status=NotificationOutbox.PENDING, available_at__lte=now)
+                       .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now)).values_list("pk", flat=True))
+        if not claimed:
+            return None
+        NotificationOutbox.objects.filter(pk=pk).update(locked_until=now + OUTBOX_LEASE, attempts=F("attempts") + 1)
+
+    return NotificationOutbox.objects.select_related("booking__user", "booking__table").get(pk=pk)
+
+
+def finish_notification(notification, **fields) -> bool:
+    # запись обновляется, только если аренда все еще наша (не истекла и не перехвачена другим воркером)
+    return NotificationOutbox.objects.filter(pk=notification.pk, locked_until=notification.locked_until).update(
+        locked_until=None, **fields) == 1
+
+
+def prepare_notification(notification, now):
+    # chat-id для отправки или None, если напоминание уже не нужно (запись закрывается как пропущенная)
+    booking = notification.booking
+    chat_id = booking.user.tg_chat_id if booking.user else None
+
+    if not booking.active or not chat_id:
+        finish_notification(notification, status=NotificationOutbox.SKIPPED, last_error="нет Telegram chat-id")
+        return None
+    if now > notification.due_at + REMINDER_TTL:
+        finish_notification(notification, status=NotificationOutbox.SKIPPED, last_error="напоминание устарело")
+        return None
+    return chat_id
+
+
+def fail_notification(notification, now, error):
+    if notification.attempts >= OUTBOX_MAX_ATTEMPTS:
+        finish_notification(notification, status=NotificationOutbox.FAILED, last_error=str(error))
+        return
+
+    delay = min(OUTBOX_RETRY_DELAY * 2 ** (notification.attempts - 1), OUTBOX_MAX_RETRY_DELAY)
+    # Telegram сам сообщает, когда можно повторить (429 retry_after)
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after:
+        delay = max(delay, timedelta(seconds=retry_after))
+    notification.available_at = now + delay
+    if finish_notification(notification, available_at=notification.available_at, last_error=str(error)):
+        schedule_notification(notification)
+
+
+def deliver_notification(notification, now) -> bool:
+    chat_id = prepare_notification(notification, now)
+    if chat_id is None:
+        return False
+
+    try:
+        send_telegram_message(chat_id, reminder_message(notification.booking))
+    except Exception as error:
+        fail_notification(notification, now, error)
+        return False
+
+    return finish_notification(notification, status=NotificationOutbox.SENT, sent_at=timezone.now(),
+                               last_error=None)
+
+
+def deliver_scheduled_notification(pk, task_id, now=None) -> bool:
+    now = now or timezone.now()
+    notification = claim_notification(pk, task_id, now)
+    if notification is None:
+        return False
+    return deliver_notification(notification, now)
+
+
+def claim_due_notifications(now, limit) -> list:
+    # просроченные записи независимо от task_id (задачи потеряны или воркеры стояли);
+    # аренда не дает одновременно отправить запись и пакетом, и ее отложенной задачей
+    with transaction.atomic():
+        pks = list(NotificationOutbox.objects.select_for_update(skip_locked=True)
+                   .filter(status=NotificationOutbox.PENDING, available_at__lte=now)
+                   .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))
+                   .order_by("available_at").values_list("pk", flat=True)[:limit])
+        NotificationOutbox.objects.filter(pk__in=pks).update(locked_until=now + OUTBOX_LEASE,
+                                                             attempts=F("attempts") + 1)
+
+    return list(NotificationOutbox.objects.select_related("booking__user", "booking__table").filter(pk__in=pks))
+
+
+def deliver_due_notifications(now=None, limit=OUTBOX_BATCH_SIZE) -> tuple[int, int]:
+    # пакетная отправка наступивших напоминаний асинхронным клиентом; возвращает (забрано записей, отправлено)
+    now = now or timezone.now()
+    notifications = claim_due_notifications(now, limit)
+    ready = [(notification, chat_id) for notification in notifications
+             if (chat_id := prepare_notification(notification, now)) is not None]
+
+    results = send_batch_async([(chat_id, reminder_message(n.booking)) for n, chat_id in ready]) if ready else []
+    sent = 0
+    for (notification, chat_id), result in zip(ready, results):
+        if isinstance(result, Exception):
+            fail_notification(notification, now, result)
+        else:
+            sent += finish_notification(notification, status=NotificationOutbox.SENT, sent_at=timezone.now(),
+                                        last_error=None)
+    return len(notifications), sent
+
+
+def has_backlog(now) -> bool:
+    # наступивших и никем не занятых напоминаний не меньше OUTBOX_BURST_SIZE (индекс notification_available_idx)
+    return (NotificationOutbox.objects.filter(status=NotificationOutbox.PENDING, available_at__lte=now)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))[OUTBOX_BURST_SIZE - 1:].exists())
+
+
+def reconcile_horizon() -> timedelta:
+    # дальше срока предварительного бронирования напоминаний быть не может
+    return timedelta(days=get_parameters().period_of_booking + 1)
+
+
+def reconcile_notifications(now, horizon, reschedule=True) -> tuple[int, int, int]:
+    # восстановление после потери задач (очистка брокера): создает недостающие записи для напоминаний
+    # в (now - REMINDER_TTL, now + horizon], заново ставит задачи ожидающим записям, а уже просроченные
+    # отправляет пакетом одной задачей; возвращает (создано, поставлено задач, просрочено);
+    # reschedule=False (по расписанию) - задачи ставятся только записям, у которых их еще не было
+    from restaurant.tasks import send_due_reminders
+
+    queued = NotificationOutbox.objects.filter(booking=OuterRef("pk"), due_at=OuterRef("notify_at"))
+    bookings = get_due_notifications(now - REMINDER_TTL, now + horizon).filter(~Exists(queued))
+    created = len(NotificationOutbox.objects.bulk_create(
+        [NotificationOutbox(booking=b, due_at=b.notify_at, available_at=b.notify_at) for b in bookings],
+        ignore_conflicts=True))
+
+    pending = NotificationOutbox.objects.filter(status=NotificationOutbox.PENDING)
+    scheduled = 0
+    unscheduled = pending if reschedule else pending.filter(task_id__isnull=True)
+    for notification in unscheduled.filter(available_at__gt=now).iterator():
+        schedule_notification(notification)
+        scheduled += 1
+
+    overdue = pending.filter(available_at__lte=now).count()
+    if overdue:
+        transaction.on_commit(send_due_reminders.delay)
+    return created, scheduled, overdue
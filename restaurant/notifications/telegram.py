@@ -0,0 +1,276 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+# повторы при 429/5xx и ошибке соединения; ожидание retry_after дольше MAX_RETRY_AFTER секунд
+# не блокирует воркер - ошибка уходит наверх, и повтор планирует очередь напоминаний
+MAX_RETRIES = 3
+MAX_RETRY_AFTER = 30
+RETRY_DELAY = 0.5
+# соединений в одном пуле httpx асинхронного клиента
+CONNECTIONS_PER_POOL = 8
+# сколько корзин по чатам держится в памяти процесса
+MAX_CHAT_BUCKETS = 10000
+
+
+class TelegramError(Exception):
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Ограничение частоты: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # забирает токен и возвращает, сколько секунд ждать до его появления;
+        # долг (tokens < 0) выстраивает конкурирующие потоки в очередь
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class BaseTelegramClient:
+    # общее для синхронного и асинхронного клиентов: лимиты и разбор ответов Bot API
+
+    def __init__(self, base_url, token, timeout=(3.05, 10), rate=30, chat_rate=1, max_retries=MAX_RETRIES,
+                 max_retry_after=MAX_RETRY_AFTER, clock=time.monotonic):
+        self.url = f"{base_url}{token}/"
+        self.timeout = timeout
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.clock = clock
+
+        # у Telegram лимиты ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+        self.bucket = TokenBucket(rate, capacity=rate, clock=clock)
+        self.chat_buckets = OrderedDict()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def chat_bucket(self, chat_id) -> TokenBucket:
+        with self.lock:
+            bucket = self.chat_buckets.pop(chat_id, None) or TokenBucket(self.chat_rate, clock=self.clock)
+            self.chat_buckets[chat_id] = bucket
+            if len(self.chat_buckets) > MAX_CHAT_BUCKETS:
+                self.chat_buckets.popitem(last=False)
+        return bucket
+
+    def throttle_delay(self, chat_id) -> float:
+        return max(self.bucket.reserve(), self.chat_bucket(chat_id).reserve(), self.paused_until - self.clock())
+
+    def parse_response(self, status, reason, content, attempt):
+        # (повторить, результат): при повторе результат - пауза перед ним в секундах;
+        # неповторяемая ошибка или исчерпанные попытки - TelegramError
+        try:
+            data = json.loads(content)
+        except ValueError:
+            data = {}
+        if 200 <= status < 300 and data.get("ok", True):
+            return False, data.get("result")
+
+        description = data.get("description") or reason
+        retry_after = (data.get("parameters") or {}).get("retry_after")
+        if status != 429 and status < 500:
+            raise TelegramError(description, status)
+        if attempt == self.max_retries or (retry_after or 0) > self.max_retry_after:
+            raise TelegramError(description, status, retry_after)
+
+        if retry_after:
+            # превышен лимит бота - ждут все отправки процесса, а не только получившая 429
+            self.paused_until = max(self.paused_until, self.clock() + retry_after)
+            return True, 0
+        return True, RETRY_DELAY * 2 ** attempt
+
+    def connection_retry(self, error, attempt) -> float:
+        # запрос не дошел до Telegram - повтор безопасен; при таймауте чтения сообщение
+        # могло быть доставлено, поэтому такие ошибки не повторяются
+        if attempt == self.max_retries:
+            raise TelegramError(str(error)) from error
+        return RETRY_DELAY * 2 ** attempt
+
+
+class TelegramClient(BaseTelegramClient):
+    """Клиент Bot API: одна keep-alive сессия на процесс, лимиты на бота и на чат, повторы по retry_after"""
+
+    def __init__(self, base_url, token, pool_size=10, sleep=time.sleep, **kwargs):
+        super().__init__(base_url, token, **kwargs)
+        self.pool_size = pool_size
+        self.sleep = sleep
+        self._session = None
+
+    @property
+    def session(self):
+        # сессия создается при первой отправке - уже в процессе воркера, а не до fork
+        if self._session is None:
+            with self.lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def close(self):
+        with self.lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def call(self, method, chat_id, **params):
+        import requests
+
+        for attempt in range(self.max_retries + 1):
+            delay = self.throttle_delay(chat_id)
+            if delay > 0:
+                self.sleep(delay)
+            try:
+                response = self.session.post(self.url + method, json={"chat_id": chat_id, **params},
+                                             timeout=self.timeout)
+            except requests.ConnectionError as error:
+                self.sleep(self.connection_retry(error, attempt))
+                continue
+            except requests.RequestException as error:
+                raise TelegramError(str(error)) from error
+
+            retry, result = self.parse_response(response.status_code, response.reason, response.content, attempt)
+            if not retry:
+                return result
+            if result:
+                self.sleep(result)
+
+    def send_message(self, chat_id, text):
+        return self.call("sendMessage", chat_id, text=text)
+
+    def send_batch(self, messages) -> list:
+        # messages - пары (chat_id, text); результат по порядку: ответ Telegram или TelegramError,
+        # ошибка одного сообщения не прерывает отправку остальных
+        messages = list(messages)
+
+        def send(message):
+            try:
+                return self.send_message(*message)
+            except TelegramError as error:
+                return error
+
+        if len(messages) <= 1:
+            return [send(message) for message in messages]
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(messages))) as executor:
+            return list(executor.map(send, messages))
+
+
+class AsyncTelegramClient(BaseTelegramClient):
+    """Асинхронный клиент (httpx) для больших пакетов: до concurrency запросов одновременно в одном потоке"""
+
+    def __init__(self, base_url, token, concurrency=50, sleep=None, **kwargs):
+        super().__init__(base_url, token, **kwargs)
+        self.concurrency = concurrency
+        self.sleep = sleep or asyncio.sleep
+        self.clients = []
+
+    async def __aenter__(self):
+        import httpx
+
+        # пул соединений httpcore перебирает все соединения на каждый запрос, и при 50 соединениях в одном
+        # пуле отправка упирается в процессор; поэтому несколько небольших пулов, чат закреплен за одним из них
+        connect, read = self.timeout
+        pools = -(-self.concurrency // CONNECTIONS_PER_POOL)
+        size = -(-self.concurrency // pools)
+        self.clients = [httpx.AsyncClient(timeout=httpx.Timeout(read, connect=connect),
+                                          limits=httpx.Limits(max_connections=size, max_keepalive_connections=size))
+                        for _ in range(pools)]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for client in self.clients:
+            await client.aclose()
+        self.clients = []
+
+    async def call(self, method, chat_id, **params):
+        import httpx
+
+        for attempt in range(self.max_retries + 1):
+            delay = self.throttle_delay(chat_id)
+            if delay > 0:
+                await self.sleep(delay)
+            try:
+                client = self.clients[hash(str(chat_id)) % len(self.clients)]
+                response = await client.post(self.url + method, json={"chat_id": chat_id, **params})
+            except (httpx.ConnectError, httpx.ConnectTimeout) as error:
+                await self.sleep(self.connection_retry(error, attempt))
+                continue
+            except httpx.HTTPError as error:
+                raise TelegramError(str(error)) from error
+
+            retry, result = self.parse_response(response.status_code, response.reason_phrase, response.content,
+                                                attempt)
+            if not retry:
+                return result
+            if result:
+                await self.sleep(result)
+
+    async def send_message(self, chat_id, text):
+        return await self.call("sendMessage", chat_id, text=text)
+
+    async def send_batch(self, messages) -> list:
+        # то же, что TelegramClient.send_batch, но конкурентность ограничивается семафором, а не потоками
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(message):
+            async with semaphore:
+                try:
+                    return await self.send_message(*message)
+                except TelegramError as error:
+                    return error
+
+        return await asyncio.gather(*(send(message) for message in messages))
+
+
+def client_options() -> dict:
+    return {"timeout": settings.TELEGRAM_TIMEOUT, "rate": settings.TELEGRAM_RATE,
+            "chat_rate": settings.TELEGRAM_CHAT_RATE}
+
+
+_client = None
+
+
+def get_client() -> TelegramClient:
+    global _client
+    if _client is None:
+        _client = TelegramClient(settings.TELEGRAM_URL, settings.TELEGRAM_TOKEN, **client_options())
+    return _client
+
+
+def send_batch_async(messages, concurrency=None) -> list:
+    # синхронная обертка для задач Celery: пакет отправляется в собственном цикле событий,
+    # клиент (и пул соединений httpx) живет столько же, сколько цикл
+    async def run():
+        async with AsyncTelegramClient(settings.TELEGRAM_URL, settings.TELEGRAM_TOKEN,
+                                       concurrency=concurrency or settings.TELEGRAM_CONCURRENCY,
+                                       **client_options()) as client:
+            return await client.send_batch(messages)
+
+    return asyncio.run(run())
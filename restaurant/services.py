@@ -1,27 +1,15 @@
 # from django.contrib.sites import requests
-from django.core.mail import send_mail
-from config.settings import EMAIL_HOST_USER
-from config import settings
-import requests
+from restaurant.notifications.mail import mail_connection, mail_message
+from restaurant.notifications.telegram import get_client
 
 
 def send_telegram_message(chat_id, message):
     """Функция отправки сообщения в телеграм"""
-
-    params = {
-        "text": message,
-        "chat_id": chat_id,
-    }
-    requests.get(f"{settings.TELEGRAM_URL}{settings.TELEGRAM_TOKEN}/sendMessage", params=params)
+    # общий клиент процесса: keep-alive соединения, таймауты, лимиты и повторы по retry_after;
+    # ошибка Telegram API - исключение, чтобы очередь напоминаний повторила отправку
+    return get_client().send_message(chat_id, message)
 
 
 def send_email_message(subject, message, recipient_list):
-    print(f"subject = {subject}, message = {message}, from_email (EMAIL_HOST_USER) = {EMAIL_HOST_USER}, "
-          f"recipient_list = {recipient_list}")
-
-    send_mail(
-        subject=subject,
-        message=str(message),
-        from_email=EMAIL_HOST_USER,
-        recipient_list=recipient_list
-    )
+    # через SMTP-соединение воркера: без нового подключения и TLS-рукопожатия на каждое письмо
+    return mail_connection.send(mail_message(subject, message, recipient_list))
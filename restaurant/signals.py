@@ -0,0 +1,114 @@
+from datetime import timedelta
+
+from django.db.models import F, Value, ExpressionWrapper, DurationField, OuterRef, Subquery
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from restaurant.availability.occupancy import refresh_occupancy, table_days
+from restaurant.models import Booking, BookingToken, ContentText, ContentImage, Contentlink, ContentParameters, \
+    NotificationOutbox, occupancy_state
+from restaurant.notifications.outbox import sync_notification, revoke_task, schedule_notification
+from restaurant.templates.restaurant.services import cache_delete_bookings
+from restaurant.utils.content import content_changed
+from restaurant.utils.parameters import parameters_service
+from users.models import User
+
+
+@receiver(pre_save, sender=Booking)
+def booking_set_period(sender, instance, **kwargs):
+    # пересчет starts_at/ends_at и notify_at, в том числе при загрузке фикстур (raw=True)
+    instance.set_period()
+    instance.set_notify_at()
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def booking_cache_delete(sender, instance, **kwargs):
+    cache_delete_bookings(instance)
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def booking_occupancy_refresh(sender, instance, **kwargs):
+    # маски занятости столика пересчитываются только для затронутых суток и только если изменились
+    # столик, период, удержание столика или подтверждение (оно заполняет маску confirmed)
+    state = occupancy_state(instance)
+    loaded = getattr(instance, "_loaded_occupancy", None)
+    if kwargs.get("created") is False and state == loaded:
+        return
+
+    keys = set()
+    for table_id, starts_at, ends_at, *_ in {state, loaded or state}:
+        if table_id is not None and starts_at is not None and ends_at is not None:
+            keys |= table_days(table_id, starts_at, ends_at)
+    refresh_occupancy(keys)
+    instance._loaded_occupancy = state
+
+
+@receiver(post_save, sender=Booking)
+def booking_notification_sync(sender, instance, raw=False, **kwargs):
+    # подтверждение, перенос или отмена бронирования ставит, переносит или снимает напоминание
+    if not raw:
+        sync_notification(instance)
+
+
+@receiver(post_delete, sender=NotificationOutbox)
+def notification_task_revoke(sender, instance, **kwargs):
+    # удаление бронирования (каскадом) или перенос напоминания снимает его отложенную задачу
+    if instance.task_id and instance.status == NotificationOutbox.PENDING:
+        revoke_task(instance.task_id)
+
+
+@receiver(post_save, sender=User)
+def user_notify_at_update(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # смена часового пояса сдвигает напоминания по еще не начавшимся бронированиям пользователя (одним UPDATE);
+    # остальные сохранения пользователя (профиль, токены, подтверждение) ничего не пересчитывают
+    loaded = getattr(instance, "_loaded_time_offset", None)
+    instance._loaded_time_offset = instance.time_offset
+    if created or raw or (update_fields is not None and "time_offset" not in update_fields):
+        return
+    if loaded == instance.time_offset:
+        return
+
+    hours = ExpressionWrapper((F("notification") + Value(instance.time_offset)) * Value(timedelta(hours=1)),
+                              output_field=DurationField())
+    Booking.objects.filter(user=instance, notify_at__isnull=False,
+                           starts_at__gt=timezone.now() - timedelta(days=1)).update(notify_at=F("starts_at") - hours)
+
+    # ожидающие отправки напоминания переносятся вслед за notify_at
+    notify_at = Subquery(Booking.objects.filter(pk=OuterRef("booking_id")).values("notify_at")[:1])
+    pending = NotificationOutbox.objects.filter(booking__user=instance, status=NotificationOutbox.PENDING)
+    pending.update(due_at=notify_at, available_at=notify_at)
+
+    # и получают новые отложенные задачи (ставятся после коммита): задача со старым eta отсекается
+    # новым task_id, иначе при сдвиге позже она сработала бы раньше срока и напоминание потерялось бы
+    for notification in pending.only("pk", "task_id", "available_at"):
+        schedule_notification(notification)
+
+
+@receiver(post_save, sender=BookingToken)
+@receiver(post_delete, sender=BookingToken)
+def booking_token_cache_delete(sender, instance, **kwargs):
+    # токен меняет статус "ожидает подтверждения" в кеше суток
+    try:
+        cache_delete_bookings(instance.booking)
+    except Booking.DoesNotExist:
+        pass
+
+
+@receiver(post_save, sender=ContentText)
+@receiver(post_delete, sender=ContentText)
+@receiver(post_save, sender=ContentImage)
+@receiver(post_delete, sender=ContentImage)
+@receiver(post_save, sender=Contentlink)
+@receiver(post_delete, sender=Contentlink)
+def content_version_bump(sender, **kwargs):
+    content_changed()
+
+
+@receiver(post_save, sender=ContentParameters)
+@receiver(post_delete, sender=ContentParameters)
+def parameters_version_bump(sender, **kwargs):
+    # изменение параметров в админке применяется без перезапуска процессов
+    parameters_service.changed()
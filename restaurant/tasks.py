@@ -1,55 +1,75 @@
-from datetime import datetime, timedelta
 from celery import shared_task
+from django.core.cache import cache
+from django.utils import timezone
 
+from restaurant.availability.engine import release_expired_bookings
+from restaurant.notifications.mail import relay_mail_batch, MAIL_BATCH_SIZE
+from restaurant.notifications.outbox import deliver_scheduled_notification, deliver_due_notifications, has_backlog, \
+    reconcile_notifications, reconcile_horizon, OUTBOX_BATCH_SIZE
 from restaurant.services import send_telegram_message, send_email_message
-from restaurant.utils.utils import get_actual_bookings, time_segment
+from restaurant.utils.parameters import get_parameters
+
+# не больше одной задачи пакетной отправки на всплеск
+BURST_LOCK_KEY = "lock:send_due_reminders"
+BURST_LOCK_TIMEOUT = 30
 
 
 @shared_task
 def send_information_about_bookings(message, tg_chat_id):
     """Отправляет сообщение пользователю о поставленном лайке"""
-    send_telegram_message(message, tg_chat_id)
+    send_telegram_message(tg_chat_id, message)
 
 
 @shared_task
 def celery_send_mail(subject, message, recipient_list):
     send_email_message(subject, message, recipient_list)
-    #
-    # send_mail(
-    #     subject=subject,
-    #     message=message,
-    #     from_email=from_email,
-    #     recipient_list=recipient_list
-    # )
 
 
 @shared_task
-def find_active_bookings():
-    utc_time = datetime.now().replace(second=0, microsecond=0)
-
-    # там уже есть актуальное время
-    bookings = get_actual_bookings(active=True, time_start=True).filter(notification__in=[1, 2, 3])
-
-    # получим местное время через user
-    for b in bookings:
-        start = (time_segment(b.date_field, b.time_start, b.time_end)[0] - timedelta(hours=b.notification))
-        notification = (start - timedelta(hours=b.notification)).replace(second=0, microsecond=0)
-        time = (utc_time + timedelta(hours=b.user.time_offset)).replace(second=0, microsecond=0)
-
-        print(f"start {start}, time{time}, notification {notification}")
-
-        tg_chat_id = b.user.tg_chat_id
-
-        if tg_chat_id is not None:
-            if notification == time:
-                message = (f"Вы забронировали столик [{b.table}]: Время: [{b.time_start} - {b.time_end}], "
-                           f"дата: [{b.date_field}]")
-                send_information_about_bookings.delay(message, tg_chat_id)
-            # # использовал для проверки работы программы
-            # else:
-            #     message = f"start {start}, time{time}, notification {notification}"
-
-            send_information_about_bookings.delay(tg_chat_id, message)
-        # # использовал для проверки работы программы
-        # else:
-        # send_information_about_bookings.delay("1567728836",f"No telegram for User {b.user}")
+def relay_mail():
+    # пакет писем из MailOutbox через одно SMTP-соединение воркера; ставится после коммита (queue_mail)
+    # и раз в минуту по расписанию - для писем, задача которых не была поставлена;
+    # полный пакет - возможно, осталось еще, следующий пакет отдельной задачей
+    taken, sent = relay_mail_batch()
+    if taken == MAIL_BATCH_SIZE:
+        relay_mail.delay()
+    return sent
+
+
+@shared_task(bind=True)
+def send_reminder(self, notification_pk):
+    # отложенная (eta) задача напоминания в Telegram, ставится при подтверждении бронирования
+    # (restaurant/notifications/outbox.py); устаревшие и повторные задачи ничего не отправляют
+    delivered = deliver_scheduled_notification(notification_pk, self.request.id)
+
+    # всплеск (все бронирования на 19:00 - напоминания в 18:00) отправляется одной асинхронной задачей,
+    # оставшиеся задачи всплеска найдут свои записи уже отправленными или занятыми
+    if has_backlog(timezone.now()) and cache.add(BURST_LOCK_KEY, 1, timeout=BURST_LOCK_TIMEOUT):
+        send_due_reminders.delay()
+    return delivered
+
+
+@shared_task
+def send_due_reminders():
+    # пакетная асинхронная отправка наступивших напоминаний (всплеск или команда reconcile_reminders);
+    # полный пакет - возможно, осталось еще, следующий пакет отдельной задачей
+    claimed, sent = deliver_due_notifications()
+    if claimed == OUTBOX_BATCH_SIZE:
+        send_due_reminders.delay()
+    return sent
+
+
+@shared_task
+def reconcile_reminders():
+    # по расписанию: задачи для ожидающих напоминаний без задачи (записи из миграции, подтверждения в обход save())
+    # и пакетная отправка просроченных; уже поставленные задачи не переставляются - это делает
+    # manage.py reconcile_reminders после очистки брокера
+    created, scheduled, overdue = reconcile_notifications(timezone.now(), reconcile_horizon(), reschedule=False)
+    return scheduled
+
+
+@shared_task
+def release_expired_holds():
+    # неподтвержденные вовремя бронирования перестают занимать столик (ограничение booking_table_period_excl)
+    time_border = timezone.now() - get_parameters().confirm_delta
+    return release_expired_bookings(time_border)
@@ -1,52 +1,114 @@
-from django.core.cache import cache
+import zlib
+from datetime import datetime, time, timedelta, timezone
 
-from restaurant.models import Booking, Questions
-from config import settings
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
 
+from restaurant.models import Booking, Questions, Table
+from restaurant.utils.cache import namespaced_key, bump_namespace_version, user_namespace, get_or_fill, \
+    get_namespace_version
 
-def get_cached_booking_list(recached: bool = False):
-    if settings.CACHE_ENABLED:
-        key = "booking_list"
-        if recached:
-            booking_list = Booking.objects.all()
-            cache.set(key, booking_list)
-        else:
-            booking_list = cache.get(key)
-            if booking_list is None:
-                booking_list = Booking.objects.all()
-                cache.set(key, booking_list)
-    else:
-        booking_list = Booking.objects.all()
-    return booking_list
+# в кеше лежат кортежи значений полей (values_list), а не pickle queryset'а
+BOOKING_COLUMNS = [f.attname for f in Booking._meta.concrete_fields]
+TABLE_COLUMNS = [f.attname for f in Table._meta.concrete_fields]
+DAY_COLUMNS = ["table_id", "pk", "starts_at", "ends_at", "active", "token_created_at"]
+# версия состава колонок в ключах: после выкладки с другими полями старые кортежи не читаются
+ROWS_LAYOUT = f"{zlib.crc32(repr((BOOKING_COLUMNS, TABLE_COLUMNS, DAY_COLUMNS)).encode()):08x}"
 
 
-def get_cached_questions_list(recached: bool = False):
-    if settings.CACHE_ENABLED:
+# общее пространство имен бронирований: его версия есть и в ключах суток, и в ключах пользователей
+BOOKINGS_NAMESPACE = "bookings"
+
+
+def booking_day_namespace(day):
+    return f"{BOOKINGS_NAMESPACE}:day:{day.isoformat()}"
+
+
+def booking_user_namespace(user_pk):
+    return f"{BOOKINGS_NAMESPACE}:user:{user_pk}"
+
+
+def booking_user_key(user_pk):
+    # список бронирований лежит в пространстве имен пользователя (сбрасывается при входе/выходе);
+    # в ключе - версии общего пространства бронирований и счетчика изменений бронирований пользователя
+    bookings_version = get_namespace_version(BOOKINGS_NAMESPACE)
+    list_version = get_namespace_version(booking_user_namespace(user_pk))
+    return namespaced_key(user_namespace(user_pk), f"booking_list:{ROWS_LAYOUT}:v{bookings_version}.{list_version}")
+
+
+def booking_day_key(day):
+    day_version = get_namespace_version(booking_day_namespace(day))
+    return namespaced_key(BOOKINGS_NAMESPACE, f"booking_list:day:{ROWS_LAYOUT}:{day.isoformat()}:v{day_version}")
+
 
-        key = "questions_list"
-        if recached:
-            questions_list = Questions.objects.all()
-            cache.set(key, questions_list)
+def booking_from_row(row, user=None):
+    # восстановление бронирования (вместе со столиком) из закешированной строки без запросов к базе
+    n = len(BOOKING_COLUMNS)
+    booking = Booking.from_db(DEFAULT_DB_ALIAS, BOOKING_COLUMNS, row[:n])
+    booking.table = Table.from_db(DEFAULT_DB_ALIAS, TABLE_COLUMNS, row[n:])
+    if user is not None:
+        booking.user = user
+    return booking
 
-        else:
-            questions_list = cache.get(key)
-            if questions_list is None:
-                questions_list = Questions.objects.all()
-                cache.set(key, questions_list)
-    else:
-        questions_list = Questions.objects.all()
-    return questions_list
 
+def get_cached_user_bookings(user) -> list[Booking]:
+    # история бронирований одного пользователя, отсортированная по дате и времени
+    def fill():
+        return list(Booking.objects.filter(user=user).order_by("date_field", "time_start").values_list(
+            *BOOKING_COLUMNS, *(f"table__{column}" for column in TABLE_COLUMNS)))
 
-def cache_delete_booking_list():
-    key = "booking_list"
-    cache.delete(key)
+    rows = get_or_fill(booking_user_key(user.pk), fill) if settings.CACHE_ENABLED else fill()
+    return [booking_from_row(row, user) for row in rows]
+
+
+def get_cached_day_bookings(day) -> list[tuple]:
+    # все бронирования, пересекающиеся с сутками day:
+    # (table_id, pk, starts_at, ends_at, active, время создания последнего токена подтверждения)
+    def fill():
+        day_start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+        day_end = day_start + timedelta(days=1)
+        return list(Booking.objects.filter(starts_at__lt=day_end, ends_at__gt=day_start)
+                    .annotate(token_created_at=Max("user_token__created_at"))
+                    .values_list(*DAY_COLUMNS))
+
+    return get_or_fill(booking_day_key(day), fill) if settings.CACHE_ENABLED else fill()
+
+
+def cache_delete_bookings(booking):
+    # сброс только затронутых ключей: список пользователя и сутки бронирования (старые и новые).
+    # Ключи не удаляются, а меняют версию после коммита: заполнение, прочитавшее строки до коммита,
+    # запишет их под старым ключом, который уже никто не читает
+    namespaces = [booking_user_namespace(booking.user_id)]
+
+    periods = {(booking.starts_at, booking.ends_at), getattr(booking, "_loaded_period", (None, None))}
+    for starts_at, ends_at in periods:
+        if starts_at is None or ends_at is None:
+            continue
+        day = starts_at.date()
+        while day <= ends_at.date():
+            namespaces.append(booking_day_namespace(day))
+            day += timedelta(days=1)
+
+    def bump():
+        for namespace in dict.fromkeys(namespaces):
+            bump_namespace_version(namespace)
+
+    transaction.on_commit(bump)
+
+
+def get_cached_questions_list(recached: bool = False):
+    if settings.CACHE_ENABLED:
+        key = namespaced_key("questions", "questions_list")
+        return get_or_fill(key, lambda: list(Questions.objects.all()), recached=recached)
+    return Questions.objects.all()
 
 
 def cache_delete_question_list():
-    key = "questions_list"
-    cache.delete(key)
+    bump_namespace_version("questions")
 
 
-def cache_clear():
-    cache.clear()
+def cache_delete_all_bookings():
+    # после изменений в обход сигналов (bulk_create, update): сбрасываются только бронирования,
+    # остальное содержимое общего Redis (страницы, блокировки, метрики) не трогается
+    bump_namespace_version(BOOKINGS_NAMESPACE)
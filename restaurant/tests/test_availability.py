@@ -0,0 +1,353 @@
+import datetime
+from unittest import TestCase, mock, skipUnless
+
+from django.core.cache import cache
+from django.db import connection, connections, transaction, DEFAULT_DB_ALIAS
+from django.test import TestCase as DjangoTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from restaurant.availability.engine import find_conflict, get_free_tables, get_reserved_bookings, \
+    release_expired_bookings, get_free_windows, get_booked_tables
+from restaurant.availability.index import DayIndex, Interval
+from restaurant.availability.occupancy import period_masks, rebuild_occupancy, classify_tables, refresh_occupancy
+from restaurant.models import Table, Booking, BookingToken, TableDayOccupancy
+from users.models import User
+
+
+def dt(hour, minute=0, day=1):
+    return datetime.datetime(2024, 4, day, hour, minute)
+
+
+class DayIndexTest(TestCase):
+
+    def setUp(self):
+        self.index = DayIndex([
+            (1, Interval(dt(12), dt(14), 2, True)),
+            (1, Interval(dt(9), dt(11), 1, True)),
+            (1, Interval(dt(22), dt(1, day=2), 3, False)),
+            (2, Interval(dt(10), dt(20), 4, True)),
+        ])
+
+    def test_len_and_sorting(self):
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual([i.pk for i in self.index.intervals(1)], [1, 2, 3])
+        self.assertEqual(self.index.table_ids(), {1, 2})
+
+    def test_free_gaps(self):
+        self.assertTrue(self.index.is_free(1, dt(11), dt(12)))
+        self.assertTrue(self.index.is_free(1, dt(14), dt(22)))
+        self.assertTrue(self.index.is_free(3, dt(9), dt(23)))
+
+    def test_conflicts(self):
+        self.assertEqual(self.index.find_conflict(1, dt(10), dt(13)).pk, 1)
+        self.assertEqual(self.index.find_conflict(1, dt(13), dt(15)).pk, 2)
+        self.assertEqual(self.index.find_conflict(1, dt(8), dt(23)).pk, 1)
+        self.assertEqual(self.index.find_conflict(1, dt(0, day=2), dt(2, day=2)).pk, 3)
+
+    def test_exclude_pk(self):
+        self.assertIsNone(self.index.find_conflict(1, dt(9), dt(11), exclude_pk=1))
+        self.assertEqual(self.index.find_conflict(1, dt(9), dt(13), exclude_pk=1).pk, 2)
+
+    def test_overlapping_intervals_in_index(self):
+        index = DayIndex([
+            (1, Interval(dt(8), dt(20), 1, True)),
+            (1, Interval(dt(9), dt(10), 2, True)),
+        ])
+        self.assertEqual(index.find_conflict(1, dt(15), dt(16)).pk, 1)
+
+    def test_free_table_ids(self):
+        self.assertEqual(self.index.free_table_ids([1, 2, 3], dt(11), dt(12)), [1, 3])
+
+    def test_free_windows(self):
+        self.assertEqual(self.index.free_windows(1, dt(8), dt(23)),
+                         [(dt(8), dt(9)), (dt(11), dt(12)), (dt(14), dt(22))])
+        self.assertEqual(self.index.free_windows(2, dt(8), dt(23)), [(dt(8), dt(10)), (dt(20), dt(23))])
+        self.assertEqual(self.index.free_windows(3, dt(8), dt(23)), [(dt(8), dt(23))])
+        # начало внутри бронирования, вложенные интервалы
+        index = DayIndex([
+            (1, Interval(dt(8), dt(20), 1, True)),
+            (1, Interval(dt(9), dt(10), 2, True)),
+        ])
+        self.assertEqual(index.free_windows(1, dt(9, 30), dt(23)), [(dt(20), dt(23))])
+
+
+class AvailabilityEngineTest(DjangoTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="availability@test.ru", password="test")
+        self.table_small = Table.objects.create(number=101, places=2, flour=1, description="test")
+        self.table_big = Table.objects.create(number=102, places=6, flour=2, description="test")
+        self.date_next = datetime.date.today() + datetime.timedelta(days=2)
+        self.time_border = timezone.now() - timezone.timedelta(minutes=45)
+
+        self.active = Booking.objects.create(user=self.user, table=self.table_big, places=4,
+                                             date_field=self.date_next, time_start=datetime.time(18, 0),
+                                             time_end=datetime.time(20, 0), active=True)
+        self.pending = Booking.objects.create(user=self.user, table=self.table_small, places=2,
+                                              date_field=self.date_next, time_start=datetime.time(18, 0),
+                                              time_end=datetime.time(20, 0), active=False, is_pending=True)
+        BookingToken.objects.create(booking=self.pending, token="availability-token")
+
+        self.cancelled = Booking.objects.create(user=self.user, table=self.table_small, places=2,
+                                                date_field=self.date_next, time_start=datetime.time(12, 0),
+                                                time_end=datetime.time(14, 0), active=False)
+
+    def segment(self, start, end):
+        return (datetime.datetime.combine(self.date_next, start), datetime.datetime.combine(self.date_next, end))
+
+    def test_reserved_bookings(self):
+        reserved = get_reserved_bookings(self.time_border)
+        self.assertIn(self.active, reserved)
+        self.assertIn(self.pending, reserved)
+        self.assertNotIn(self.cancelled, reserved)
+
+        expired_border = timezone.now() + timezone.timedelta(minutes=1)
+        self.assertNotIn(self.pending, get_reserved_bookings(expired_border))
+
+    def test_table_free(self):
+        start, end = self.segment(datetime.time(12, 0), datetime.time(14, 0))
+        self.assertIsNone(find_conflict(self.table_small, start, end, self.time_border))
+
+        start, end = self.segment(datetime.time(19, 0), datetime.time(21, 0))
+        self.assertEqual(find_conflict(self.table_big, start, end, self.time_border).pk, self.active.pk)
+        self.assertIsNone(find_conflict(self.table_big, start, end, self.time_border, exclude_pk=self.active.pk))
+
+    def test_free_tables(self):
+        start, end = self.segment(datetime.time(19, 0), datetime.time(21, 0))
+        self.assertEqual(get_free_tables(start, end, 2, self.time_border), [t for t in Table.objects.filter(
+            places__gte=2).exclude(pk__in=[self.table_small.pk, self.table_big.pk]).order_by("number")])
+
+        start, end = self.segment(datetime.time(10, 0), datetime.time(12, 0))
+        free = get_free_tables(start, end, 5, self.time_border)
+        self.assertIn(self.table_big, free)
+        self.assertNotIn(self.table_small, free)
+
+    def test_free_windows(self):
+        start, end = self.segment(datetime.time(8, 0), datetime.time(23, 0))
+        windows = dict(get_free_windows(start, end, 2, self.time_border, flour=1))
+        self.assertEqual([(s.time(), e.time()) for s, e in windows[self.table_small]],
+                         [(datetime.time(8, 0), datetime.time(18, 0)), (datetime.time(20, 0), datetime.time(23, 0))])
+        self.assertNotIn(self.table_big, windows)
+
+        # истекшее подтверждение столик не держит
+        expired_border = timezone.now() + timezone.timedelta(minutes=1)
+        windows = dict(get_free_windows(start, end, 5, expired_border))
+        self.assertEqual(list(windows), [self.table_big])
+        self.assertEqual(len(windows[self.table_big]), 2)
+
+    def test_booked_tables(self):
+        start, end = self.segment(datetime.time(0, 0), datetime.time(23, 0))
+        with self.assertNumQueries(2):
+            tables = get_booked_tables(start, end, self.time_border)
+        self.assertEqual(tables, [self.table_small, self.table_big])
+        self.assertEqual([(day, [b["time_start"] for b in bookings]) for day, bookings in tables[1].booking_days],
+                         [(self.date_next, [datetime.time(18, 0)])])
+
+        # ожидающее подтверждения с истекшим временем и бронирования вне периода не показываются
+        expired_border = timezone.now() + timezone.timedelta(minutes=1)
+        self.assertEqual(get_booked_tables(start, end, expired_border), [self.table_big])
+        start, end = self.segment(datetime.time(8, 0), datetime.time(18, 0))
+        self.assertEqual(get_booked_tables(start, end, self.time_border), [])
+
+    def test_release_expired_bookings(self):
+        self.assertEqual(release_expired_bookings(self.time_border), 0)
+
+        expired_border = timezone.now() + timezone.timedelta(minutes=1)
+        self.assertEqual(release_expired_bookings(expired_border, table=self.table_big), 0)
+        self.assertEqual(release_expired_bookings(expired_border), 1)
+
+        self.pending.refresh_from_db()
+        self.assertFalse(self.pending.is_pending)
+        self.assertFalse(self.pending.active)
+
+
+class FreeSlotsViewTest(DjangoTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="slots@test.ru", password="test")
+        self.table = Table.objects.create(number=201, places=4, flour=2, description="test")
+        self.day = datetime.date.today() + datetime.timedelta(days=1)
+        Booking.objects.create(user=self.user, table=self.table, places=2, date_field=self.day,
+                               time_start=datetime.time(18, 0), time_end=datetime.time(20, 0), active=True)
+
+    def get(self, **params):
+        return self.client.get(reverse("restaurant:free_slots"), params)
+
+    def test_windows(self):
+        resp = self.get(date=self.day.isoformat(), places=3, flour=2)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["tables"], [{"id": self.table.pk, "number": 201, "places": 4, "flour": 2,
+                                                  "windows": [{"start": "08:00", "end": "18:00"},
+                                                              {"start": "20:00", "end": "23:00"}]}])
+
+        self.assertEqual(self.get(date=self.day.isoformat(), places=5).json()["tables"], [])
+
+    def test_invalidated_on_booking_change(self):
+        self.get(date=self.day.isoformat())
+        Booking.objects.create(user=self.user, table=self.table, places=2, date_field=self.day,
+                               time_start=datetime.time(8, 0), time_end=datetime.time(10, 0), active=True)
+
+        windows = self.get(date=self.day.isoformat(), flour=2).json()["tables"][0]["windows"]
+        self.assertEqual(windows[0], {"start": "10:00", "end": "18:00"})
+
+    def test_today_follows_user_time_offset(self):
+        # 05:00 UTC - это 15:00 для гостя из UTC+10: утренние промежутки для него уже в прошлом
+        moment = datetime.datetime.combine(self.day, datetime.time(5), tzinfo=datetime.timezone.utc)
+
+        class FrozenDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return moment
+
+        User.objects.filter(pk=self.user.pk).update(time_offset=10)
+        self.client.login(email="slots@test.ru", password="test")
+        with mock.patch("restaurant.utils.utils.datetime", FrozenDatetime):
+            windows = self.get(date=self.day.isoformat()).json()["tables"][0]["windows"]
+        self.assertEqual(windows, [{"start": "15:00", "end": "18:00"}, {"start": "20:00", "end": "23:00"}])
+
+    def test_bad_request(self):
+        self.assertEqual(self.get().status_code, 400)
+        self.assertEqual(self.get(date="завтра").status_code, 400)
+        self.assertEqual(self.get(date=self.day.isoformat(), places=0).status_code, 400)
+
+        past = datetime.date.today() - datetime.timedelta(days=1)
+        self.assertEqual(self.get(date=past.isoformat()).json()["error"],
+                         "Нельзя забронировать место на прошедшее время")
+        self.assertEqual(self.get(date=(self.day + datetime.timedelta(days=30)).isoformat()).status_code, 400)
+
+
+class OccupancyTest(DjangoTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="occupancy@test.ru", password="test")
+        self.table = Table.objects.create(number=301, places=4, flour=1, description="test")
+        self.day = datetime.date.today() + datetime.timedelta(days=3)
+
+    def book(self, start, end, **kwargs):
+        return Booking.objects.create(user=self.user, table=self.table, places=2, date_field=self.day,
+                                      time_start=start, time_end=end, **kwargs)
+
+    def masks(self):
+        return {row.day: row.mask for row in TableDayOccupancy.objects.filter(table=self.table)}
+
+    def test_period_masks(self):
+        start = datetime.datetime(2024, 4, 1, 18, tzinfo=datetime.timezone.utc)
+        self.assertEqual(period_masks(start, start + datetime.timedelta(hours=2)),
+                         {datetime.date(2024, 4, 1): 0xFF << 72})
+        # края округляются наружу до слотов по 15 минут
+        self.assertEqual(period_masks(start + datetime.timedelta(minutes=10), start + datetime.timedelta(minutes=20)),
+                         {datetime.date(2024, 4, 1): 0b11 << 72})
+        self.assertEqual(period_masks(start + datetime.timedelta(minutes=10), start + datetime.timedelta(minutes=50),
+                                      inner=True), {datetime.date(2024, 4, 1): 0b11 << 73})
+        # через полночь - две маски
+        self.assertEqual(period_masks(start + datetime.timedelta(hours=5, minutes=30),
+                                      start + datetime.timedelta(hours=7)),
+                         {datetime.date(2024, 4, 1): 0b11 << 94, datetime.date(2024, 4, 2): 0b1111})
+
+    def test_updated_by_signals(self):
+        booking = self.book(datetime.time(18, 0), datetime.time(20, 0))
+        self.assertEqual(self.masks(), {self.day: 0xFF << 72})
+        self.assertEqual(TableDayOccupancy.objects.get().confirmed_mask, 0xFF << 72)
+
+        booking.time_start, booking.time_end = datetime.time(23, 30), datetime.time(1, 0)
+        booking.save()
+        next_day = self.day + datetime.timedelta(days=1)
+        self.assertEqual(self.masks(), {self.day: 0b11 << 94, next_day: 0b1111})
+
+        # отмена освобождает слоты
+        booking.active = False
+        booking.save()
+        self.assertEqual(self.masks(), {})
+
+    def test_confirmation_sets_confirmed_mask(self):
+        # создание с ожиданием подтверждения -> подтверждение по ссылке из письма -> маска confirmed
+        booking = self.book(datetime.time(12, 0), datetime.time(13, 0), active=False, is_pending=True)
+        BookingToken.objects.create(booking=booking, token="occupancy-confirm")
+        self.assertEqual(self.masks(), {self.day: 0xF << 48})
+        self.assertEqual(TableDayOccupancy.objects.get().confirmed_mask, 0)
+
+        self.client.get(reverse("restaurant:booking_verification", args=["occupancy-confirm"]))
+        occupancy = TableDayOccupancy.objects.get()
+        self.assertEqual((occupancy.mask, occupancy.confirmed_mask), (0xF << 48, 0xF << 48))
+        start = datetime.datetime.combine(self.day, datetime.time(12, 0), datetime.timezone.utc)
+        self.assertEqual(classify_tables([self.table.pk], start, start + datetime.timedelta(hours=1)),
+                         ({self.table.pk}, set()))
+
+    def test_refresh_locks_table_days(self):
+        # блокировка берется внутри транзакции до чтения бронирований, иначе параллельный пересчет затрет маску
+        locked = []
+
+        def lock(keys):
+            locked.append((set(keys), connection.in_atomic_block))
+
+        with mock.patch("restaurant.availability.occupancy.lock_table_days", side_effect=lock):
+            self.book(datetime.time(23, 0), datetime.time(1, 0))
+        next_day = self.day + datetime.timedelta(days=1)
+        self.assertEqual(locked, [({(self.table.pk, self.day), (self.table.pk, next_day)}, True)])
+
+    @skipUnless(connection.vendor == "postgresql", "рекомендательные блокировки есть только в PostgreSQL")
+    def test_lock_held_until_commit(self):
+        other = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            with transaction.atomic():
+                refresh_occupancy({(self.table.pk, self.day)})
+                with other.cursor() as cursor:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [self.table.pk, self.day.toordinal()])
+                    self.assertFalse(cursor.fetchone()[0])
+        finally:
+            other.close()
+
+    def test_unchanged_state_skips_refresh(self):
+        booking = self.book(datetime.time(12, 0), datetime.time(13, 0))
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.description = "у окна"
+        with mock.patch("restaurant.signals.refresh_occupancy") as refresh:
+            booking.save()
+        refresh.assert_not_called()
+
+    def test_expired_released(self):
+        pending = self.book(datetime.time(12, 0), datetime.time(13, 0), active=False, is_pending=True)
+        BookingToken.objects.create(booking=pending, token="occupancy-token")
+        self.book(datetime.time(18, 0), datetime.time(19, 0))
+
+        expired_border = timezone.now() + timezone.timedelta(minutes=1)
+        # устаревшая маска не мешает: столик проверяется по интервалам
+        start = datetime.datetime.combine(self.day, datetime.time(12, 0))
+        self.assertIn(self.table, get_free_tables(start, start + datetime.timedelta(hours=1), 2, expired_border))
+
+        self.assertEqual(release_expired_bookings(expired_border), 1)
+        self.assertEqual(self.masks(), {self.day: 0xF << 72})
+
+    def test_classify_tables(self):
+        other = Table.objects.create(number=302, places=4, flour=1, description="test")
+        self.book(datetime.time(18, 0), datetime.time(20, 0))
+        self.book(datetime.time(12, 0), datetime.time(13, 0), active=False, is_pending=True)
+        self.book(datetime.time(14, 10), datetime.time(15, 0))
+
+        def classify(start, end):
+            return classify_tables([self.table.pk, other.pk], datetime.datetime.combine(self.day, start,
+                                                                                        datetime.timezone.utc),
+                                   datetime.datetime.combine(self.day, end, datetime.timezone.utc))
+
+        # подтвержденное целиком покрывает слоты - занято без запроса к бронированиям
+        self.assertEqual(classify(datetime.time(19, 0), datetime.time(21, 0)), ({self.table.pk}, set()))
+        # ожидающее подтверждения и край слота - проверяются по бронированиям
+        self.assertEqual(classify(datetime.time(12, 30), datetime.time(13, 0)), (set(), {self.table.pk}))
+        self.assertEqual(classify(datetime.time(13, 30), datetime.time(14, 5)), (set(), {self.table.pk}))
+        self.assertEqual(classify(datetime.time(9, 0), datetime.time(11, 0)), (set(), set()))
+
+        start = datetime.datetime.combine(self.day, datetime.time(13, 30))
+        with self.assertNumQueries(3):
+            self.assertEqual(get_free_tables(start, start + datetime.timedelta(minutes=35), 2, timezone.now()),
+                             [self.table, other])
+
+    def test_rebuild(self):
+        self.book(datetime.time(18, 0), datetime.time(20, 0))
+        self.book(datetime.time(22, 0), datetime.time(0, 30))
+        masks = self.masks()
+
+        TableDayOccupancy.objects.all().delete()
+        self.assertEqual(rebuild_occupancy(datetime.date.today()), 2)
+        self.assertEqual(self.masks(), masks)
@@ -0,0 +1,105 @@
+import datetime
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db.models import F
+from django.test import TestCase
+from django.utils import timezone
+
+from restaurant.management.commands.benchmark_booking import run_suite, compare_results
+from restaurant.models import Booking, BookingToken, NotificationOutbox, Table
+from restaurant.utils.seed import seed_restaurant
+from users.models import User
+
+
+class SeedTest(TestCase):
+
+    def test_deterministic(self):
+        seed_restaurant(tables=3, users=5, bookings=40, seed=7)
+        first = list(Booking.objects.order_by("pk").values_list("table__number", "date_field", "time_start",
+                                                                  "user__email"))
+        Table.objects.all().delete()
+        User.objects.all().delete()
+
+        seed_restaurant(tables=3, users=5, bookings=40, seed=7)
+        second = list(Booking.objects.order_by("pk").values_list("table__number", "date_field", "time_start",
+                                                                   "user__email"))
+        self.assertEqual(first, second)
+
+    def test_bookings(self):
+        counts = seed_restaurant(tables=4, users=10, bookings=400, questions=5, reviews=5, late_share=0.5)
+        notifications = counts.pop("notifications")
+        self.assertEqual(counts, {"tables": 4, "users": 10, "bookings": 400, "questions": 5, "reviews": 5})
+
+        # будущие напоминания подтвержденных бронирований стоят в очереди, как после подтверждения
+        future = Booking.objects.filter(active=True, notify_at__gt=timezone.now())
+        self.assertGreater(notifications, 0)
+        self.assertEqual(notifications, future.count())
+        self.assertEqual(set(NotificationOutbox.objects.filter(status=NotificationOutbox.PENDING, task_id__isnull=True)
+                             .values_list("booking_id", "due_at")), set(future.values_list("pk", "notify_at")))
+
+        # bulk_create обходит pre_save - период и напоминание заполняет сам сид
+        self.assertFalse(Booking.objects.filter(starts_at__isnull=True).exists())
+        booking = Booking.objects.filter(notification__gt=0).select_related("user").first()
+        notify_at = booking.notify_at
+        booking.set_notify_at()
+        self.assertEqual(notify_at, booking.notify_at)
+
+        # есть бронирования через полночь, ожидающие подтверждения - с токенами
+        self.assertTrue(Booking.objects.filter(time_end__lt=F("time_start")).exists())
+        self.assertEqual(BookingToken.objects.filter(booking__is_pending=True).count(),
+                         Booking.objects.filter(is_pending=True).count())
+
+        # столик не занят двумя действующими бронированиями одновременно
+        for table in Table.objects.all():
+            periods = list(Booking.objects.filter(table=table).order_by("starts_at").values_list("starts_at",
+                                                                                                 "ends_at"))
+            for (_, end), (start, _) in zip(periods, periods[1:]):
+                self.assertLessEqual(end, start)
+
+    def test_dinner_peak(self):
+        seed_restaurant(tables=10, users=10, bookings=1000)
+        dinner = Booking.objects.filter(time_start__gte=datetime.time(18), time_start__lt=datetime.time(21))
+        morning = Booking.objects.filter(time_start__gte=datetime.time(8), time_start__lt=datetime.time(11))
+        self.assertGreater(dinner.count(), morning.count())
+
+
+    def test_command(self):
+        out = StringIO()
+        call_command("seed_restaurant", tables=2, users=3, bookings=20, questions=1, reviews=1, stdout=out)
+        self.assertIn("bookings: 20", out.getvalue())
+        self.assertEqual(Booking.objects.count(), 20)
+
+        # повторный запуск с тем же seed не дублирует пользователей
+        with self.assertRaises(CommandError):
+            call_command("seed_restaurant", tables=2, users=3, bookings=20, stdout=out)
+
+
+class BenchmarkSuiteTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_run_suite(self):
+        results = run_suite(tables=3, users=5, bookings=40, iterations=5, warmup=1)
+
+        self.assertEqual(set(results["scenarios"]), {"booking_create", "booking_list", "get_actual_bookings",
+                                                     "clean_my_table", "due_notifications"})
+        for result in results["scenarios"].values():
+            self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+            self.assertLessEqual(result["p95_ms"], result["p99_ms"])
+            self.assertGreater(result["per_second"], 0)
+
+        # бронирования создаются, письма в очередь ставятся без брокера
+        self.assertEqual(results["scenarios"]["booking_create"]["outcomes"], {"302": 5})
+
+    def test_compare(self):
+        baseline = {"scenarios": {"booking_list": {"p95_ms": 10.0, "queries": 3.0}}}
+        current = {"scenarios": {"booking_list": {"p95_ms": 11.0, "queries": 3.0},
+                                 "clean_my_table": {"p95_ms": 1.0, "queries": 1.0}}}
+        self.assertEqual(compare_results(baseline, current), [])
+
+        current["scenarios"]["booking_list"] = {"p95_ms": 15.0, "queries": 4.0}
+        self.assertEqual(compare_results(baseline, current), ["booking_list: p95 10.0 -> 15.0 мс",
+                                                              "booking_list: SQL-запросов 3.0 -> 4.0"])
@@ -0,0 +1,160 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, override_settings, RequestFactory
+from django.urls import reverse
+
+from restaurant.templates.restaurant.services import get_cached_user_bookings, cache_delete_all_bookings
+from restaurant.utils.cache import get_namespace_version, bump_namespace_version, namespaced_key, user_namespace, \
+    get_or_fill, jittered_timeout, CACHE_TTL_JITTER, CACHE_LOCK_POLL, CACHE_LOCK_WAIT, \
+    versioned_cache_page
+from users.models import User
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHE_ENABLED=True, CACHES=LOCMEM_CACHES)
+class NamespaceVersionTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_changes_only_own_namespace(self):
+        key_1 = namespaced_key("first", "data")
+        key_2 = namespaced_key("second", "data")
+        cache.set_many({key_1: 1, key_2: 2})
+
+        bump_namespace_version("first")
+
+        self.assertNotEqual(namespaced_key("first", "data"), key_1)
+        self.assertIsNone(cache.get(namespaced_key("first", "data")))
+        self.assertEqual(cache.get(namespaced_key("second", "data")), 2)
+
+    @patch("restaurant.utils.cache.initial_version", side_effect=[100, 200])
+    def test_evicted_version_does_not_restore_old_keys(self, mock_time):
+        version = get_namespace_version("first")
+        bump_namespace_version("first")
+        cache.delete("ns:first")
+
+        self.assertGreater(get_namespace_version("first"), version + 1)
+
+
+@override_settings(CACHE_ENABLED=True, CACHES=LOCMEM_CACHES)
+class GetOrFillTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def fill(self):
+        self.calls += 1
+        return self.calls
+
+    def test_fresh_value_not_recomputed(self):
+        self.assertEqual(get_or_fill("key", self.fill), 1)
+        self.assertEqual(get_or_fill("key", self.fill), 1)
+        self.assertEqual(get_or_fill("key", self.fill, recached=True), 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_stale_value_served_while_locked(self):
+        cache.set("key", ("old", 0), 60)
+
+        # блокировку держит другой воркер - отдаем устаревшее значение без пересчета
+        cache.add("lock:key", 1, 10)
+        self.assertEqual(get_or_fill("key", self.fill), "old")
+        self.assertEqual(self.calls, 0)
+
+        # блокировка свободна - пересчитываем и снимаем блокировку
+        cache.delete("lock:key")
+        self.assertEqual(get_or_fill("key", self.fill), 1)
+        self.assertIsNone(cache.get("lock:key"))
+
+    def test_miss_waits_for_lock_holder(self):
+        cache.add("lock:key", 1, 10)
+
+        # пока ждем, держатель блокировки заполняет ключ
+        with patch("restaurant.utils.cache.time.sleep", side_effect=lambda _: cache.set("key", ("filled", 10 ** 10))):
+            self.assertEqual(get_or_fill("key", self.fill), "filled")
+        self.assertEqual(self.calls, 0)
+
+    def test_miss_wait_is_capped(self):
+        cache.add("lock:key", 1, 10)
+
+        # держатель блокировки завис - ждем не дольше CACHE_LOCK_WAIT и считаем сами, не записывая в кеш
+        clock = [0.0]
+        with patch("restaurant.utils.cache.time.monotonic", side_effect=lambda: clock[0]), \
+                patch("restaurant.utils.cache.time.sleep", side_effect=lambda s: clock.__setitem__(0, clock[0] + s)):
+            self.assertEqual(get_or_fill("key", self.fill), 1)
+        self.assertLessEqual(clock[0], CACHE_LOCK_WAIT + CACHE_LOCK_POLL)
+        self.assertIsNone(cache.get("key"))
+
+    def test_miss_takes_released_lock(self):
+        cache.add("lock:key", 1, 10)
+
+        # держатель упал и снял блокировку без значения - ожидающий берет блокировку и заполняет ключ
+        with patch("restaurant.utils.cache.time.sleep", side_effect=lambda _: cache.delete("lock:key")):
+            self.assertEqual(get_or_fill("key", self.fill), 1)
+        self.assertEqual(cache.get("key")[0], 1)
+        self.assertIsNone(cache.get("lock:key"))
+
+    def test_jittered_timeout(self):
+        timeouts = {jittered_timeout(300) for _ in range(50)}
+        self.assertTrue(all(300 * (1 - CACHE_TTL_JITTER) <= t <= 300 * (1 + CACHE_TTL_JITTER) for t in timeouts))
+        self.assertGreater(len(timeouts), 1)
+
+
+@override_settings(CACHE_ENABLED=True, CACHES=LOCMEM_CACHES)
+class LoginLogoutCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user_1 = User.objects.create_user(email="ns_1@test.ru", password="test")
+        self.user_2 = User.objects.create_user(email="ns_2@test.ru", password="test")
+
+    def test_login_logout_keeps_other_users_cache(self):
+        get_cached_user_bookings(self.user_1)
+        get_cached_user_bookings(self.user_2)
+        cache.set("unrelated", 1)
+        version = get_namespace_version(user_namespace(self.user_1.pk))
+
+        self.client.force_login(self.user_1)
+        self.client.post(reverse("users:logout"))
+
+        self.assertEqual(get_namespace_version(user_namespace(self.user_1.pk)), version + 2)
+        self.assertEqual(cache.get("unrelated"), 1)
+        with self.assertNumQueries(0):
+            get_cached_user_bookings(self.user_2)
+
+    def test_delete_all_bookings_keeps_other_keys(self):
+        get_cached_user_bookings(self.user_1)
+        cache.set("unrelated", 1)
+
+        cache_delete_all_bookings()
+        self.assertEqual(cache.get("unrelated"), 1)
+        with self.assertNumQueries(1):
+            get_cached_user_bookings(self.user_1)
+
+
+@override_settings(CACHE_ENABLED=True, CACHES=LOCMEM_CACHES)
+class VersionedCachePageTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_prefix_follows_namespace_version(self):
+        calls = []
+
+        def view(request):
+            calls.append(request)
+            return HttpResponse(str(len(calls)))
+
+        page = versioned_cache_page(60, "pages_test")(view)
+        factory = RequestFactory()
+        self.assertEqual(page(factory.get("/page/")).content, b"1")
+        self.assertEqual(page(factory.get("/page/")).content, b"1")
+
+        # обертка та же, новая версия - новый ключ
+        bump_namespace_version("pages_test")
+        self.assertEqual(page(factory.get("/page/")).content, b"2")
+        self.assertEqual(len(calls), 2)
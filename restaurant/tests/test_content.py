@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from restaurant.models import ContentText
+from restaurant.utils.cache import bump_namespace_version, get_namespace_version
+from restaurant.utils.content import content_registry, CONTENT_NAMESPACE
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ContentRegistryTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        content_registry.reset()
+        self.text = ContentText.objects.create(title="registry", body="first")
+
+    def test_reads_from_memory(self):
+        self.assertEqual(content_registry.text("registry"), "first")
+
+        with self.assertNumQueries(0), mock.patch.object(cache, "get") as cache_get:
+            self.assertEqual(content_registry.text("registry"), "first")
+            self.assertIsNone(content_registry.text("missing"))
+        # в пределах интервала проверки версия в Redis не запрашивается
+        cache_get.assert_not_called()
+
+    def test_save_and_delete_bump_version(self):
+        version = get_namespace_version(CONTENT_NAMESPACE)
+        self.text.body = "second"
+        self.text.save()
+
+        self.assertGreater(get_namespace_version(CONTENT_NAMESPACE), version)
+        self.assertEqual(content_registry.text("registry"), "second")
+
+        self.text.delete()
+        self.assertIsNone(content_registry.text("registry"))
+
+    def test_other_process_change(self):
+        self.assertEqual(content_registry.text("registry"), "first")
+
+        # изменение в другом процессе: в базе новое значение и новая версия в Redis, локальный реестр не сброшен
+        ContentText.objects.filter(pk=self.text.pk).update(body="second")
+        bump_namespace_version(CONTENT_NAMESPACE)
+        self.assertEqual(content_registry.text("registry"), "first")
+
+        content_registry.checked_at = 0.0
+        self.assertEqual(content_registry.text("registry"), "second")
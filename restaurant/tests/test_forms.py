@@ -5,8 +5,9 @@ from unittest import TestCase
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from restaurant.availability.engine import get_free_tables
 from restaurant.forms import BookingForm, QuestionsForm, LimitedQuestionsForm
-from restaurant.models import Table, Booking, BookingToken, ContentParameters
+from restaurant.models import Table, Booking, BookingToken, ContentParameters, booking_period
 from restaurant.utils.utils import get_content_parameters
 from users.models import User
 
@@ -216,10 +217,15 @@ class TestBookingForm(TestCase):
         text_err3 = "В указанное время выбранный столик еще не освободился"
 
         self.assertTrue(form_correct.clean_my_table(time_border))
+        self.assertEqual(form_correct.free_tables, [])
 
         with self.assertRaises(ValidationError) as e_1:
             form_incorect.clean_my_table(time_border)
         self.assertEqual(e_1.exception.message, text_err1)
+        # вместо занятого столика предлагаются свободные на тот же период (движок доступности)
+        self.assertNotIn(table, form_incorect.free_tables)
+        self.assertEqual(form_incorect.free_tables, get_free_tables(*booking_period(
+            date_next, incorrect_data["time_start"], incorrect_data["time_end"]), 1, time_border))
 
         with self.assertRaises(ValidationError) as e_2:
             form_incorect_2.clean_my_table(time_border)
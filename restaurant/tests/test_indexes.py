@@ -0,0 +1,62 @@
+import datetime
+from unittest import skipUnless
+
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.test import TestCase
+from django.utils import timezone
+
+from restaurant.availability.engine import get_reserved_bookings
+from restaurant.models import Table, Booking, BookingToken, NotificationOutbox, booking_period
+from restaurant.utils.utils import get_due_notifications
+from users.models import User, UserToken
+
+
+@skipUnless(connection.vendor == "postgresql", "планы запросов проверяются только для PostgreSQL")
+class BookingIndexesTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="indexes@test.ru", password="test")
+        self.table = Table.objects.create(number=301, places=4, flour=1, description="test")
+        date_next = datetime.date.today() + datetime.timedelta(days=1)
+        self.start, self.end = booking_period(date_next, datetime.time(18, 0), datetime.time(20, 0))
+
+        Booking.objects.create(user=self.user, table=self.table, places=2, notification=1, date_field=date_next,
+                               time_start=datetime.time(12, 0), time_end=datetime.time(14, 0), active=True)
+
+        # на маленьких таблицах планировщик предпочтет полный просмотр, поэтому запрещаем его
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_table_period_lookup(self):
+        time_border = timezone.now() - timezone.timedelta(minutes=45)
+        bookings = get_reserved_bookings(time_border).filter(table=self.table, starts_at__lt=self.end,
+                                                             ends_at__gt=self.start)
+        self.assertUsesIndex(bookings, "booking_table_period_idx")
+
+    def test_pending_token_lookup(self):
+        time_border = timezone.now() - timezone.timedelta(minutes=45)
+        tokens = BookingToken.objects.filter(booking=OuterRef("pk"), created_at__gt=time_border)
+        self.assertUsesIndex(Booking.objects.filter(Exists(tokens)), "bookingtoken_created_idx")
+
+    def test_user_history(self):
+        bookings = Booking.objects.filter(user=self.user).order_by("date_field", "time_start")
+        self.assertUsesIndex(bookings, "booking_user_date_idx")
+
+    def test_notification_lookup(self):
+        now = timezone.now()
+        self.assertUsesIndex(get_due_notifications(now - timezone.timedelta(hours=1), now), "booking_notify_at_idx")
+
+    def test_outbox_lookup(self):
+        outbox = NotificationOutbox.objects.filter(status=NotificationOutbox.PENDING, available_at__lte=timezone.now())
+        self.assertUsesIndex(outbox, "notification_available_idx")
+
+    def test_token_lookups(self):
+        for queryset in (BookingToken.objects.filter(token="token"), UserToken.objects.filter(token="token")):
+            plan = queryset.explain()
+            self.assertIn("Index", plan, plan)
+            self.assertIn("token", plan, plan)
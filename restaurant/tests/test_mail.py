@@ -0,0 +1,149 @@
+import smtplib
+import socket
+import datetime
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from restaurant.management.commands.mail_benchmark import SmtpSink, run_benchmark
+from restaurant.models import MailOutbox, Table, Booking
+from restaurant.notifications.mail import PersistentMailConnection, queue_mail, relay_mail_batch, mail_message, \
+    MAIL_BATCH_WINDOW, MAIL_RELAY_LOCK, MAIL_RETRY_DELAY, MAIL_MAX_ATTEMPTS
+from users.models import User
+
+
+class PersistentMailConnectionTest(TestCase):
+
+    def test_reused_and_reconnected(self):
+        with SmtpSink() as sink:
+            connection = PersistentMailConnection(**sink.connection_options())
+            self.assertEqual(connection.send_messages(
+                [mail_message("Тема", "Текст", [f"user{number}@test.ru"]) for number in range(3)]), 3)
+            self.assertEqual(len(sink.handler.peers), 1)
+
+            # сервер закрыл соединение - письмо уходит после переподключения
+            connection.connection.connection.sock.shutdown(socket.SHUT_RDWR)
+            self.assertTrue(connection.send(mail_message("Тема", "Текст", ["user@test.ru"])))
+            connection.close()
+
+        self.assertEqual(sink.handler.messages, 4)
+        self.assertEqual(len(sink.handler.peers), 2)
+
+    @mock.patch("restaurant.notifications.mail.get_connection")
+    def test_refused_recipient_logged(self, get_connection):
+        get_connection.return_value.send_messages.side_effect = smtplib.SMTPRecipientsRefused(
+            {"bad@test.ru": (550, b"no such user")})
+        connection = PersistentMailConnection()
+
+        with self.assertLogs("restaurant.notifications.mail", "WARNING") as logs:
+            self.assertFalse(connection.send(mail_message("Тема", "Текст", ["bad@test.ru"])))
+        self.assertIn("bad@test.ru", logs.output[0])
+
+    def test_benchmark(self):
+        results = run_benchmark(messages=10)
+        self.assertEqual(results["per_message"]["connections"], 10)
+        self.assertEqual(results["persistent"]["connections"], 1)
+        self.assertEqual(results["persistent"]["sent"], 10)
+
+
+@mock.patch("restaurant.tasks.relay_mail.apply_async")
+@override_settings(CACHE_ENABLED=True)
+class MailOutboxTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_dispatched_on_commit(self, relay_mail):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for number in range(3):
+                    queue_mail("Подтверждение почты", "Привет", [f"user{number}@test.ru"])
+                # до коммита брокер не трогается
+                relay_mail.assert_not_called()
+
+        # одна задача отправки на окно
+        relay_mail.assert_called_once_with(countdown=MAIL_BATCH_WINDOW, retry=False)
+        self.assertEqual(MailOutbox.objects.filter(status=MailOutbox.PENDING).count(), 3)
+
+        # откат транзакции - ни письма, ни задачи
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(ValueError):
+            with transaction.atomic():
+                queue_mail("Восстановление пароля", "Привет", ["user@test.ru"])
+                raise ValueError
+        self.assertEqual(MailOutbox.objects.count(), 3)
+        relay_mail.assert_called_once()
+
+        self.assertEqual(relay_mail_batch(), (3, 3))
+        self.assertEqual([message.to for message in mail.outbox],
+                         [["user0@test.ru"], ["user1@test.ru"], ["user2@test.ru"]])
+        self.assertEqual(mail.outbox[0].subject, "Подтверждение почты")
+        self.assertEqual(MailOutbox.objects.filter(status=MailOutbox.SENT).count(), 3)
+        self.assertIsNone(cache.get(MAIL_RELAY_LOCK))
+        self.assertEqual(relay_mail_batch(), (0, 0))
+
+    def test_broker_unavailable(self, relay_mail):
+        relay_mail.side_effect = ConnectionRefusedError
+        with self.assertLogs("restaurant.notifications.mail", "ERROR"), \
+                self.captureOnCommitCallbacks(execute=True):
+            queue_mail("Подтверждение почты", "Привет", ["user@test.ru"])
+
+        # запрос не падает, письмо ждет периодического запуска relay_mail
+        self.assertIsNone(cache.get(MAIL_RELAY_LOCK))
+        self.assertEqual(relay_mail_batch(), (1, 1))
+
+    def test_retry_with_backoff(self, relay_mail):
+        queue_mail("Подтверждение почты", "Привет", ["user0@test.ru"])
+        queue_mail("Подтверждение почты", "Привет", ["user1@test.ru"])
+        self.now = timezone.now()
+
+        connection = mock.Mock()
+        connection.send.side_effect = ConnectionRefusedError("smtp down")
+        self.assertEqual(relay_mail_batch(self.now, connection=connection), (2, 0))
+        # после первой ошибки соединения остаток пакета откладывается без попыток
+        connection.send.assert_called_once()
+        self.assertEqual(set(MailOutbox.objects.values_list("status", "attempts", "available_at", "last_error")),
+                         {(MailOutbox.PENDING, 1, self.now + MAIL_RETRY_DELAY, "smtp down")})
+
+        moment = self.now
+        for _ in range(MAIL_MAX_ATTEMPTS - 1):
+            moment += datetime.timedelta(hours=1)
+            relay_mail_batch(moment, connection=connection)
+        self.assertEqual(MailOutbox.objects.filter(status=MailOutbox.FAILED).count(), 2)
+
+    def test_refused(self, relay_mail):
+        queue_mail("Подтверждение почты", "Привет", ["bad@test.ru"])
+        connection = mock.Mock()
+        connection.send.return_value = False
+
+        self.assertEqual(relay_mail_batch(connection=connection), (1, 0))
+        self.assertEqual(MailOutbox.objects.get().status, MailOutbox.FAILED)
+
+
+@mock.patch("restaurant.tasks.relay_mail.apply_async")
+class BookingMailTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.table = Table.objects.create(number=502, places=4, flour=1, description="test")
+
+    def test_booking_confirmation_mail(self, relay_mail):
+        user = User.objects.create_user(email="mail_user@test.ru", name="user", password="test")
+        self.client.login(email="mail_user@test.ru", password="test")
+        data = {"table": self.table.pk, "places": 2, "description": "test", "notification": 0,
+                "date_field": datetime.date.today() + datetime.timedelta(days=3),
+                "time_start": "15:00", "time_end": "17:00"}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(reverse("restaurant:booking_create"), data)
+
+        self.assertRedirects(resp, reverse("restaurant:confirm_booking", args=[user.email]),
+                             fetch_redirect_response=False)
+        outbox = MailOutbox.objects.get()
+        self.assertEqual(outbox.recipient_list, [user.email])
+        self.assertIn(Booking.objects.get(user=user).user_token.get().token, outbox.message)
+        relay_mail.assert_called_once()
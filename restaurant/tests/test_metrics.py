@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from restaurant.middleware import QueryBudgetExceeded
+from restaurant.utils.metrics import MetricsRegistry, RequestMetrics, metrics_registry, render_prometheus
+from users.models import User
+
+
+class QueryMetricsMiddlewareTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics_registry.reset()
+        self.staff = User.objects.create_user(email="staff@test.ru", password="test", is_staff=True)
+        self.user = User.objects.create_user(email="user@test.ru", password="test")
+
+    def test_server_timing(self):
+        self.client.login(email="staff@test.ru", password="test")
+        resp = self.client.get(reverse("restaurant:booking_list"))
+
+        timing = resp["Server-Timing"]
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(timing, r'cache;desc="\d+ hits, \d+ misses"')
+        self.assertRegex(timing, r"render;dur=[\d.]+, total;dur=[\d.]+")
+
+        # обычным пользователям подробности не показываются
+        self.client.login(email="user@test.ru", password="test")
+        self.assertNotIn("Server-Timing", self.client.get(reverse("restaurant:booking_list")))
+
+    def test_cache_hits(self):
+        self.client.login(email="staff@test.ru", password="test")
+        self.client.get(reverse("restaurant:main"))
+        # повторный запрос отдается из кеша страниц без SQL
+        self.assertIn('db;dur=0.0;desc="0 queries"', self.client.get(reverse("restaurant:main"))["Server-Timing"])
+
+        totals = metrics_registry.totals()["restaurant:main"]
+        self.assertEqual(totals["requests"], 2)
+        self.assertGreater(totals["cache_hits"], 0)
+        self.assertGreater(totals["cache_misses"], 0)
+
+    def test_query_budget(self):
+        self.client.login(email="user@test.ru", password="test")
+        # строгий режим в тестах включает TEST_RUNNER (config.test_runner), а не разбор командной строки
+        self.assertTrue(settings.QUERY_BUDGET_STRICT)
+        with self.settings(QUERY_BUDGETS={**settings.QUERY_BUDGETS, "restaurant:booking_list": 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("restaurant:booking_list"))
+
+            # вне тестов превышение только учитывается и пишется в лог
+            with self.settings(QUERY_BUDGET_STRICT=False), self.assertLogs("restaurant.middleware", "WARNING"):
+                self.assertEqual(self.client.get(reverse("restaurant:booking_list")).status_code, 200)
+
+        self.assertEqual(metrics_registry.totals()["restaurant:booking_list"]["over_budget"], 2)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("restaurant:main"))
+        self.assertEqual(self.client.get(reverse("restaurant:metrics")).status_code, 302)
+
+        self.client.login(email="staff@test.ru", password="test")
+        resp = self.client.get(reverse("restaurant:metrics"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('django_view_requests_total{view="restaurant:main"} 1', resp.content.decode())
+
+
+class MetricsRegistryTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_processes_aggregated(self):
+        # счетчики двух процессов складываются в кеше
+        first, second = MetricsRegistry(flush_interval=0), MetricsRegistry(flush_interval=60)
+        metrics = RequestMetrics()
+        metrics.queries, metrics.sql_time, metrics.cache_hits = 3, 0.25, 2
+
+        first.record("restaurant:main", metrics, 0.5, False)
+        second.record("restaurant:main", metrics, 0.5, True)
+        second.record("users:profile", metrics, 0.5, False)
+
+        totals = first.totals()
+        # второй процесс еще не сбросил свои счетчики
+        self.assertEqual(totals, {"restaurant:main": {"requests": 1, "queries": 3, "sql_us": 250000, "cache_hits": 2,
+                                                      "cache_misses": 0, "render_us": 0, "duration_us": 500000,
+                                                      "over_budget": 0}})
+
+        totals = second.totals()
+        self.assertEqual(totals["restaurant:main"]["requests"], 2)
+        self.assertEqual(totals["restaurant:main"]["over_budget"], 1)
+        self.assertEqual(totals["users:profile"]["queries"], 3)
+
+        text = render_prometheus(totals)
+        self.assertIn("# TYPE django_view_sql_seconds_total counter", text)
+        self.assertIn('django_view_sql_seconds_total{view="restaurant:main"} 0.5', text)
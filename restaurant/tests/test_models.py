@@ -1,3 +1,5 @@
+import datetime
+
 from django.test import TestCase
 from restaurant.models import Questions, Table, Booking, BookingToken, Contentlink, ContentParameters, ContentImage, \
     ContentText, Review
@@ -297,6 +299,42 @@ class BookingModelTest(TestCase):
         expected_object_name = f"{booking.pk}, {booking.user} - {booking.table}"
         self.assertEqual(expected_object_name, str(booking))
 
+    def test_booking_starts_at_ends_at(self):
+        booking = Booking.objects.create(user=User.objects.first(), table=Table.objects.first(), places=2,
+                                         date_field=datetime.date(2024, 4, 1), time_start=datetime.time(22, 0),
+                                         time_end=datetime.time(1, 30))
+
+        booking.refresh_from_db()
+        self.assertEqual(booking.starts_at, datetime.datetime(2024, 4, 1, 22, 0, tzinfo=datetime.timezone.utc))
+        self.assertEqual(booking.ends_at, datetime.datetime(2024, 4, 2, 1, 30, tzinfo=datetime.timezone.utc))
+
+        booking.time_end = datetime.time(23, 0)
+        booking.save(update_fields=["time_end"])
+
+        booking.refresh_from_db()
+        self.assertEqual(booking.ends_at, datetime.datetime(2024, 4, 1, 23, 0, tzinfo=datetime.timezone.utc))
+
+    def test_booking_notify_at(self):
+        user = User.objects.create_user(email="notify_at@test.ru", password="test", time_offset=3)
+        date = datetime.date.today() + datetime.timedelta(days=2)
+        booking = Booking.objects.create(user=user, table=Table.objects.first(), places=2, date_field=date,
+                                         time_start=datetime.time(18, 0), time_end=datetime.time(20, 0),
+                                         notification=2)
+
+        # 18:00 по UTC+3 минус 2 часа - 13:00 UTC
+        self.assertEqual(booking.notify_at, datetime.datetime.combine(date, datetime.time(13, 0),
+                                                                      tzinfo=datetime.timezone.utc))
+
+        user.time_offset = 5
+        user.save()
+        booking.refresh_from_db()
+        self.assertEqual(booking.notify_at.time(), datetime.time(11, 0))
+
+        booking.notification = 0
+        booking.save(update_fields=["notification"])
+        booking.refresh_from_db()
+        self.assertIsNone(booking.notify_at)
+
 
 class TableModelTest(TestCase):
     fixtures = ["test_data.json"]
@@ -0,0 +1,45 @@
+from datetime import time, timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from restaurant.models import ContentParameters
+from restaurant.utils.parameters import BookingParameters, get_parameters, parameters_service
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ParametersServiceTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        ContentParameters.objects.all().delete()
+        for title, body in (("period_of_booking", "10"), ("work_start", "12:00"), ("work_end", "16:00"),
+                            ("confirm_timedelta", "50")):
+            ContentParameters.objects.create(title=title, body=body, description="test")
+        parameters_service.reset()
+
+    def test_typed_parameters_one_query(self):
+        with self.assertNumQueries(1):
+            parameters = get_parameters()
+
+        self.assertEqual(parameters, BookingParameters(10, time(12, 0), time(16, 0), 50))
+        self.assertEqual(parameters.confirm_delta, timedelta(minutes=50))
+
+        with self.assertNumQueries(0):
+            get_parameters()
+
+    def test_hot_reload_on_save(self):
+        get_parameters()
+
+        work_end = ContentParameters.objects.get(title="work_end")
+        work_end.body = "22:30"
+        work_end.save()
+
+        self.assertEqual(get_parameters().work_end, time(22, 30))
+
+    def test_defaults_when_invalid(self):
+        ContentParameters.objects.filter(title="work_start").delete()
+        self.assertEqual(get_parameters(), BookingParameters())
+        self.assertIsNone(parameters_service.get())
@@ -0,0 +1,120 @@
+import datetime
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from restaurant.models import Table, Booking, BookingToken
+from restaurant.templates.restaurant import services
+from restaurant.templates.restaurant.services import get_cached_user_bookings, get_cached_day_bookings, \
+    booking_day_key, booking_user_key, ROWS_LAYOUT
+from restaurant.utils.cache import get_or_fill
+from users.models import User
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHE_ENABLED=True, CACHES=LOCMEM_CACHES)
+class BookingCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user_1 = User.objects.create_user(email="cache_1@test.ru", password="test")
+        self.user_2 = User.objects.create_user(email="cache_2@test.ru", password="test")
+        self.table = Table.objects.create(number=401, places=4, flour=1, description="test")
+        self.day = datetime.date.today() + datetime.timedelta(days=3)
+
+        self.booking_1 = self.create_booking(self.user_1, datetime.time(12, 0), datetime.time(13, 0))
+        self.booking_2 = self.create_booking(self.user_2, datetime.time(14, 0), datetime.time(15, 0))
+
+    def create_booking(self, user, time_start, time_end, day=None):
+        return Booking.objects.create(user=user, table=self.table, places=2, date_field=day or self.day,
+                                      time_start=time_start, time_end=time_end, active=True)
+
+    def test_user_bookings_cached(self):
+        bookings = get_cached_user_bookings(self.user_1)
+        self.assertEqual(bookings, [self.booking_1])
+
+        with self.assertNumQueries(0):
+            bookings = get_cached_user_bookings(self.user_1)
+            self.assertEqual(bookings[0].user, self.user_1)
+            self.assertEqual(str(bookings[0].table), str(self.table))
+            self.assertEqual(bookings[0].time_start, datetime.time(12, 0))
+
+    def test_user_bookings_targeted_invalidation(self):
+        get_cached_user_bookings(self.user_1)
+        get_cached_user_bookings(self.user_2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.create_booking(self.user_2, datetime.time(16, 0), datetime.time(17, 0))
+
+        # изменение у второго пользователя не трогает кеш первого
+        with self.assertNumQueries(0):
+            get_cached_user_bookings(self.user_1)
+        self.assertEqual(get_cached_user_bookings(self.user_2), [self.booking_2, booking])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.delete()
+        self.assertEqual(get_cached_user_bookings(self.user_2), [self.booking_2])
+
+    def test_day_bookings_invalidation(self):
+        self.assertEqual({row[1] for row in get_cached_day_bookings(self.day)}, {self.booking_1.pk, self.booking_2.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BookingToken.objects.create(booking=self.booking_1, token="cache-token")
+        row = [row for row in get_cached_day_bookings(self.day) if row[1] == self.booking_1.pk][0]
+        self.assertIsNotNone(row[5])
+
+        # перенос бронирования на другие сутки сбрасывает и старые, и новые сутки
+        next_day = self.day + datetime.timedelta(days=1)
+        get_cached_day_bookings(next_day)
+
+        booking = Booking.objects.get(pk=self.booking_2.pk)
+        booking.date_field = next_day
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.save()
+
+        self.assertEqual({row[1] for row in get_cached_day_bookings(self.day)}, {self.booking_1.pk})
+        self.assertEqual({row[1] for row in get_cached_day_bookings(next_day)}, {self.booking_2.pk})
+
+    def test_invalidation_after_commit(self):
+        get_cached_user_bookings(self.user_1)
+        self.assertEqual(len(get_cached_day_bookings(self.day)), 2)
+
+        # до коммита ключи не сбрасываются: заполнить их данными незакоммиченной транзакции нельзя
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.booking_1.delete()
+            with self.assertNumQueries(0):
+                self.assertEqual(len(get_cached_day_bookings(self.day)), 2)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_cached_user_bookings(self.user_1), [])
+        self.assertEqual({row[1] for row in get_cached_day_bookings(self.day)}, {self.booking_2.pk})
+
+    def test_fill_racing_commit_not_cached(self):
+        # заполнение прочитало строки до коммита параллельной записи и пишет в кеш уже после сброса
+        def racing_get_or_fill(key, fill, *args, **kwargs):
+            def stale_fill():
+                rows = fill()
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.create_booking(self.user_1, datetime.time(18, 0), datetime.time(19, 0))
+                return rows
+            return get_or_fill(key, stale_fill, *args, **kwargs)
+
+        with patch.object(services, "get_or_fill", racing_get_or_fill):
+            self.assertEqual(len(get_cached_day_bookings(self.day)), 2)
+
+        self.assertEqual(len(get_cached_day_bookings(self.day)), 3)
+
+    def test_layout_in_keys(self):
+        # смена состава колонок меняет ключи, старые кортежи не распаковываются
+        self.assertIn(ROWS_LAYOUT, booking_day_key(self.day))
+        self.assertIn(ROWS_LAYOUT, booking_user_key(self.user_1.pk))
+
+    def test_midnight_booking_in_both_days(self):
+        booking = self.create_booking(self.user_1, datetime.time(23, 0), datetime.time(1, 0))
+        next_day = self.day + datetime.timedelta(days=1)
+
+        self.assertIn(booking.pk, {row[1] for row in get_cached_day_bookings(self.day)})
+        self.assertIn(booking.pk, {row[1] for row in get_cached_day_bookings(next_day)})
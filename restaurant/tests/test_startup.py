@@ -0,0 +1,21 @@
+from unittest import TestCase
+
+from restaurant.management.commands.startup_report import TARGETS, measure_startup, parse_importtime
+
+
+class StartupTest(TestCase):
+
+    def test_no_queries_during_import(self):
+        # импорт веб-процесса и воркера не должен обращаться к базе (параметры и контент загружаются лениво)
+        report = measure_startup(TARGETS["web"] + TARGETS["worker"])
+        self.assertEqual(report["queries"], [])
+
+        imported = {name for name, self_us, cumulative_us in report["imports"]}
+        self.assertIn("restaurant.views", imported)
+        self.assertNotIn("requests", imported)
+
+    def test_parse_importtime(self):
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       305 |       7859 |   django.core.mail\n"
+                  "other output\n")
+        self.assertEqual(parse_importtime(stderr), [("django.core.mail", 305, 7859)])
@@ -0,0 +1,230 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from restaurant.models import Table, Booking, NotificationOutbox
+from restaurant.notifications.outbox import deliver_scheduled_notification, deliver_due_notifications, \
+    OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY
+from restaurant.notifications.telegram import TelegramError
+from restaurant.tasks import send_reminder, reconcile_reminders
+from restaurant.utils.utils import get_due_notifications
+from users.models import User
+
+
+@mock.patch("restaurant.notifications.outbox.current_app")
+@mock.patch("restaurant.tasks.send_reminder.apply_async")
+class NotificationOutboxTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="notify@test.ru", password="test", time_offset=3,
+                                             tg_chat_id="100")
+        self.user_no_tg = User.objects.create_user(email="no_tg@test.ru", password="test", time_offset=3)
+        self.date = datetime.date.today() + datetime.timedelta(days=1)
+
+        # 18:00 по местному времени UTC+3 - это 15:00 UTC, напоминание за 2 часа - в 13:00 UTC
+        self.booking = self.create_booking(self.user, datetime.time(18, 0), notification=2)
+        self.booking_no_tg = self.create_booking(self.user_no_tg, datetime.time(18, 0), notification=2)
+        self.create_booking(self.user, datetime.time(12, 0), notification=0)
+        self.create_booking(self.user, datetime.time(20, 0), notification=2, active=False)
+
+        self.moment = datetime.datetime.combine(self.date, datetime.time(13, 0, 25), tzinfo=datetime.timezone.utc)
+
+    def create_booking(self, user, time_start, notification, active=True):
+        # у каждого бронирования свой столик, чтобы не пересекаться по времени
+        table = Table.objects.create(number=500 + Table.objects.count(), places=4, flour=1, description="test")
+        time_end = (datetime.datetime.combine(self.date, time_start) + datetime.timedelta(hours=1)).time()
+        return Booking.objects.create(user=user, table=table, places=2, date_field=self.date,
+                                      time_start=time_start, time_end=time_end, notification=notification,
+                                      active=active)
+
+    def deliver(self, booking, now):
+        notification = NotificationOutbox.objects.get(booking=booking)
+        return deliver_scheduled_notification(notification.pk, notification.task_id, now)
+
+    def test_eta_task_follows_booking(self, apply_async, celery_app):
+        notification = NotificationOutbox.objects.get(booking=self.booking)
+        self.assertEqual(NotificationOutbox.objects.count(), 2)
+        self.assertEqual(notification.due_at, self.booking.notify_at)
+
+        # задача ставится после коммита, с eta на момент напоминания
+        with self.captureOnCommitCallbacks(execute=True):
+            self.booking.time_start, self.booking.time_end = datetime.time(19, 0), datetime.time(20, 0)
+            self.booking.save()
+
+        moved = NotificationOutbox.objects.get(booking=self.booking)
+        apply_async.assert_called_once_with((moved.pk,), eta=self.booking.notify_at, task_id=moved.task_id)
+        celery_app.control.revoke.assert_called_once_with(notification.task_id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.booking.active = False
+            self.booking.save()
+        self.assertFalse(NotificationOutbox.objects.filter(booking=self.booking).exists())
+        celery_app.control.revoke.assert_called_with(moved.task_id)
+
+    @mock.patch("restaurant.notifications.outbox.send_telegram_message")
+    def test_time_offset_reschedules_reminder(self, send, apply_async, celery_app):
+        old = NotificationOutbox.objects.get(booking=self.booking)
+
+        # UTC+3 -> UTC+1: 18:00 по местному времени - это 17:00 UTC, напоминание - в 15:00 UTC (позже)
+        # UTC+1 -> UTC+5: напоминание в 11:00 UTC (раньше)
+        for time_offset, hour in ((1, 15), (5, 11)):
+            with self.subTest(time_offset=time_offset), self.captureOnCommitCallbacks(execute=True):
+                self.user.time_offset = time_offset
+                self.user.save()
+
+            notification = NotificationOutbox.objects.get(booking=self.booking)
+            moment = datetime.datetime.combine(self.date, datetime.time(hour), tzinfo=datetime.timezone.utc)
+            self.assertEqual(notification.available_at, moment)
+            self.assertNotEqual(notification.task_id, old.task_id)
+            apply_async.assert_any_call((notification.pk,), eta=moment, task_id=notification.task_id)
+            celery_app.control.revoke.assert_any_call(old.task_id)
+
+            # прежняя задача ничего не отправляет ни в свое время, ни в новое; новая - ровно один раз
+            self.assertFalse(deliver_scheduled_notification(old.pk, old.task_id, old.available_at))
+            self.assertFalse(deliver_scheduled_notification(old.pk, old.task_id, moment))
+            self.assertFalse(deliver_scheduled_notification(notification.pk, notification.task_id,
+                                                            moment - datetime.timedelta(minutes=1)))
+            send.reset_mock()
+            self.assertTrue(deliver_scheduled_notification(notification.pk, notification.task_id, moment))
+            self.assertFalse(deliver_scheduled_notification(notification.pk, notification.task_id, moment))
+            send.assert_called_once()
+
+            # следующий сдвиг - для нового, еще не отправленного напоминания
+            NotificationOutbox.objects.filter(pk=notification.pk).update(status=NotificationOutbox.PENDING)
+            old = NotificationOutbox.objects.get(pk=notification.pk)
+
+    def test_user_save_without_offset_change(self, apply_async, celery_app):
+        # сохранение профиля без смены смещения не трогает бронирования и не переставляет задачи
+        user = User.objects.get(pk=self.user.pk)
+        user.name = "new name"
+        apply_async.reset_mock()
+        with self.assertNumQueries(1), self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        apply_async.assert_not_called()
+        celery_app.control.revoke.assert_not_called()
+
+    def test_due_notifications(self, apply_async, celery_app):
+        with self.assertNumQueries(1):
+            due = list(get_due_notifications(self.moment - datetime.timedelta(minutes=1), self.moment))
+            self.assertEqual(due, [self.booking])
+            self.assertEqual(due[0].user.tg_chat_id, "100")
+
+        self.assertEqual(list(get_due_notifications(self.moment, self.moment + datetime.timedelta(hours=1))), [])
+
+    @mock.patch("restaurant.notifications.outbox.send_telegram_message")
+    def test_delivered_once(self, send, apply_async, celery_app):
+        notification = NotificationOutbox.objects.get(booking=self.booking)
+        with mock.patch("restaurant.notifications.outbox.timezone.now", return_value=self.moment):
+            self.assertTrue(send_reminder.apply((notification.pk,), task_id=notification.task_id).get())
+
+        send.assert_called_once()
+        chat_id, message = send.call_args.args
+        self.assertEqual(chat_id, "100")
+        self.assertIn(str(self.booking.table), message)
+        self.assertEqual(NotificationOutbox.objects.get(booking=self.booking).status, NotificationOutbox.SENT)
+
+        # повторная доставка задачи брокером, задача с устаревшим id и преждевременный запуск ничего не отправляют
+        self.assertFalse(deliver_scheduled_notification(notification.pk, notification.task_id, self.moment))
+        self.assertFalse(deliver_scheduled_notification(notification.pk, "stale", self.moment))
+        self.assertFalse(self.deliver(self.booking_no_tg, self.moment - datetime.timedelta(hours=1)))
+        send.assert_called_once()
+
+        self.assertFalse(self.deliver(self.booking_no_tg, self.moment))
+        self.assertEqual(NotificationOutbox.objects.get(booking=self.booking_no_tg).status,
+                         NotificationOutbox.SKIPPED)
+
+    @mock.patch("restaurant.notifications.outbox.send_telegram_message", side_effect=ConnectionError("timeout"))
+    def test_retry_with_backoff(self, send, apply_async, celery_app):
+        task_id = NotificationOutbox.objects.get(booking=self.booking).task_id
+        self.assertFalse(self.deliver(self.booking, self.moment))
+
+        notification = NotificationOutbox.objects.get(booking=self.booking)
+        self.assertEqual(notification.status, NotificationOutbox.PENDING)
+        self.assertEqual(notification.attempts, 1)
+        self.assertEqual(notification.available_at, self.moment + OUTBOX_RETRY_DELAY)
+        self.assertEqual(notification.last_error, "timeout")
+        # повтор - новая задача с eta на время следующей попытки
+        self.assertNotEqual(notification.task_id, task_id)
+
+        moment = self.moment
+        for _ in range(OUTBOX_MAX_ATTEMPTS - 1):
+            moment += datetime.timedelta(minutes=10)
+            self.deliver(self.booking, moment)
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, NotificationOutbox.FAILED)
+        self.assertEqual(send.call_count, OUTBOX_MAX_ATTEMPTS)
+
+    @mock.patch("restaurant.notifications.outbox.send_batch_async")
+    def test_overdue_sent_in_batch(self, send_batch, apply_async, celery_app):
+        send_batch.side_effect = lambda messages: [{} for message in messages]
+
+        self.assertEqual(deliver_due_notifications(self.moment), (2, 1))
+        (chat_id, message), = send_batch.call_args.args[0]
+        self.assertEqual(chat_id, "100")
+        self.assertEqual(NotificationOutbox.objects.get(booking=self.booking).status, NotificationOutbox.SENT)
+        self.assertEqual(NotificationOutbox.objects.get(booking=self.booking_no_tg).status,
+                         NotificationOutbox.SKIPPED)
+
+        # отложенная задача той же записи уже ничего не отправит
+        self.assertFalse(self.deliver(self.booking, self.moment))
+        self.assertEqual(deliver_due_notifications(self.moment), (0, 0))
+
+    @mock.patch("restaurant.notifications.outbox.send_batch_async")
+    def test_batch_retry_after(self, send_batch, apply_async, celery_app):
+        send_batch.return_value = [TelegramError("Too Many Requests", 429, retry_after=120)]
+        deliver_due_notifications(self.moment)
+
+        notification = NotificationOutbox.objects.get(booking=self.booking)
+        self.assertEqual(notification.status, NotificationOutbox.PENDING)
+        self.assertEqual(notification.available_at, self.moment + datetime.timedelta(seconds=120))
+
+    @mock.patch("restaurant.tasks.send_due_reminders.delay")
+    @mock.patch("restaurant.notifications.outbox.send_telegram_message")
+    def test_burst_sent_in_batch(self, send, send_due_reminders, apply_async, celery_app):
+        cache.clear()
+        notification = NotificationOutbox.objects.get(booking=self.booking)
+        with mock.patch("restaurant.tasks.timezone.now", return_value=self.moment):
+            send_reminder.apply((notification.pk,), task_id=notification.task_id)
+            # одно наступившее напоминание - не всплеск
+            send_due_reminders.assert_not_called()
+
+            with mock.patch("restaurant.notifications.outbox.OUTBOX_BURST_SIZE", 1):
+                send_reminder.apply((notification.pk,), task_id=notification.task_id)
+                send_reminder.apply((notification.pk,), task_id=notification.task_id)
+        # пакетная задача ставится один раз на всплеск
+        send_due_reminders.assert_called_once_with()
+
+    def test_reconcile_command(self, apply_async, celery_app):
+        # бронирование подтверждено в обход save(), а задачи потеряны вместе с брокером
+        booking = self.create_booking(self.user, datetime.time(17, 0), notification=2, active=False)
+        Booking.objects.filter(pk=booking.pk).update(active=True)
+        old_task_id = NotificationOutbox.objects.get(booking=self.booking).task_id
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("reconcile_reminders", stdout=out)
+
+        self.assertIn("создано записей: 1, поставлено задач: 3, просрочено (отправка пакетом): 0", out.getvalue())
+        self.assertEqual(apply_async.call_count, 3)
+        self.assertTrue(NotificationOutbox.objects.filter(booking=booking, task_id__isnull=False).exists())
+        self.assertNotEqual(NotificationOutbox.objects.get(booking=self.booking).task_id, old_task_id)
+
+    def test_periodic_reconcile_schedules_unscheduled(self, apply_async, celery_app):
+        # запись, перенесенная миграцией, без задачи; у остальных задачи уже стоят
+        NotificationOutbox.objects.filter(booking=self.booking).update(task_id=None)
+        task_id = NotificationOutbox.objects.get(booking=self.booking_no_tg).task_id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reconcile_reminders.apply().get(), 1)
+
+        notification = NotificationOutbox.objects.get(booking=self.booking)
+        self.assertIsNotNone(notification.task_id)
+        apply_async.assert_called_once_with((notification.pk,), eta=notification.available_at,
+                                            task_id=notification.task_id)
+        self.assertEqual(NotificationOutbox.objects.get(booking=self.booking_no_tg).task_id, task_id)
+        celery_app.control.revoke.assert_not_called()
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from restaurant.management.commands.telegram_benchmark import run_benchmark
+from restaurant.notifications.telegram import TelegramClient, AsyncTelegramClient, TelegramError, TokenBucket
+
+
+class StubTelegramHandler(BaseHTTPRequestHandler):
+    # keep-alive, как у api.telegram.org
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.path, body, self.client_address))
+
+        status, data = self.server.responses.pop(0) if self.server.responses else (200, {"ok": True, "result": {}})
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubTelegramTestCase(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubTelegramHandler)
+        self.server.requests, self.server.responses = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/bot"
+        self.sleeps = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TelegramClientTest(StubTelegramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = TelegramClient(self.url, "TOKEN", timeout=(1, 2), rate=1000, chat_rate=1000,
+                                     sleep=self.sleeps.append)
+
+    def tearDown(self):
+        self.client.close()
+        super().tearDown()
+
+    def test_keep_alive(self):
+        for number in range(3):
+            self.client.send_message("100", f"сообщение {number}")
+
+        self.assertEqual(len(self.server.requests), 3)
+        path, body, address = self.server.requests[0]
+        self.assertEqual(path, "/botTOKEN/sendMessage")
+        self.assertEqual(body, {"chat_id": "100", "text": "сообщение 0"})
+        # все сообщения ушли по одному соединению
+        self.assertEqual(len({address for path, body, address in self.server.requests}), 1)
+
+    def test_retry_after(self):
+        self.server.responses = [
+            (429, {"ok": False, "description": "Too Many Requests", "parameters": {"retry_after": 3}}),
+            (502, {}),
+        ]
+        self.assertEqual(self.client.send_message("100", "текст"), {})
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertGreater(self.sleeps[0], 2)
+
+    def test_errors(self):
+        self.server.responses = [(400, {"ok": False, "description": "Bad Request: chat not found"})]
+        with self.assertRaises(TelegramError) as error:
+            self.client.send_message("100", "текст")
+        self.assertEqual(error.exception.status, 400)
+        self.assertEqual(len(self.server.requests), 1)
+
+        # долгое ожидание не блокирует воркер: ошибка с retry_after для очереди напоминаний
+        self.server.responses = [(429, {"ok": False, "parameters": {"retry_after": 600}})]
+        with self.assertRaises(TelegramError) as error:
+            self.client.send_message("100", "текст")
+        self.assertEqual(error.exception.retry_after, 600)
+
+    def test_send_batch(self):
+        self.server.responses = [(403, {"ok": False, "description": "Forbidden: bot was blocked by the user"})]
+        results = self.client.send_batch([("100", "первое"), ("200", "второе"), ("300", "третье")])
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(sum(isinstance(result, TelegramError) for result in results), 1)
+        self.assertEqual(sum(result == {} for result in results), 2)
+
+
+class AsyncTelegramClientTest(StubTelegramTestCase):
+
+    def send_batch(self, messages):
+        async def sleep(delay):
+            self.sleeps.append(delay)
+
+        async def run():
+            async with AsyncTelegramClient(self.url, "TOKEN", timeout=(1, 2), rate=1000, chat_rate=1000,
+                                           concurrency=16, sleep=sleep) as client:
+                return await client.send_batch(messages)
+
+        return asyncio.run(run())
+
+    def test_async_send_batch(self):
+        self.server.responses = [
+            (429, {"ok": False, "parameters": {"retry_after": 2}}),
+            (400, {"ok": False, "description": "Bad Request: chat not found"}),
+        ]
+        results = self.send_batch([(str(chat_id), "напоминание") for chat_id in range(40)])
+
+        # 40 сообщений + повтор после 429; ошибка одного сообщения не мешает остальным
+        self.assertEqual(len(self.server.requests), 41)
+        self.assertEqual(sum(isinstance(result, TelegramError) for result in results), 1)
+        self.assertEqual({body["chat_id"] for path, body, address in self.server.requests},
+                         {str(chat_id) for chat_id in range(40)})
+        self.assertGreater(max(self.sleeps), 1)
+        # соединения переиспользуются: не больше concurrency на весь пакет
+        self.assertLessEqual(len({address for path, body, address in self.server.requests}), 16)
+
+
+class TelegramBenchmarkTest(TestCase):
+
+    def test_benchmark(self):
+        results = run_benchmark(messages=20, latency=0, concurrency=8, pool_size=4)
+        self.assertEqual({name: result["sent"] for name, result in results.items()},
+                         {"sequential": 20, "threads": 20, "asyncio": 20})
+
+
+class TokenBucketTest(TestCase):
+
+    def test_reserve(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0, 0])
+        # третий и четвертый запросы ждут своей очереди
+        self.assertEqual([bucket.reserve(), bucket.reserve()], [0.5, 1.0])
+
+        now[0] = 10
+        self.assertEqual(bucket.reserve(), 0)
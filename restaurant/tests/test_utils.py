@@ -1,9 +1,12 @@
-from datetime import datetime, time, date
+from datetime import datetime, time, date, timedelta, timezone
 from unittest import TestCase
 
-from restaurant.models import ContentParameters, ContentText, ContentImage, Contentlink
+from django.test import TestCase as DjangoTestCase
+
+from restaurant.models import ContentParameters, ContentText, ContentImage, Contentlink, Table, Booking
 from restaurant.utils.utils import time_segment, get_content_parameters, get_content_text_from_postgres, \
-    get_content_image_from_postgres, get_content_link_from_postgres
+    get_content_image_from_postgres, get_content_link_from_postgres, get_actual_bookings, get_content_bulk
+from users.models import User
 
 
 class UtilsTest(TestCase):
@@ -83,3 +86,59 @@ class UtilsTest(TestCase):
 
         self.assertEqual(text_error.description, text_e)
         self.assertEqual(text_success.text, test_link.text)
+
+
+class ContentBulkTest(DjangoTestCase):
+
+    def test_get_content_bulk(self):
+        ContentText.objects.create(title="bulk-text", body="text")
+        ContentImage.objects.create(title="bulk-image", description="image", image=None)
+        Contentlink.objects.create(title="bulk-link", text="bulk", link="#", description="link")
+
+        # реестр контента перезагружается после сохранения записей: по одному запросу на модель
+        with self.assertNumQueries(3):
+            content = get_content_bulk(texts=("bulk-text", "bulk-missing"), images=("bulk-image", "bulk-missing"),
+                                       links=("bulk-link",))
+
+        self.assertEqual(content["bulk_text"], "text")
+        self.assertEqual(content["bulk_image"].description, "image")
+        self.assertEqual(content["bulk_link"].text, "bulk")
+        # для отсутствующих записей - заглушки, как у одиночных функций
+        self.assertEqual(content["bulk_missing"].description, ("Для изменения изображения создайте запись "
+                                                               "'bulk-missing' в таблице ContentImage и загрузите "
+                                                               "изображение (необходимы полномочия администратора)"))
+        self.assertFalse(ContentImage.objects.filter(title="not_found").exists())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_content_bulk(), {})
+            self.assertEqual(get_content_bulk(texts=("bulk-text",)), {"bulk_text": "text"})
+
+
+class ActualBookingsTest(DjangoTestCase):
+
+    def setUp(self):
+        table = Table.objects.create(number=201, places=4, flour=1, description="test")
+        user_utc = User.objects.create_user(email="utc@test.ru", password="test", time_offset=0)
+        user_msk = User.objects.create_user(email="msk@test.ru", password="test", time_offset=3)
+
+        # "настенное" время через 2 часа после текущего UTC: у пользователя UTC+3 оно уже прошло
+        start = datetime.now(timezone.utc) + timedelta(hours=2)
+        end = start + timedelta(hours=2)
+
+        self.booking_utc = Booking.objects.create(user=user_utc, table=table, places=2, date_field=start.date(),
+                                                  time_start=start.time(), time_end=end.time(), active=True)
+        self.booking_msk = Booking.objects.create(user=user_msk, table=table, places=2, date_field=start.date(),
+                                                  time_start=start.time(), time_end=end.time(), active=False)
+
+    def test_local_time_offset(self):
+        self.assertEqual(list(get_actual_bookings(active=True, time_start=True)), [self.booking_utc])
+        self.assertEqual(set(get_actual_bookings(active=False, time_start=False)),
+                         {self.booking_utc, self.booking_msk})
+        self.assertEqual(list(get_actual_bookings(active=False, time_start=True)), [self.booking_utc])
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            bookings = get_actual_bookings(active=False, time_start=False)
+            for b in bookings:
+                self.assertTrue(b.user.time_offset in (0, 3))
+                self.assertTrue(b.table.number)
@@ -1,10 +1,15 @@
 import datetime
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
 
-from restaurant.models import Table, Booking
+from restaurant.models import Table, Booking, MailOutbox
 from django.urls import reverse
 
-from restaurant.templates.restaurant.services import cache_clear
+from restaurant.utils.content import content_registry
+from restaurant.utils.parameters import get_parameters
 from users.models import User
 
 
@@ -34,12 +39,12 @@ class QuestionsListViewTest(TestCase):
 
 class HomeListViewTest(TestCase):
     # CACHE_ENABLED = False
-    # cache_clear()
+    # cache.clear()
     fixtures = ["test_data.json"]
 
     def setUp(self):
         self.CACHE_ENABLED = False
-        cache_clear()
+        cache.clear()
 
     def test_home_url_exists_at_desired_location(self):
         resp = self.client.get("/")
@@ -73,16 +78,28 @@ class HomeListViewTest(TestCase):
         self.assertTrue("whatsup" in resp.context)
         self.assertTrue("vkontakte" in resp.context)
 
+    def test_home_content_queries(self):
+        # загрузка реестра контента - по одному запросу на ContentText, ContentImage и Contentlink,
+        # дальше контент читается из памяти процесса
+        content_registry.reset()
+        with self.assertNumQueries(3):
+            resp = self.client.get(reverse("restaurant:main"))
+        self.assertEqual(resp.status_code, 200)
+
+        cache.clear()
+        with self.assertNumQueries(0):
+            self.client.get(reverse("restaurant:main"))
+
 
 class AboutListViewTest(TestCase):
     # CACHE_ENABLED = False
-    # cache_clear()
+    # cache.clear()
     fixtures = ["test_data.json"]
 
     def setUp(self):
         # self.cache_off = False
         self.CACHE_ENABLED = False
-        cache_clear()
+        cache.clear()
 
     def test_home_url_exists_at_desired_location(self):
         resp = self.client.get("/about_us/")
@@ -113,6 +130,16 @@ class AboutListViewTest(TestCase):
         self.assertTrue("about_us_team2" in resp.context)
         self.assertTrue("about_us_team3" in resp.context)
 
+    def test_about_us_content_queries(self):
+        content_registry.reset()
+        with self.assertNumQueries(3):
+            resp = self.client.get(reverse("restaurant:about_us"))
+        self.assertEqual(resp.status_code, 200)
+
+        cache.clear()
+        with self.assertNumQueries(0):
+            self.client.get(reverse("restaurant:about_us"))
+
 
 class BookingListViewTest(TestCase):
     fixtures = ["test_data.json"]
@@ -250,26 +277,94 @@ class BookingCreateViewTest(TestCase):
         # Check that we got a response "success"
         self.assertEqual(resp.status_code, 200)
 
-        # Проверка, что все бронирования пользователя показаны
-        self.assertTrue("booking_list" in resp.context)
-        self.assertEqual(len(resp.context["booking_list"]), 20)
+        # занятые столики по номерам, бронирования всех пользователей сгруппированы по дням
+        tables = resp.context["tables_list"]
+        self.assertEqual([t.number for t in tables], sorted([Table.objects.first().number,
+                                                             Table.objects.last().number]))
+        date_next = datetime.date.today() + datetime.timedelta(days=2)
+        for table in tables:
+            self.assertEqual([day for day, _ in table.booking_days], [date_next])
+            starts = [b["time_start"] for b in table.booking_days[0][1]]
+            self.assertEqual(len(starts), 10)
+            # проверка, что список отсортирован
+            self.assertEqual(starts, sorted(starts))
+
+    def test_free_tables_for_form_period(self):
+        # у изменяемого бронирования - столики, свободные в его период (свой столик тоже свободен)
+        booking = Booking.objects.filter(user__email="test_user2@test.ru").order_by("time_start").first()
+        other = Booking.objects.filter(time_start=booking.time_start).exclude(pk=booking.pk).get().table
+        Booking.objects.filter(pk=booking.pk).update(places=1)
 
-        # Подтверждение, что бронирования принадлежат разным пользователям
-        different_users = False
-        for booking_item in resp.context["booking_list"]:
-            if booking_item.user != resp.context["user"]:
-                different_users = True
-                break
-        self.assertTrue(different_users)
+        self.client.login(email="test_user2@test.ru", password="test")
+        resp = self.client.get(reverse("restaurant:booking_update", args=[booking.pk]))
+        free_tables = resp.context["form"].free_tables
+        self.assertIn(booking.table, free_tables)
+        self.assertNotIn(other, free_tables)
+        self.assertContains(resp, "В это время свободны столики")
+
+    def test_window_follows_user_time_offset(self):
+        # периоды хранятся в "настенном" времени пользователя: для UTC+10 бронирование на 3 часа вперед по UTC
+        # закончилось 6 часов назад по его часам, а то, что закончится через 12 часов по UTC, - еще впереди
+        user = User.objects.get(email="test_user2@test.ru")
+        User.objects.filter(pk=user.pk).update(time_offset=10)
+        table = Table.objects.first()
+        now = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+        for hours in (3, 11):
+            start = now + datetime.timedelta(hours=hours)
+            Booking.objects.create(user=user, table=table, places=1, notification=0, date_field=start.date(),
+                                   time_start=start.time(), time_end=(start + datetime.timedelta(hours=1)).time(),
+                                   active=True)
+        past, future = (now + datetime.timedelta(hours=hours) for hours in (3, 11))
 
-        # проверка, что список отсортирован
-        date_last = 0
-        time_last = 0
+        self.client.login(email="test_user2@test.ru", password="test")
+        resp = self.client.get(reverse("restaurant:booking_create"))
+        shown = {(day, b["time_start"]) for t in resp.context["tables_list"] for day, bookings in t.booking_days
+                 for b in bookings}
+        self.assertNotIn((past.date(), past.time()), shown)
+        self.assertIn((future.date(), future.time()), shown)
+
+    def test_bookings_outside_period_not_loaded(self):
+        # прошедшие и дальше срока бронирования не выбираются
+        user = User.objects.get(email="test_user1@test.ru")
+        table = Table.objects.first()
+        period_of_booking = get_parameters().period_of_booking
+        for days in (-3, period_of_booking + 2):
+            Booking.objects.create(user=user, table=table, places=1, notification=0,
+                                   date_field=datetime.date.today() + datetime.timedelta(days=days),
+                                   time_start=datetime.time(12), time_end=datetime.time(13), active=True)
 
-        for copy in resp.context["booking_list"]:
-            if date_last == 0:
-                date_last = copy.date_field
-                time_last = copy.time_start
-            else:
-                self.assertTrue(copy.date_field >= date_last)
-                self.assertTrue(copy.time_start >= time_last)
+        self.client.login(email="test_user2@test.ru", password="test")
+        resp = self.client.get(reverse("restaurant:booking_create"))
+        days = {day for t in resp.context["tables_list"] for day, _ in t.booking_days}
+        self.assertEqual(days, {datetime.date.today() + datetime.timedelta(days=2)})
+
+
+@skipUnless(connection.vendor == "postgresql", "ограничение booking_table_period_excl есть только в PostgreSQL")
+class BookingConstraintTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.table = Table.objects.create(number=501, places=4, flour=1, description="test")
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="test_user_constraint@test.ru", name="user", password="test")
+        self.date_next = datetime.date.today() + datetime.timedelta(days=2)
+
+        Booking.objects.create(user=self.user, table=self.table, places=2, notification=0,
+                               date_field=self.date_next, time_start=datetime.time(14, 0),
+                               time_end=datetime.time(16, 0), active=True)
+
+    def test_concurrent_booking_rejected_by_database(self):
+        self.client.login(email="test_user_constraint@test.ru", password="test")
+        data = {"table": self.table.pk, "places": 2, "description": "test", "notification": 0,
+                "date_field": self.date_next, "time_start": "15:00", "time_end": "17:00"}
+
+        # имитация гонки: проверка формы уже прошла, а столик занял параллельный запрос
+        with mock.patch("restaurant.forms.find_conflict", return_value=None):
+            resp = self.client.post(reverse("restaurant:booking_create"), data)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("В указанный период времени столик забронирован", resp.context["form"].non_field_errors())
+        self.assertEqual(Booking.objects.filter(table=self.table, date_field=self.date_next).count(), 1)
+        # письмо о подтверждении откатилось вместе с бронированием
+        self.assertFalse(MailOutbox.objects.exists())
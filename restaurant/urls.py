@@ -1,13 +1,13 @@
 from django.urls import path
-from django.views.decorators.cache import cache_page
 
 from .views import HomePageView, AboutUsPageView, BookingListView, BookingCreateView, BookingUpdateView, \
-    BookingDeleteView, BookingDetailView, toggle_activity_booking, confirm_booking, booking_verification, \
-    QuestionCreateView, QuestionListView, QuestionUpdateView, QuestionDeleteView, questions_success
+    BookingDeleteView, BookingDetailView, toggle_activity_booking, confirm_booking, booking_verification, free_slots, \
+    QuestionCreateView, QuestionListView, QuestionUpdateView, QuestionDeleteView, questions_success, metrics
 
 # MessageCreateView,
 
 from restaurant.apps import RestaurantConfig
+from restaurant.utils.cache import versioned_cache_page
 
 app_name = RestaurantConfig.name
 
@@ -15,10 +15,9 @@ urlpatterns = [
     # path("actual_booking/", actual_booking, name="actual_booking"),
 
     # страницы вообще почти не меняются, потому закеширую их на 300 секунд (5 минут!)
-    # изменение параметров страницы (текст и картинки) будут конечно отражаться на сайте с 5 минутной задержкой
-    # не вижу в этом проблемы, они меняются так редко что можно и подождать
-    path("", cache_page(300)(HomePageView.as_view()), name="main"),
-    path("about_us/", cache_page(300)(AboutUsPageView.as_view()), name="about_us"),
+    # ключи страниц лежат в пространстве имен "pages": сброс - bump_namespace_version("pages"), без cache.clear()
+    path("", versioned_cache_page(300, "pages")(HomePageView.as_view()), name="main"),
+    path("about_us/", versioned_cache_page(300, "pages")(AboutUsPageView.as_view()), name="about_us"),
 
     path("booking_list/", BookingListView.as_view(), name="booking_list"),
     path("booking_create/", BookingCreateView.as_view(), name="booking_create"),
@@ -27,6 +26,8 @@ urlpatterns = [
     path("booking_detail/<int:pk>/", BookingDetailView.as_view(), name="booking_detail"),
 
     path("booking_activity/<int:pk>/", toggle_activity_booking, name="booking_activity"),
+    # свободные промежутки столиков на дату (JSON)
+    path("free_slots/", free_slots, name="free_slots"),
 
     path("confirm_booking/<str:email>/", confirm_booking, name="confirm_booking"),
     path("booking_verification/<str:token>/", booking_verification, name="booking_verification"),
@@ -39,4 +40,7 @@ urlpatterns = [
     path("question_delete/<int:pk>/", QuestionDeleteView.as_view(), name="question_delete"),
     path("question_list/", QuestionListView.as_view(), name="question_list"),
     path("question_success/<str:message>/", questions_success, name="questions_success"),
+
+    # метрики запросов по представлениям (restaurant.middleware), только для администраторов
+    path("metrics/", metrics, name="metrics"),
 ]
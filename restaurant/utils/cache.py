@@ -0,0 +1,158 @@
+import random
+import time
+
+from django.core.cache import cache
+from django.middleware.cache import CacheMiddleware
+from django.utils.decorators import decorator_from_middleware_with_args
+
+# разброс времени жизни ключей (±10%), чтобы они не истекали одновременно
+CACHE_TTL_JITTER = 0.1
+# сколько секунд после мягкого истечения значение еще отдается как устаревшее
+CACHE_STALE_TIMEOUT = 60
+# время жизни блокировки пересчета; сколько секунд и с каким интервалом ждать значения при промахе
+CACHE_LOCK_TIMEOUT = 10
+CACHE_LOCK_WAIT = 0.3
+CACHE_LOCK_POLL = 0.05
+
+
+def initial_version() -> int:
+    return int(time.time() * 1000)
+
+
+def namespace_version_key(namespace):
+    return f"ns:{namespace}"
+
+
+def get_namespace_version(namespace) -> int:
+    # текущая версия пространства имен; начальное значение - время в мс, чтобы после вытеснения
+    # счетчика из Redis не "воскресли" записи со старыми версиями
+    key = namespace_version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_namespace_version(namespace) -> int:
+    # все ключи пространства имен становятся недоступны, остальной кеш не трогается
+    key = namespace_version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = initial_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def namespaced_key(namespace, key) -> str:
+    return f"{namespace}:v{get_namespace_version(namespace)}:{key}"
+
+
+def user_namespace(user_pk) -> str:
+    return f"user:{user_pk}"
+
+
+class VersionedSnapshot:
+    # данные в памяти процесса (load), перечитываемые при смене версии пространства имен в кеше;
+    # версия сверяется не чаще чем раз в check_interval секунд, так что чтение - это обращение к памяти
+    check_interval = 2
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.version = None
+        self.checked_at = 0.0
+        self.data = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def get(self):
+        now = time.monotonic()
+        if self.version is None or now - self.checked_at >= self.check_interval:
+            version = get_namespace_version(self.namespace)
+            if version != self.version:
+                self.data = self.load()
+                self.version = version
+            self.checked_at = now
+        return self.data
+
+    def reset(self):
+        # следующее обращение перечитает версию и, при необходимости, данные
+        self.version = None
+
+    def changed(self):
+        # остальные процессы увидят изменение не позже чем через check_interval секунд, текущий - сразу
+        bump_namespace_version(self.namespace)
+        self.reset()
+
+
+class VersionedCacheMiddleware(CacheMiddleware):
+    # cache_page, у которого префикс ключа зависит от версии пространства имен:
+    # сброс страниц - это bump_namespace_version(namespace), а не cache.clear()
+    def __init__(self, get_response, namespace, **kwargs):
+        self.namespace = namespace
+        super().__init__(get_response, **kwargs)
+
+    @property
+    def key_prefix(self):
+        return f"{self.namespace}:v{get_namespace_version(self.namespace)}"
+
+    @key_prefix.setter
+    def key_prefix(self, value):
+        # CacheMiddleware присваивает постоянный префикс в __init__, здесь он вычисляется на каждый запрос
+        pass
+
+
+def versioned_cache_page(timeout, namespace):
+    # обертка строится один раз при импорте urls, на запрос - только чтение версии
+    return decorator_from_middleware_with_args(VersionedCacheMiddleware)(page_timeout=timeout, namespace=namespace)
+
+
+def jittered_timeout(timeout=None) -> int:
+    if timeout is None:
+        timeout = cache.default_timeout
+    return max(1, round(timeout * random.uniform(1 - CACHE_TTL_JITTER, 1 + CACHE_TTL_JITTER)))
+
+
+def get_or_fill(key, fill, timeout=None, recached=False):
+    # защита от "стада" при истечении ключа: в кеше лежит пара (значение, момент мягкого истечения);
+    # после мягкого истечения пересчитывает только получивший блокировку, остальные получают устаревшее значение,
+    # а при полном промахе недолго ждут, пока держатель блокировки заполнит ключ
+    lock_key = f"lock:{key}"
+    locked = False
+
+    if not recached:
+        entry = cache.get(key)
+        if entry is not None:
+            value, soft_expires_at = entry
+            if soft_expires_at > time.time():
+                return value
+            locked = cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT)
+            if not locked:
+                return value
+        else:
+            locked = cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT)
+            if not locked:
+                deadline = time.monotonic() + CACHE_LOCK_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(CACHE_LOCK_POLL)
+                    entry = cache.get(key)
+                    if entry is not None:
+                        return entry[0]
+                    # держатель снял блокировку, не заполнив ключ (исключение в fill) - заполняем сами
+                    locked = cache.add(lock_key, 1, CACHE_LOCK_TIMEOUT)
+                    if locked:
+                        break
+                else:
+                    # держатель блокировки не успел - считаем сами, но в кеш не пишем
+                    return fill()
+
+    try:
+        value = fill()
+        timeout = jittered_timeout(timeout)
+        cache.set(key, (value, time.time() + timeout), timeout + CACHE_STALE_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
@@ -0,0 +1,34 @@
+from restaurant.models import ContentText, ContentImage, Contentlink
+from restaurant.utils.cache import VersionedSnapshot, bump_namespace_version
+
+CONTENT_NAMESPACE = "content"
+
+
+class ContentRegistry(VersionedSnapshot):
+    # контент сайта в памяти процесса: загружается целиком (по запросу на модель) и перезагружается,
+    # когда в кеше меняется версия пространства имен "content" (сигналы post_save/post_delete)
+
+    def load(self):
+        return {
+            "texts": dict(ContentText.objects.values_list("title", "body")),
+            "images": {image.title: image for image in ContentImage.objects.all()},
+            "links": {link.title: link for link in Contentlink.objects.all()},
+        }
+
+    def text(self, title):
+        return self.get()["texts"].get(title)
+
+    def image(self, title):
+        return self.get()["images"].get(title)
+
+    def link(self, title):
+        return self.get()["links"].get(title)
+
+
+content_registry = ContentRegistry(CONTENT_NAMESPACE)
+
+
+def content_changed():
+    # закешированные страницы с контентом тоже сбрасываются
+    content_registry.changed()
+    bump_namespace_version("pages")
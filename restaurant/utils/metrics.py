@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+
+# счетчики по представлениям копятся в памяти процесса и раз в METRICS_FLUSH_INTERVAL секунд
+# прибавляются к общим в кеше (Redis), чтобы /metrics/ показывал сумму по всем процессам
+METRICS_FLUSH_INTERVAL = 5
+METRICS_VIEWS_KEY = "metrics:views"
+METRICS_FIELDS = ("requests", "queries", "sql_us", "cache_hits", "cache_misses", "render_us", "duration_us",
+                  "over_budget")
+
+_missing = object()
+
+
+class RequestMetrics:
+    # метрики одного запроса; время - в секундах
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.render_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper: каждый SQL-запрос проходит через счетчик
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+
+
+current_metrics = ContextVar("current_metrics", default=None)
+
+
+def record_cache(hits, misses):
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+class InstrumentedCacheMixin:
+    # попадания и промахи кеша считаются в метрики текущего запроса (restaurant.middleware)
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            record_cache(0, 1)
+            return default
+        record_cache(1, 0)
+        return value
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    # get_many у LocMemCache сводится к get, отдельно не считается
+    pass
+
+
+class InstrumentedRedisCache(InstrumentedCacheMixin, RedisCache):
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        record_cache(len(values), len(keys) - len(values))
+        return values
+
+
+def incr_counter(key, value):
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        if not cache.add(key, value, timeout=None):
+            cache.incr(key, value)
+
+
+class MetricsRegistry:
+
+    def __init__(self, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.pending = defaultdict(Counter)
+        self.flushed = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, view, metrics, duration, over_budget):
+        with self.lock:
+            counter = self.pending[view]
+            counter.update(requests=1, queries=metrics.queries, sql_us=int(metrics.sql_time * 10 ** 6),
+                           cache_hits=metrics.cache_hits, cache_misses=metrics.cache_misses,
+                           render_us=int(metrics.render_time * 10 ** 6), duration_us=int(duration * 10 ** 6),
+                           over_budget=int(over_budget))
+            due = time.monotonic() - self.flushed >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(Counter)
+            self.flushed = time.monotonic()
+        if not pending:
+            return
+
+        views = set(cache.get(METRICS_VIEWS_KEY) or ())
+        if not views.issuperset(pending):
+            cache.set(METRICS_VIEWS_KEY, sorted(views | set(pending)), timeout=None)
+        for view, counter in pending.items():
+            for field, value in counter.items():
+                if value:
+                    incr_counter(f"metrics:{view}:{field}", value)
+
+    def totals(self) -> dict:
+        self.flush()
+        views = cache.get(METRICS_VIEWS_KEY) or []
+        keys = {f"metrics:{view}:{field}": (view, field) for view in views for field in METRICS_FIELDS}
+        totals = {view: dict.fromkeys(METRICS_FIELDS, 0) for view in views}
+        for key, value in cache.get_many(list(keys)).items():
+            view, field = keys[key]
+            totals[view][field] = value
+        return totals
+
+    def reset(self):
+        with self.lock:
+            self.pending = defaultdict(Counter)
+        views = cache.get(METRICS_VIEWS_KEY) or []
+        cache.delete_many([f"metrics:{view}:{field}" for view in views for field in METRICS_FIELDS])
+        cache.delete(METRICS_VIEWS_KEY)
+
+
+metrics_registry = MetricsRegistry()
+
+PROMETHEUS_METRICS = (
+    # (имя, поле, делитель, тип, описание)
+    ("django_view_requests_total", "requests", 1, "counter", "Запросы к представлению"),
+    ("django_view_queries_total", "queries", 1, "counter", "SQL-запросы"),
+    ("django_view_sql_seconds_total", "sql_us", 10 ** 6, "counter", "Время SQL-запросов"),
+    ("django_view_cache_hits_total", "cache_hits", 1, "counter", "Попадания в кеш"),
+    ("django_view_cache_misses_total", "cache_misses", 1, "counter", "Промахи кеша"),
+    ("django_view_render_seconds_total", "render_us", 10 ** 6, "counter", "Время отрисовки шаблона"),
+    ("django_view_duration_seconds_total", "duration_us", 10 ** 6, "counter", "Полное время обработки"),
+    ("django_view_query_budget_exceeded_total", "over_budget", 1, "counter", "Запросы сверх бюджета SQL"),
+)
+
+
+def render_prometheus(totals) -> str:
+    lines = []
+    for name, field, divisor, kind, description in PROMETHEUS_METRICS:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for view, values in sorted(totals.items()):
+            value = values[field] / divisor if divisor != 1 else values[field]
+            lines.append(f'{name}{{view="{view}"}} {value}')
+    return "\n".join(lines) + "\n"
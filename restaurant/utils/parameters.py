@@ -0,0 +1,49 @@
+from dataclasses import dataclass, asdict
+from datetime import time, timedelta
+
+from restaurant.models import ContentParameters
+from restaurant.utils.cache import VersionedSnapshot
+
+PARAMETERS_NAMESPACE = "parameters"
+
+
+@dataclass(frozen=True)
+class BookingParameters:
+    # параметры работы ресторана и бронирования (таблица ContentParameters); значения по умолчанию -
+    # те, что использовались при отсутствии записей в базе
+    period_of_booking: int = 14
+    work_start: time = time(8, 0, 0)
+    work_end: time = time(23, 0, 0)
+    confirm_timedelta: int = 45
+
+    @property
+    def confirm_delta(self) -> timedelta:
+        return timedelta(minutes=self.confirm_timedelta)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class ParametersService(VersionedSnapshot):
+    # все параметры одним запросом; None - если какого-то параметра нет или он некорректен
+
+    def load(self):
+        rows = dict(ContentParameters.objects.filter(title__in=("period_of_booking", "work_start", "work_end",
+                                                                "confirm_timedelta")).values_list("title", "body"))
+        try:
+            return BookingParameters(
+                period_of_booking=int(rows["period_of_booking"]),
+                work_start=time.fromisoformat(rows["work_start"]),
+                work_end=time.fromisoformat(rows["work_end"]),
+                confirm_timedelta=int(rows["confirm_timedelta"]),
+            )
+        except (KeyError, ValueError):
+            return None
+
+
+parameters_service = ParametersService(PARAMETERS_NAMESPACE)
+
+
+def get_parameters() -> BookingParameters:
+    # актуальные параметры из памяти процесса (без запроса к базе), при их отсутствии - значения по умолчанию
+    return parameters_service.get() or BookingParameters()
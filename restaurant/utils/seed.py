@@ -0,0 +1,222 @@
+import math
+import random
+from datetime import date, time, timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db.models import Max, Exists, OuterRef
+from django.utils import timezone
+
+from restaurant.availability.occupancy import rebuild_occupancy
+from restaurant.models import Booking, BookingToken, NotificationOutbox, Questions, Review, Table
+from restaurant.utils.parameters import get_parameters
+from users.models import User
+
+SEED_BATCH_SIZE = 5000
+SEED_PASSWORD = "benchmark"
+SEED_DOMAIN = "seed.test"
+# метка сгенерированных столиков, вопросов и отзывов
+SEED_MARK = "[seed]"
+
+# начало бронирования - по получасам с 8:00 до 22:30, вес: вечерний пик, пик поменьше в обед
+START_WEIGHTS = {m: 6 if 18 * 60 <= m < 21 * 60 else 3 if 12 * 60 <= m < 14 * 60 else 1
+                 for m in range(8 * 60, 23 * 60, 30)}
+SLOT_MINUTES = (60, 90, 120, 150)
+# поздние бронирования с 22:30 заканчиваются после полуночи (до 2:30)
+LATE_MINUTES = (22 * 60 + 30, 23 * 60, 23 * 60 + 30)
+LATE_SLOT_MINUTES = (90, 120, 180)
+# среднее число бронирований столика в день, по нему подбирается глубина истории
+BOOKINGS_PER_TABLE_DAY = 4
+MAX_BOOKINGS_PER_TABLE_DAY = 10
+
+
+def batched(objects, size=SEED_BATCH_SIZE):
+    iterator = iter(objects)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def insert(model, objects, total, progress=None) -> list:
+    # вставка пачками по SEED_BATCH_SIZE, после каждой пачки - progress(имя модели, вставлено, всего)
+    created, done = [], 0
+    for batch in batched(objects):
+        created += model.objects.bulk_create(batch)
+        done += len(batch)
+        if progress:
+            progress(model._meta.verbose_name_plural, done, total)
+    return created
+
+
+def as_time(minutes) -> time:
+    minutes %= 24 * 60
+    return time(minutes // 60, minutes % 60)
+
+
+def day_periods(rng, count, close, late_share) -> list[tuple[int, int]]:
+    # до count непересекающихся (начало, конец) в минутах от начала суток для одного столика;
+    # конец позже 24:00 - бронирование через полночь
+    periods = []
+    if rng.random() < late_share:
+        start = rng.choice(LATE_MINUTES)
+        periods.append((start, start + rng.choice(LATE_SLOT_MINUTES)))
+
+    # начала в случайном порядке с учетом весов (выборка без возвращения): пиковые - раньше,
+    # каждое берется, если помещается между уже выбранными
+    starts = sorted(START_WEIGHTS, key=lambda m: rng.random() ** (1 / START_WEIGHTS[m]), reverse=True)
+    for start in starts:
+        if len(periods) >= count:
+            break
+        end = min(start + rng.choice(SLOT_MINUTES), close)
+        if end - start >= 60 and all(end <= b_start or start >= b_end for b_start, b_end in periods):
+            periods.append((start, end))
+    return sorted(periods)
+
+
+def seed_tables(count) -> list[Table]:
+    # номера продолжают уже существующие столики
+    first = (Table.objects.aggregate(number=Max("number"))["number"] or 0) + 1
+    tables = [Table(number=number, places=(2, 4, 4, 6, 8)[number % 5], flour=number % 3 + 1,
+                    description=f"{SEED_MARK} столик {number}") for number in range(first, first + count)]
+    return Table.objects.bulk_create(tables)
+
+
+def seed_users(count, rng, seed=0, progress=None) -> list[User]:
+    # один хеш пароля на всех: make_password (PBKDF2) на каждого пользователя занял бы больше, чем вставка
+    password = make_password(SEED_PASSWORD)
+
+    def users():
+        for number in range(count):
+            # большинство - в часовом поясе ресторана, остальные - по всему миру
+            time_offset = 3 if rng.random() < 0.6 else rng.randint(-12, 12)
+            yield User(email=f"user{seed}-{number}@{SEED_DOMAIN}", password=password, name=f"Гость {number}",
+                       time_offset=time_offset, tg_chat_id=str(10 ** 8 + number) if rng.random() < 0.5 else None)
+
+    return insert(User, users(), count, progress)
+
+
+def booking_status(rng, starts_at, now) -> str:
+    # прошедшие - состоялись или отменены, будущие - еще и ждут подтверждения по email;
+    # expired - не подтверждено вовремя (токен остался, удержание снято)
+    if starts_at < now:
+        return rng.choices(("active", "cancelled", "expired"), weights=(85, 10, 5))[0]
+    return rng.choices(("active", "pending", "cancelled", "expired"), weights=(75, 10, 10, 5))[0]
+
+
+def seed_bookings(tables, users, count, rng, first_day, days, close=None, late_share=0.05,
+                  progress=None) -> int:
+    # бронирования без пересечений по столику (ограничение booking_table_period_excl) с вечерним пиком;
+    # дни - с first_day на days вперед; close - не позже какого времени заканчиваются обычные
+    # бронирования (по умолчанию конец работы ресторана)
+    close = close or get_parameters().work_end
+    close_minutes = close.hour * 60 + close.minute
+    now = timezone.now()
+    table_days = len(tables) * days
+
+    tokens = []
+
+    def bookings():
+        remaining = count
+        for day_number in range(days):
+            day = first_day + timedelta(days=day_number)
+            for table_number, table in enumerate(tables):
+                # среднее подстраивается под остаток, чтобы в сумме получилось около count
+                # (пересекающиеся слоты отбрасываются, при нехватке столиков и дней выйдет меньше)
+                left = table_days - day_number * len(tables) - table_number
+                mean = remaining / left
+                wanted = min(rng.randint(0, math.ceil(2 * mean)), MAX_BOOKINGS_PER_TABLE_DAY, remaining)
+                for start, end in day_periods(rng, wanted, close_minutes, late_share) if wanted else ():
+                    user = rng.choice(users)
+                    booking = Booking(user=user, table=table, places=rng.randint(1, table.places),
+                                      notification=rng.choice((0, 0, 1, 2, 3)), date_field=day,
+                                      time_start=as_time(start), time_end=as_time(end))
+                    # bulk_create не вызывает pre_save (restaurant.signals) - starts_at/ends_at/notify_at здесь
+                    booking.set_period()
+                    booking.set_notify_at()
+
+                    status = booking_status(rng, booking.starts_at, now)
+                    booking.active = status == "active"
+                    booking.is_pending = status == "pending"
+                    if status in ("pending", "expired"):
+                        tokens.append((booking, status == "expired"))
+
+                    remaining -= 1
+                    yield booking
+                    if not remaining:
+                        return
+
+    created = 0
+    for batch in batched(bookings()):
+        Booking.objects.bulk_create(batch)
+        created += len(batch)
+        seed_tokens(tokens, rng)
+        tokens.clear()
+        if progress:
+            progress(Booking._meta.verbose_name_plural, created, count)
+    return created
+
+
+def seed_tokens(tokens, rng):
+    # токены подтверждения ожидающих бронирований; у просроченных время создания сдвигается назад -
+    # auto_now_add при вставке всегда ставит текущее
+    created = BookingToken.objects.bulk_create([BookingToken(booking=booking, token=f"{rng.getrandbits(128):032x}")
+                                                for booking, _ in tokens])
+    expired = [token.pk for token, (booking, is_expired) in zip(created, tokens) if is_expired]
+    if expired:
+        confirm_delta = get_parameters().confirm_delta
+        BookingToken.objects.filter(pk__in=expired).update(created_at=timezone.now() - 2 * confirm_delta)
+
+
+def seed_notifications(now, progress=None) -> int:
+    # ожидающие записи NotificationOutbox для будущих напоминаний подтвержденных бронирований - как после
+    # sync_notification; отложенные задачи для них ставит периодическая restaurant.tasks.reconcile_reminders
+    queued = NotificationOutbox.objects.filter(booking=OuterRef("pk"), due_at=OuterRef("notify_at"))
+    bookings = Booking.objects.filter(active=True, notify_at__gt=now).filter(~Exists(queued))
+    total = bookings.count()
+    notifications = (NotificationOutbox(booking_id=pk, due_at=notify_at, available_at=notify_at)
+                     for pk, notify_at in bookings.values_list("pk", "notify_at").iterator(chunk_size=SEED_BATCH_SIZE))
+    return len(insert(NotificationOutbox, notifications, total, progress))
+
+
+def seed_questions(count, rng, progress=None) -> int:
+    def questions():
+        for number in range(count):
+            moderated = rng.random() < 0.7
+            yield Questions(question_text=f"Вопрос гостя номер {number}: можно ли прийти с собакой?",
+                            sign=f"{SEED_MARK} гость {number}", moderated=moderated,
+                            answer_text="Да, на веранде можно." if moderated else None)
+
+    return len(insert(Questions, questions(), count, progress))
+
+
+def seed_reviews(users, count, rng, progress=None) -> int:
+    def reviews():
+        for number in range(count):
+            grade = rng.choices((5, 4, 3, 2, 1), weights=(50, 25, 12, 8, 5))[0]
+            yield Review(review_text=f"Отзыв номер {number}", author=rng.choice(users),
+                         sign=f"{SEED_MARK} гость {number}", grade=grade, moderated=rng.random() < 0.8)
+
+    return len(insert(Review, reviews(), count, progress))
+
+
+def seed_restaurant(tables=20, users=100, bookings=2000, questions=0, reviews=0, seed=0, days=21, close=None,
+                    late_share=0.05, progress=None) -> dict:
+    # одинаковый seed на пустой базе - одинаковые данные, поэтому замеры разных запусков сравнимы;
+    # если столиков и дней мало для bookings, история удлиняется в прошлое (вперед - на срок бронирования)
+    rng = random.Random(seed)
+    days = max(days, math.ceil(bookings / (tables * BOOKINGS_PER_TABLE_DAY)))
+    first_day = date.today() + timedelta(days=get_parameters().period_of_booking - days)
+
+    table_list = seed_tables(tables)
+    user_list = seed_users(users, rng, seed, progress)
+    counts = {
+        "tables": len(table_list),
+        "users": len(user_list),
+        "bookings": seed_bookings(table_list, user_list, bookings, rng, first_day, days, close, late_share,
+                                  progress),
+        "notifications": seed_notifications(timezone.now(), progress),
+        "questions": seed_questions(questions, rng, progress),
+        "reviews": seed_reviews(user_list, reviews, rng, progress),
+    }
+    # маски занятости столиков обновляются сигналами, которых bulk_create не отправляет
+    rebuild_occupancy(first_day)
+    return counts
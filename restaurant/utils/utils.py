@@ -1,21 +1,40 @@
-from datetime import datetime, timedelta, time
-from restaurant.models import ContentText, ContentImage, Contentlink, ContentParameters, Booking
+from datetime import datetime, timedelta, timezone
+
+from django.db.models import F, Value, ExpressionWrapper, DurationField, DateTimeField
+from django.db.models.functions import Coalesce, Now
+
+from restaurant.models import ContentImage, Contentlink, Booking
+from restaurant.utils.content import content_registry
+from restaurant.utils.parameters import parameters_service, BookingParameters
+from users.models import User
+
+
+def content_text_not_found(title):
+    return f"Для изменения текста создайте запись '{title}' в таблице ContentText (необходимы полномочия администратора)"
+
+
+def content_image_not_found(title):
+    str_part_1 = "Для изменения изображения создайте запись '"
+    str_part_2 = "' в таблице ContentImage и загрузите изображение (необходимы полномочия администратора)"
+    return f"{str_part_1}{title}{str_part_2}"
+
+
+def content_link_not_found(title):
+    return f"Для создания ссылки создайте запись '{title}' в таблице ContentLink (необходимы полномочия администратора)"
 
 
 def get_content_text_from_postgres(title):
-    try:
-        return ContentText.objects.get(title=title).body
-    except Exception:
-        return f"Для изменения текста создайте запись '{title}' в таблице ContentText (необходимы полномочия администратора)"
+    # контент читается из реестра процесса (restaurant/utils/content.py), база - только при его перезагрузке
+    body = content_registry.text(title)
+    return body if body is not None else content_text_not_found(title)
 
 
 def get_content_image_from_postgres(title):
-    try:
-        return ContentImage.objects.get(title=title)
-    except Exception:
-        str_part_1 = "Для изменения изображения создайте запись '"
-        str_part_2 = "' в таблице ContentImage и загрузите изображение (необходимы полномочия администратора)"
-        description = f"{str_part_1}{title}{str_part_2}"
+    image = content_registry.image(title)
+    if image is not None:
+        return image
+    else:
+        description = content_image_not_found(title)
 
         try:
             not_found = ContentImage.objects.create(title="not_found", description=description, image=None)
@@ -25,10 +44,11 @@ def get_content_image_from_postgres(title):
 
 
 def get_content_link_from_postgres(title):
-    try:
-        return Contentlink.objects.get(title=title)
-    except Exception:
-        text = f"Для создания ссылки создайте запись '{title}' в таблице ContentLink (необходимы полномочия администратора)"
+    link = content_registry.link(title)
+    if link is not None:
+        return link
+    else:
+        text = content_link_not_found(title)
         try:
             not_found = Contentlink.objects.create(title="not_found", text="ссылка не найдена", link="#", description=text)
         except Exception:
@@ -36,6 +56,27 @@ def get_content_link_from_postgres(title):
         return not_found
 
 
+def get_content_bulk(texts=(), images=(), links=()) -> dict:
+    # весь контент страницы из реестра процесса (при его перезагрузке - по одному запросу на модель);
+    # ключи словаря - названия с "-" замененным на "_", как переменные в шаблонах.
+    # для отсутствующих записей - заглушки с подсказкой администратору (без записи в базу)
+    content = {}
+
+    for title in texts:
+        body = content_registry.text(title)
+        content[title.replace("-", "_")] = body if body is not None else content_text_not_found(title)
+
+    for title in images:
+        content[title.replace("-", "_")] = content_registry.image(title) or ContentImage(
+            title="not_found", description=content_image_not_found(title), image=None)
+
+    for title in links:
+        content[title.replace("-", "_")] = content_registry.link(title) or Contentlink(
+            title="not_found", text="ссылка не найдена", link="#", description=content_link_not_found(title))
+
+    return content
+
+
 def time_segment(date: datetime.date, start: datetime.time, end: datetime.time) -> tuple[datetime, datetime]:
     # делает из даты, начального и конечного времени 2 значения datetime
 
@@ -48,66 +89,53 @@ def time_segment(date: datetime.date, start: datetime.time, end: datetime.time)
 
 
 def get_content_parameters(ignored_error):
-    # выдернуть из базы данных параметры работы, бронирования и т.д.
-
-    # period_of = ContentParameters.objects.filter(title="period_of_booking").exists()
-    # work_start = ContentParameters.objects.filter(title="work_start").exists()
-    # work_end = ContentParameters.objects.filter(title="work_end").exists()
-    # confirm_t = ContentParameters.objects.filter(title="confirm_timedelta").exists()
-    #
-    # if not (period_of and work_start and work_end and confirm_t):
-    #     if ignored_error:
-    #         work_start = time(8, 0, 0)
-    #         work_end = time(23, 0, 0)
-    #         period_of_booking = 14
-    #         return {"period_of_booking": period_of_booking, "work_start": work_start, "work_end": work_end,
-    #                 "confirm_timedelta": 45}
-    #     else:
-    #         return False
-    try:
-        period_of_booking = int(ContentParameters.objects.get(title="period_of_booking").body)
-        work_start = time.fromisoformat(ContentParameters.objects.get(title="work_start").body)
-        work_end = time.fromisoformat(ContentParameters.objects.get(title="work_end").body)
-        confirm_timedelta = int(str(ContentParameters.objects.get(title="confirm_timedelta").body))
-
-        return {"period_of_booking": period_of_booking, "work_start": work_start, "work_end": work_end,
-                "confirm_timedelta": confirm_timedelta}
-    except Exception:
-        if ignored_error:
-            work_start = time(8, 0, 0)
-            work_end = time(23, 0, 0)
-            period_of_booking = 14
-            return {"period_of_booking": period_of_booking, "work_start": work_start, "work_end": work_end,
-                    "confirm_timedelta": 45}
-        else:
-            return False
-
+    # параметры работы, бронирования и т.д. в виде словаря (для совместимости);
+    # значения берутся из памяти процесса (restaurant/utils/parameters.py), база - только после их изменения
+    parameters = parameters_service.get()
+    if parameters is None:
+        return BookingParameters().as_dict() if ignored_error else False
+    return parameters.as_dict()
 
-def get_actual_bookings(active=True, time_start=True):
 
-    # 1) все неактивные бронирования проигнорим
+def user_wall_clock(user) -> datetime:
+    # текущее "настенное" время пользователя в UTC - в той же шкале, что starts_at/ends_at его бронирований
+    # (то же смещение, что local_now в get_actual_bookings)
+    time_offset = getattr(user, "time_offset", None)
+    if time_offset is None:
+        time_offset = User._meta.get_field("time_offset").default
+    return datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(hours=time_offset)
 
-    # booking_tokens = [token.booking.pk for token in BookingToken.objects.filter(created_at__gt=time_border)]
 
-    now = datetime.now()
+def get_actual_bookings(active=True, time_start=True):
+    # бронирования, которые по местному времени пользователя ещё не начались (time_start=True)
+    # или ещё не закончились (time_start=False); возвращает ленивый queryset, всё считается в базе
 
     if active:
-        first_filter = Booking.objects.filter(active=True)
+        bookings = Booking.objects.filter(active=True)
     else:
-        first_filter = Booking.objects.all()
+        bookings = Booking.objects.all()
 
-    second_filter = first_filter.filter(date_field__year__gte=now.year, date_field__month__gte=now.month,
-                                        date_field__day__gte=(now - timedelta(days=1)).day)
+    # starts_at/ends_at - "настенное" время в UTC, смещение пользователей не меньше -12 часов,
+    # поэтому всё, что закончилось (началось) раньше now - 12 часов, отсекается индексом в базе
+    border = (datetime.now() - timedelta(hours=12)).replace(tzinfo=timezone.utc)
 
-    if (time_start):
-        still_is = [b.pk for b in second_filter if
-                    (time_segment(b.date_field, b.time_start, b.time_end)[0] > (now + timedelta(hours=b.user.time_offset)))]
+    # местное время пользователя: now() + users_user.time_offset часов (JOIN вместо запроса на каждую строку)
+    time_offset = Coalesce(F("user__time_offset"), Value(User._meta.get_field("time_offset").default))
+    local_now = ExpressionWrapper(
+        Now() + ExpressionWrapper(time_offset * Value(timedelta(hours=1)), output_field=DurationField()),
+        output_field=DateTimeField())
 
-        third_filter = second_filter.filter(pk__in=still_is)
+    bookings = bookings.alias(local_now=local_now)
+    if time_start:
+        bookings = bookings.filter(starts_at__gt=border).filter(starts_at__gt=F("local_now"))
     else:
-        still_is = [b.pk for b in second_filter if
-                    (time_segment(b.date_field, b.time_start, b.time_end)[1] > (now + timedelta(hours=b.user.time_offset)))]
+        bookings = bookings.filter(ends_at__gt=border).filter(ends_at__gt=F("local_now"))
+
+    return bookings.select_related("user", "table")
 
-        third_filter = second_filter.filter(pk__in=still_is)
 
-    return third_filter
+def get_due_notifications(since, until):
+    # подтвержденные бронирования, напоминание по которым приходится на (since, until]: один запрос по индексу
+    # booking_notify_at_idx, объем работы зависит от числа таких напоминаний, а не от числа будущих бронирований
+    return (Booking.objects.filter(active=True, notify_at__gt=since, notify_at__lte=until)
+            .filter(user__tg_chat_id__isnull=False).select_related("user", "table"))
@@ -1,98 +1,57 @@
+import datetime
 import secrets
 
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
+from django.db import transaction, IntegrityError
 
-from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
 from django.utils import timezone
 from django.views.generic import TemplateView, ListView, CreateView, UpdateView, DeleteView, DetailView
 
+from restaurant.availability.engine import release_expired_bookings, get_free_windows, \
+    get_booked_tables, get_free_tables
 from restaurant.forms import BookingForm, QuestionsForm, LimitedQuestionsForm
-from restaurant.models import Booking, Table, BookingToken, Questions
+from restaurant.models import Booking, BookingToken, Questions, booking_period
+from restaurant.notifications.mail import queue_mail
 
 from dotenv import load_dotenv
 
-from restaurant.tasks import celery_send_mail
-from restaurant.templates.restaurant.services import get_cached_booking_list, get_cached_questions_list, \
-    cache_delete_question_list, cache_delete_booking_list
-from restaurant.utils.utils import get_content_text_from_postgres, \
-    get_content_image_from_postgres, get_content_link_from_postgres, get_actual_bookings, get_content_parameters
-from users.models import User
+from restaurant.templates.restaurant.services import get_cached_user_bookings, get_cached_questions_list, \
+    cache_delete_question_list
+from restaurant.utils.metrics import metrics_registry, render_prometheus
+from restaurant.utils.parameters import get_parameters
+from restaurant.utils.utils import get_content_text_from_postgres, get_content_bulk, user_wall_clock
 
 load_dotenv()
 
-PARAMETERS = get_content_parameters(True)
-
 
 class HomePageView(TemplateView):
     template_name = "restaurant/home.html"
 
+    TEXTS = ("home-about", "home-offer", "home-adress")
+    IMAGES = ("home-about-inside1", "home-about-inside2", "home-food1", "home-food2", "home-food3")
+    LINKS = ("vkontakte", "whatsup", "telegram")
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # количество рассылок всего
-        CONST1 = "home-about"
-        CONST2 = "home-offer"
-        CONST3 = "home-adress"
-
-        context[CONST1.replace("-", "_")] = get_content_text_from_postgres(CONST1)
-        context[CONST2.replace("-", "_")] = get_content_text_from_postgres(CONST2)
-        context[CONST3.replace("-", "_")] = get_content_text_from_postgres(CONST3)
-
-        IMGCONST1 = "home-about-inside1"
-        IMGCONST2 = "home-about-inside2"
-        IMGCONST3 = "home-food1"
-        IMGCONST4 = "home-food2"
-        IMGCONST5 = "home-food3"
-
-        context[IMGCONST1.replace("-", "_")] = get_content_image_from_postgres(IMGCONST1)
-        context[IMGCONST2.replace("-", "_")] = get_content_image_from_postgres(IMGCONST2)
-        context[IMGCONST3.replace("-", "_")] = get_content_image_from_postgres(IMGCONST3)
-        context[IMGCONST4.replace("-", "_")] = get_content_image_from_postgres(IMGCONST4)
-        context[IMGCONST5.replace("-", "_")] = get_content_image_from_postgres(IMGCONST5)
-
-        LINKCONST1 = "vkontakte"
-        LINKCONST2 = "whatsup"
-        LINKCONST3 = "telegram"
-
-        context[LINKCONST1.replace("-", "_")] = get_content_link_from_postgres(LINKCONST1)
-        context[LINKCONST2.replace("-", "_")] = get_content_link_from_postgres(LINKCONST2)
-        context[LINKCONST3.replace("-", "_")] = get_content_link_from_postgres(LINKCONST3)
-
+        context.update(get_content_bulk(texts=self.TEXTS, images=self.IMAGES, links=self.LINKS))
         return context
 
 
 class AboutUsPageView(TemplateView):
     template_name = "restaurant/about_us.html"
 
+    TEXTS = ("about_us-mission-part", "about_us-history-part1", "about_us-history-part2", "about_us-command-part1",
+             "about_us-command-part2")
+    IMAGES = ("about_us-inside3", "about_us-inside4", "about_us-team1", "about_us-team2", "about_us-team3")
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # количество рассылок всего
-        CONST1 = "about_us-mission-part"
-        CONST2 = "about_us-history-part1"
-        CONST3 = "about_us-history-part2"
-        CONST4 = "about_us-command-part1"
-        CONST5 = "about_us-command-part2"
-
-        context[CONST1.replace("-", "_")] = get_content_text_from_postgres(CONST1)
-        context[CONST2.replace("-", "_")] = get_content_text_from_postgres(CONST2)
-        context[CONST3.replace("-", "_")] = get_content_text_from_postgres(CONST3)
-        context[CONST4.replace("-", "_")] = get_content_text_from_postgres(CONST4)
-        context[CONST5.replace("-", "_")] = get_content_text_from_postgres(CONST5)
-
-        IMGCONST1 = "about_us-inside3"
-        IMGCONST2 = "about_us-inside4"
-        IMGCONST3 = "about_us-team1"
-        IMGCONST4 = "about_us-team2"
-        IMGCONST5 = "about_us-team3"
-
-        context[IMGCONST1.replace("-", "_")] = get_content_image_from_postgres(IMGCONST1)
-        context[IMGCONST2.replace("-", "_")] = get_content_image_from_postgres(IMGCONST2)
-        context[IMGCONST3.replace("-", "_")] = get_content_image_from_postgres(IMGCONST3)
-        context[IMGCONST4.replace("-", "_")] = get_content_image_from_postgres(IMGCONST4)
-        context[IMGCONST5.replace("-", "_")] = get_content_image_from_postgres(IMGCONST5)
-
+        context.update(get_content_bulk(texts=self.TEXTS, images=self.IMAGES))
         return context
 
 
@@ -124,10 +83,8 @@ class BookingListView(LoginRequiredMixin, ListView):
         user = self.request.user
         context["user"] = user
 
-        cashed_booking = get_cached_booking_list()
-
-        # unfiltered_booking = cashed_booking.filter(user=user)
-        context["booking_list"] = cashed_booking.filter(user=user).order_by("date_field", "time_start")
+        # история бронирований пользователя из кеша (сортировка по дате и времени)
+        context["booking_list"] = get_cached_user_bookings(user)
 
         return context
 
@@ -140,48 +97,46 @@ class BookingCreateUpdateMixin:
 
     def form_valid(self, form):
         # Xозяином рассылки автоматически становится тот, кто её создал
-        booking = form.save()
+        booking = form.save(commit=False)
         user = self.request.user
         booking.user = user
         booking.active = False
+        booking.is_pending = True
 
         token = secrets.token_hex(16)
         # email = user.email
 
-        booking.save()
-
-        booking_token = BookingToken.objects.create(token=token, booking=booking)
-        booking_token.save()
+        confirm_timedelta = get_parameters().confirm_delta
+        time_border = timezone.now() - confirm_timedelta
 
         host = self.request.get_host()
         url = f"http://{host}/booking_verification/{token}/"
 
-        subject = "Подтверждение бронирования",
-        message = f"Привет, перейди по ссылке для подтверждения бронирования: {url} ",
-        # from_email = EMAIL_HOST_USER,
-        # recipient_list = [email]
-
-        # send_mail(
-        #     subject="Подтверждение бронирования",
-        #     message=f"Привет, перейди по ссылке для подтверждения бронирования: {url}",
-        #     from_email=EMAIL_HOST_USER,
-        #     recipient_list=[email]
-        # )
+        subject = "Подтверждение бронирования"
+        message = f"Привет, перейди по ссылке для подтверждения бронирования: {url} "
 
-        email_list = []
-        # email_list.append(user.email)
-
-        subscriptions = User.objects.filter(pk=self.request.user.pk)
-        for s in subscriptions:
-            email_list.append(s.email)
-
-        # The values_list() method returns a QuerySet containing tuples: <QuerySet [(1,), (2,)]>
-        # values_list() with a single field, use flat=True to return a QuerySet instead of 1-tuples: <QuerySet [1, 2]>
-        # email_list = subscriptions.values_list("email", flat=True)
-        celery_send_mail.delay(subject, message, email_list)
-
-        get_cached_booking_list(recached=True)
-        return super().form_valid(form)
+        try:
+            with transaction.atomic():
+                # бронирования с истекшим временем подтверждения не должны мешать ограничению в базе
+                release_expired_bookings(time_border, table=booking.table)
+                booking.save()
+
+                BookingToken.objects.create(token=token, booking=booking)
+
+                # письмо пишется в той же транзакции и отправляется задачей после коммита: запрос не ждет
+                # брокер, а при откате (столик занят) письма нет
+                queue_mail(subject, message, [user.email])
+        except IntegrityError as e:
+            # параллельный запрос успел занять столик после проверки в clean_my_table
+            if "booking_table_period_excl" not in str(e):
+                raise
+            form.add_error(None, "В указанный период времени столик забронирован")
+            return self.form_invalid(form)
+
+        # кеш бронирований сбрасывается сигналами post_save (restaurant.signals);
+        # бронирование уже сохранено - super().form_valid сохранил бы его второй раз
+        self.object = booking
+        return redirect(self.get_success_url())
 
     def get_success_url(self):
         user = self.request.user
@@ -191,53 +146,88 @@ class BookingCreateUpdateMixin:
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # получение времени подтверждения бронирования, получение времени, которое определяет границу регистрации
-
-        confirm_timedelta = timezone.timedelta(minutes=PARAMETERS.get("confirm_timedelta"))
-
-        # try:
-        #
-        #     confirm_timedelta = timezone.timedelta(
-        #         minutes=ContentParameters.objects.get(title="confirm_timedelta"))
-        #
-        #     confirm_timedelta = timezone.timedelta(
-        #         minutes=ContentParameters.objects.get(title="confirm_timedelta"))
-        # except Exception:
-        #     confirm_timedelta = timezone.timedelta(minutes=45)
-
-        time_border = timezone.now() - confirm_timedelta
-
-        # список pk бронирований, которые могут быть подтверждены
-
-        # отбор по времени конца бронирования без учета активности:
-        present_time_booking = get_actual_bookings(active=False, time_start=False)
-        # время подтверждения не истекло у следующих pk
-        booking_tokens = [token.booking.pk for token in BookingToken.objects.filter(created_at__gt=time_border)]
-        # теперь фильтруем по pk исключая те, которые не были подтверждены
-        # получение списка актуальных бронирований
-        bookings = present_time_booking.filter(Q(active=True) | Q(pk__in=booking_tokens)).order_by(
-            "date_field", "time_start")
+        parameters = get_parameters()
+        time_border = timezone.now() - parameters.confirm_delta
 
-        # получение списка задействованных столиков
-        table_pk = [b.table.pk for b in bookings]
-        tables = Table.objects.filter(pk__in=table_pk).order_by("number")
+        # занятость столиков только в пределах срока бронирования: от текущего времени пользователя (периоды
+        # хранятся в его "настенном" времени) до последнего дня, доступного в форме, по дням - объем не растет
+        # с историей бронирований
+        now = user_wall_clock(self.request.user)
+        last_day = now.date() + datetime.timedelta(days=parameters.period_of_booking + 1)
+        context["tables_list"] = get_booked_tables(now, datetime.datetime.combine(last_day, datetime.time.min),
+                                                   time_border)
 
-        context["tables_list"] = tables
-        context["booking_list"] = bookings
+        # пока гость не отправил форму - свободные столики на ее период (после отправки их заполняет
+        # clean_my_table, если выбранный столик занят)
+        form = context["form"]
+        if not form.is_bound:
+            form.free_tables = self.get_free_tables_for_form(form, now, time_border)
 
-        context["period_of_booking"] = PARAMETERS.get("period_of_booking")
-        context["work_start"] = PARAMETERS.get("work_start")
-        context["work_end"] = PARAMETERS.get("work_end")
+        context["period_of_booking"] = parameters.period_of_booking
+        context["work_start"] = parameters.work_start
+        context["work_end"] = parameters.work_end
 
         CONST1 = "booking_create"
         context[CONST1.replace("-", "_")] = get_content_text_from_postgres(CONST1)
 
         return context
 
+    @staticmethod
+    def get_free_tables_for_form(form, now, time_border):
+        # начальный период (создание) или текущий период бронирования (изменение): занятость по маскам
+        # (restaurant.availability.occupancy), само изменяемое бронирование столик не занимает
+        values = {name: form.get_initial_for_field(form.fields[name], name)
+                  for name in ("date_field", "time_start", "time_end", "places")}
+        if None in (values["date_field"], values["time_start"], values["time_end"]):
+            return []
+        start, end = booking_period(values["date_field"], values["time_start"], values["time_end"])
+        if start <= now:
+            return []
+        return get_free_tables(start, end, values["places"] or 1, time_border, exclude_pk=form.instance.pk)
+
+
+def free_slots(request):
+    # свободные промежутки столиков на дату, чтобы выбрать время до отправки формы бронирования:
+    # ?date=2024-10-20&places=4&flour=2 (этаж необязателен)
+    try:
+        day = datetime.date.fromisoformat(request.GET["date"])
+        places = int(request.GET.get("places", 1))
+        flour = int(request.GET["flour"]) if request.GET.get("flour") else None
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "Укажите дату (date=ГГГГ-ММ-ДД), число мест (places) и при желании этаж "
+                                      "(flour)"}, status=400)
+
+    parameters = get_parameters()
+    opens, closes = booking_period(day, parameters.work_start, parameters.work_end)
+    # те же ограничения, что и в BookingForm.validate_date_time: не в прошлом и не дальше срока бронирования
+    now = user_wall_clock(request.user)
+    if places < 1:
+        return JsonResponse({"error": "Должно быть занято хотя бы одно место за столиком"}, status=400)
+    if closes <= now:
+        return JsonResponse({"error": "Нельзя забронировать место на прошедшее время"}, status=400)
+    if opens > now + datetime.timedelta(days=parameters.period_of_booking):
+        return JsonResponse({"error": f"Бронировать места можно не ранее чем за {parameters.period_of_booking} "
+                                      f"дней"}, status=400)
+
+    time_border = timezone.now() - parameters.confirm_delta
+    tables = get_free_windows(max(opens, now), closes, places, time_border, flour)
+
+    return JsonResponse({
+        "date": day.isoformat(),
+        "places": places,
+        "flour": flour,
+        "work_start": parameters.work_start.strftime("%H:%M"),
+        "work_end": parameters.work_end.strftime("%H:%M"),
+        "tables": [{"id": table.pk, "number": table.number, "places": table.places, "flour": table.flour,
+                    "windows": [{"start": start.strftime("%H:%M"), "end": end.strftime("%H:%M")}
+                                for start, end in windows]}
+                   for table, windows in tables],
+    })
+
 
 def confirm_booking(request, email):
 
-    confirm_timedelta = timezone.timedelta(minutes=PARAMETERS.get("confirm_timedelta"))
+    confirm_timedelta = get_parameters().confirm_delta
     context = {
         "email": email, "confirm_timedelta": confirm_timedelta
     }
@@ -253,19 +243,18 @@ def booking_verification(request, token):
     #     # confirm_timedelta = timezone.timedelta(minutes=ContentParameters.objects.get(title="confirm_timedelta"))
     # except Exception:
     #     confirm_timedelta_raw = timezone.timedelta(minutes=45)
-    confirm_timedelta = timezone.timedelta(minutes=PARAMETERS.get("confirm_timedelta"))
+    confirm_timedelta = get_parameters().confirm_delta
     # confirm_timedelta = timezone.timedelta(minutes=int(confirm_timedelta_raw.body))
 
     if this_booking_token.created_at < timezone.now() - confirm_timedelta:
         booking.delete()
         this_booking_token.delete()
-        get_cached_booking_list(recached=True)
         return render(request, "restaurant/token_expired.html")
     else:
         this_booking_token.delete()
         booking.active = True
+        booking.is_pending = False
         booking.save()
-        get_cached_booking_list(recached=True)
         return render(request, "restaurant/booking_confirmed.html")
 
 
@@ -310,8 +299,6 @@ class BookingDeleteView(LoginRequiredMixin, DeleteView):
 
         user = self.request.user
         if user == self.object.user:
-            cache_delete_booking_list()
-            # get_cached_booking_list(recached=True)
             return super().form_valid(form)
         else:
             raise PermissionDenied
@@ -319,6 +306,7 @@ class BookingDeleteView(LoginRequiredMixin, DeleteView):
 
 class BookingDetailView(LoginRequiredMixin, DetailView):
     model = Booking
+    queryset = Booking.objects.select_related("user", "table")
     login_url = "users:login"
     redirect_field_name = "login"
 
@@ -335,19 +323,14 @@ class BookingDetailView(LoginRequiredMixin, DetailView):
         else:
             raise PermissionDenied
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["object"] = get_cached_booking_list().get(id=self.kwargs.get("pk"))
-        return context
-
 
 def toggle_activity_booking(request, pk):
     booking_item = get_object_or_404(Booking, pk=pk)
     if booking_item.active:
         booking_item.active = False
+        booking_item.is_pending = False
     booking_item.save()
 
-    get_cached_booking_list(recached=True)
     return redirect(reverse("restaurant:booking_list"))
 
 
@@ -432,3 +415,9 @@ def questions_success(request, message):
         "message": get_content_text_from_postgres(message),
     }
     return render(request, "restaurant/questions_success.html", context)
+
+
+@staff_member_required
+def metrics(request):
+    # сводка QueryMetricsMiddleware по представлениям в текстовом формате Prometheus
+    return HttpResponse(render_prometheus(metrics_registry.totals()), content_type="text/plain; version=0.0.4")
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="usertoken",
+            name="token",
+            field=models.CharField(
+                blank=True, max_length=100, null=True, unique=True, verbose_name="Token"
+            ),
+        ),
+    ]
@@ -67,6 +67,13 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.name} ({self.email})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # смещение при загрузке: напоминания пересчитываются, только если оно изменилось (restaurant.signals)
+        instance._loaded_time_offset = instance.__dict__.get("time_offset")
+        return instance
+
 
 class UserToken(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="пользователь к которому относится токен",
@@ -74,4 +81,4 @@ class UserToken(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="дата создания",
                                       help_text="введите дату создания токена")
-    token = models.CharField(max_length=100, verbose_name="Token", **NULLABLE)
+    token = models.CharField(max_length=100, verbose_name="Token", unique=True, **NULLABLE)
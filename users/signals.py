@@ -0,0 +1,12 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.dispatch import receiver
+
+from restaurant.utils.cache import bump_namespace_version, user_namespace
+
+
+@receiver(user_logged_in)
+@receiver(user_logged_out)
+def bump_user_cache_namespace(sender, request, user, **kwargs):
+    # вместо cache.clear() инвалидируются только ключи вошедшего/вышедшего пользователя
+    if user is not None:
+        bump_namespace_version(user_namespace(user.pk))
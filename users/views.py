@@ -3,6 +3,7 @@ import secrets
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LogoutView
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
 
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse
@@ -10,8 +11,8 @@ from django.utils import timezone
 from django.views.generic import CreateView, UpdateView, DetailView
 
 from restaurant.models import ContentParameters
-from restaurant.tasks import celery_send_mail
-from restaurant.templates.restaurant.services import get_cached_booking_list, cache_clear
+from restaurant.notifications.mail import queue_mail
+from restaurant.templates.restaurant.services import get_cached_user_bookings
 from users.forms import UserRegisterForm, UserProfileForm
 from users.models import User, UserToken
 from users.services import get_password
@@ -38,36 +39,28 @@ class RegisterView(CreateView):
     template_name = "users/register.html"
 
     def form_valid(self, form):
-        user = form.save()
-        user.is_active = False
         token = secrets.token_hex(16)
-        user.token = token
-
-        user_token = UserToken.objects.create(token=token, user=user)
-        user_token.save()
-
-        user.save()
         host = self.request.get_host()
         url = f"http://{host}/users/email-confirm/{token}/"
-        # print(url)
-        # send_mail(
-        #     subject="Подтверждение почты",
-        #     message=f"Привет, перейди по ссылке для подтверждения почты {url}",
-        #     from_email=EMAIL_HOST_USER,
-        #     recipient_list=[user.email]
-        # )
-        subject = "Подтверждение почты",
-        message = f"Привет, перейди по ссылке для подтверждения почты {url} ",
 
-        email_list = []
-        email_list.append(user.email)
+        subject = "Подтверждение почты"
+        message = f"Привет, перейди по ссылке для подтверждения почты {url} "
+
+        # пользователь, токен и письмо - одна транзакция; письмо отправляется задачей после коммита
+        with transaction.atomic():
+            user = form.save()
+            user.is_active = False
+            user.token = token
 
-        celery_send_mail.delay(subject, message, email_list)
+            user_token = UserToken.objects.create(token=token, user=user)
+            user_token.save()
 
-        redirect_url = reverse("users:confirm_email", args=[user.email])
-        self.success_url = redirect_url
+            user.save()
+            queue_mail(subject, message, [user.email])
 
-        return super().form_valid(form)
+        # пользователь уже сохранен - super().form_valid сохранил бы его второй раз
+        self.object = user
+        return redirect(reverse("users:confirm_email", args=[user.email]))
 
 
 def email_verification(request, token):
@@ -134,8 +127,7 @@ class UserDetailView(LoginRequiredMixin, GetFormClassUserIsOwnerMixin, DetailVie
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        context["booking_list"] = get_cached_booking_list().filter(user=self.object).order_by("date_field",
-                                                                                              "time_start")
+        context["booking_list"] = get_cached_user_bookings(self.object)
         user = self.request.user
         pk = self.kwargs.get("pk")
 
@@ -155,38 +147,25 @@ def password_recovery(request):
         message = f"Привет, держи новый сложный 12-ти символьный пароль, который ты тоже забудешь: {password} . \
                     Если вы не запрашивали восстановление пароля, просто игнорируйте это сообщение."
 
-        # send_mail(
-        #     subject="Восстановление пароля",
-        #     message=message,
-        #     from_email=EMAIL_HOST_USER,
-        #     recipient_list=[email]
-        # )
-        subject = "Восстановление пароля",
-        # message = f"Привет, перейди по ссылке для подтверждения почты {url} ",
+        subject = "Восстановление пароля"
 
-        email_list = []
-        email_list.append(email)
-
-        celery_send_mail.delay(subject, message, email_list)
-
-        user.set_password(password)
-        user.save()
+        # письмо с паролем уходит, только если новый пароль сохранен
+        with transaction.atomic():
+            user.set_password(password)
+            user.save()
+            queue_mail(subject, message, [email])
         return redirect(reverse("users:login"))
 
     return render(request, "users/password_recovery.html")
 
 
 class CacheClearedLogoutView(LogoutView):
-
-    def post(self, request, *args, **kwargs):
-        """Logout may be done via POST."""
-        cache_clear()
-        return super().post(request, *args, **kwargs)
+    # кеш пользователя сбрасывается сигналом user_logged_out (users/signals.py) - сменой версии его
+    # пространства имен; общий кеш остальных пользователей больше не очищается
+    pass
 
 
 def cache_clear_when_login(request):
-    # Ваш код обработки запроса
-    # ...
-    # Очистка кэша страницы
-    cache_clear()
+    # страницы в кеше зависят от cookie сессии, а при входе ключ сессии меняется, поэтому глобальная очистка не нужна;
+    # данные пользователя сбрасываются сигналом user_logged_in
     return redirect(reverse("users:login"))